@@ -0,0 +1,80 @@
+"""
+Remembers what each discovery source last reported to the server.
+
+Devices whose ip, hostname and vendor haven't changed since the last successful upload
+only need their last_seen refreshed, so they are sent as a compact list of MACs.
+Every device is still sent in full once in a while, in case the server lost it.
+"""
+
+import threading
+import time
+
+
+def _fingerprint(device):
+    return device.get('ip'), device.get('hostname'), device.get('vendor')
+
+
+class DeviceDeltaTracker:
+    def __init__(self, full_resend_interval_seconds):
+        """
+        Args:
+            full_resend_interval_seconds: Maximum time an unchanged device goes without a full upload
+        """
+        self.full_resend_interval_seconds = full_resend_interval_seconds
+        self._reported = {}
+        self._lock = threading.Lock()
+
+    def split(self, devices, now=None):
+        """
+        Returns (changed, unchanged_macs): the device dicts that need a full upload and
+        the MACs of devices the server already has up to date.
+        """
+        now = time.time() if now is None else now
+        changed = []
+        unchanged_macs = []
+        with self._lock:
+            for device in devices:
+                reported = self._reported.get(device.get('mac'))
+                if (reported is None or reported[0] != _fingerprint(device) or
+                        now - reported[1] >= self.full_resend_interval_seconds):
+                    changed.append(device)
+                else:
+                    unchanged_macs.append(device['mac'])
+        return changed, unchanged_macs
+
+    def record(self, devices, now=None):
+        """Remember devices the server accepted in full."""
+        now = time.time() if now is None else now
+        with self._lock:
+            for device in devices:
+                self._reported[device.get('mac')] = (_fingerprint(device), now)
+
+    def forget(self, macs):
+        """Drop devices so they are sent in full next time."""
+        with self._lock:
+            for mac in macs:
+                self._reported.pop(mac, None)
+
+
+class ChurnTracker:
+    """
+    Counts devices that a discovery source sees for the first time, or with a different IP
+    than the last time it saw them.
+    """
+
+    def __init__(self):
+        self._ips = {}
+        self._lock = threading.Lock()
+
+    def observe(self, source, device):
+        """Remember the device's IP. Returns True if the device is new to the source or its IP changed."""
+        key = (source, device.get('mac'))
+        ip = device.get('ip')
+        with self._lock:
+            changed = key not in self._ips or self._ips[key] != ip
+            self._ips[key] = ip
+        return changed
+
+    def count(self, source, devices):
+        """Returns how many of the devices are new to the source or changed IP."""
+        return sum(1 for device in devices if self.observe(source, device))
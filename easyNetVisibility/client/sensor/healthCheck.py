@@ -1,6 +1,7 @@
 import logging
 
 import network_utils
+import sensor_metrics
 import server_api
 
 
@@ -8,7 +9,12 @@ def report_health():
     logger = logging.getLogger('EasyNetVisibility')
     logger.info('Reporting health')
 
+    metrics = sensor_metrics.snapshot()
+    metrics['process'] = sensor_metrics.process_stats()
+    metrics['spool_depth'] = server_api.spool_depth()
+
     health_info = {'mac': network_utils.get_mac(),
-                   'hostname': network_utils.get_hostname()}
+                   'hostname': network_utils.get_hostname(),
+                   'metrics': metrics}
 
     server_api.report_sensor_health(health_info)
@@ -1,4 +1,5 @@
 import fcntl
+import ipaddress
 import logging
 import re
 import socket
@@ -8,19 +9,108 @@ from scapy.all import get_if_hwaddr
 
 _logger = logging.getLogger('EasyNetVisibility')
 _interface = None
+_extra_interfaces = []
+_networks = []
 _detected_mac = None
 _detected_hostname = None
 
 
-def init(param_interface):
+def init(param_interface, param_networks=None):
+    """
+    Args:
+        param_interface: Interface to scan, or a comma separated list of interfaces. The first
+            one is the sensor's own interface, used for its MAC address
+        param_networks: Comma separated networks to sweep besides the interfaces' subnets,
+            each a CIDR optionally followed by @interface
+    """
     global _interface
-    _interface = param_interface
+    global _extra_interfaces
+    global _networks
+
+    interfaces = [i.strip() for i in (param_interface or '').split(',') if i.strip()]
+    _interface = interfaces[0] if interfaces else None
+    _extra_interfaces = interfaces[1:]
+    _networks = []
+    for entry in (param_networks or '').split(','):
+        if entry.strip():
+            network = _parse_network(entry.strip())
+            if network is not None:
+                _networks.append(network)
+
+
+def _parse_network(entry):
+    """Returns (cidr, interface or None) for a CIDR[@interface] entry, or None if it isn't an IPv4 network."""
+    cidr, _, interface = entry.partition('@')
+    try:
+        network = ipaddress.ip_network(cidr.strip(), strict=False)
+    except ValueError:
+        _logger.error(f"Ignoring invalid network '{entry}'")
+        return None
+    if network.version != 4:
+        _logger.error(f"Ignoring network '{entry}', only IPv4 networks can be swept")
+        return None
+    return str(network), interface.strip() or None
 
 
 def get_interface():
     return _interface
 
 
+def get_interfaces():
+    """Returns every interface to sweep, starting with the sensor's own interface."""
+    interface = get_interface()
+    return ([interface] if interface else []) + _extra_interfaces
+
+
+def route_interface(network):
+    """Returns the interface the kernel routes the network through, by longest prefix match, or None."""
+    address = int(ipaddress.ip_network(network).network_address)
+    best = None
+    try:
+        with open("/proc/net/route") as route_file:
+            next(route_file, None)
+            for line in route_file:
+                fields = line.strip().split()
+                if len(fields) < 8:
+                    continue
+                destination = int.from_bytes(struct.pack("<L", int(fields[1], 16)), 'big')
+                mask = int.from_bytes(struct.pack("<L", int(fields[7], 16)), 'big')
+                if address & mask == destination and (best is None or mask > best[0]):
+                    best = (mask, fields[0])
+    except OSError:
+        return None
+    return best[1] if best else None
+
+
+def get_sweep_targets():
+    """
+    Returns the (network, interface) pairs to ping sweep: the subnet of every interface that has
+    an IPv4 address, then the configured networks not already covered. A configured network
+    without an interface is tagged with the interface the kernel routes it through.
+    """
+    targets = []
+    covered = set()
+
+    def add(network, interface):
+        key = ipaddress.ip_network(network, strict=False)
+        if key not in covered:
+            covered.add(key)
+            targets.append((network, interface))
+
+    for interface in get_interfaces():
+        try:
+            ip = get_ip(interface)
+            netmask = get_netmask(interface)
+        except OSError as e:
+            _logger.warning(f"Not sweeping interface {interface}, it has no IPv4 address: {e}")
+            continue
+        if ip is not None and netmask is not None:
+            add('%s/%s' % (ip, str(netmask)), interface)
+    for network, interface in _networks:
+        add(network, interface or route_interface(network))
+    return targets
+
+
 def get_system_dfgw():
     with open("/proc/net/route") as route_file:
         for line in route_file:
@@ -30,22 +120,24 @@ def get_system_dfgw():
             return socket.inet_ntoa(struct.pack("<L", int(fields[2], 16)))
 
 
-def get_ip():
-    if _interface is None:
+def get_ip(interface=None):
+    interface = interface or _interface
+    if interface is None:
         _logger.warning("Interface is not set. Cannot get IP address.")
         return None
     s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
     return socket.inet_ntoa(
-        fcntl.ioctl(s.fileno(), 0x8915, struct.pack('256s', _interface[:15].encode('utf-8')))[20:24])
+        fcntl.ioctl(s.fileno(), 0x8915, struct.pack('256s', interface[:15].encode('utf-8')))[20:24])
 
 
-def get_netmask():
-    if _interface is None:
+def get_netmask(interface=None):
+    interface = interface or _interface
+    if interface is None:
         _logger.warning("Interface is not set. Cannot get netmask.")
         return None
     s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
     netmask = socket.inet_ntoa(
-        fcntl.ioctl(s.fileno(), 0x891b, struct.pack('256s', _interface[:15].encode('utf-8')))[20:24])
+        fcntl.ioctl(s.fileno(), 0x891b, struct.pack('256s', interface[:15].encode('utf-8')))[20:24])
     netmask_bits = sum([bin(int(x)).count('1') for x in netmask.split('.')])
     return netmask_bits
 
@@ -1,92 +1,257 @@
 import logging
-import os
+import queue
+import subprocess
+import threading
 import xml.etree.ElementTree as ElementTree
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 import network_utils
+import scan_state
 
 _found_devices = {}
+_ping_sweep_concurrency = 4
+_ping_sweep_max_rate = 0
+_port_scan_concurrency = 4
+_port_scan_host_timeout = 900
+_incremental_scan = True
+_full_scan_interval = 24 * 60 * 60
+_rotating_slices = 8
+_state_file = '/opt/easy_net_visibility/client/port_scan_state.json'
 _logger = logging.getLogger('EasyNetVisibility')
 
 
-def ping_sweep():
-    global _found_devices
-    result_devices = []
+class _ProcessGroup:
+    """The nmap processes of one scan, so they can all be stopped when the scan is abandoned."""
+
+    def __init__(self):
+        self._processes = set()
+        self._stopped = False
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            self._stopped = False
+
+    def add(self, process):
+        with self._lock:
+            if not self._stopped:
+                self._processes.add(process)
+                return
+        # Started after the scan was stopped
+        process.terminate()
+
+    def discard(self, process):
+        with self._lock:
+            self._processes.discard(process)
+
+    def stop(self):
+        """Terminate the running processes, and any process added until the next start()."""
+        with self._lock:
+            self._stopped = True
+            processes = list(self._processes)
+            self._processes.clear()
+        for process in processes:
+            if process.poll() is None:
+                process.terminate()
+
+
+_port_scan_processes = _ProcessGroup()
+_ping_sweep_processes = _ProcessGroup()
+
+
+def _run_nmap(args, process_group=None):
+    """
+    Run nmap with its XML report streamed on stdout.
+    Yields each <host> element as soon as nmap finishes it, then discards it to keep memory flat.
+    """
+    process = subprocess.Popen(['nmap'] + args + ['-oX', '-'], stdout=subprocess.PIPE)
+    if process_group is not None:
+        process_group.add(process)
+    try:
+        root = None
+        for event, elem in ElementTree.iterparse(process.stdout, events=('start', 'end')):
+            if root is None:
+                root = elem
+            elif event == 'end' and elem.tag == 'host':
+                yield elem
+                # Drop the finished host from the document tree
+                root.clear()
+    finally:
+        if process.poll() is None:
+            process.kill()
+        process.stdout.close()
+        process.wait()
+        if process_group is not None:
+            process_group.discard(process)
+
+
+def _parse_ping_host(host):
+    """Returns the device dict for a ping sweep <host> element, or None for the local interface."""
+    ip_address = ""
+    mac_address = ""
+    hostname = ""
+    mac_vendor = ""
+    for ip in host.findall("./address"):
+        address_type = ip.get('addrtype')
+        if address_type == "mac":
+            mac_address = ip.get('addr')
+            mac_address = mac_address.rstrip()
+            mac_address = network_utils.convert_mac(mac_address)
+            mac_vendor = ip.get('vendor')
+            if mac_vendor is None:
+                mac_vendor = 'Unknown'
+            mac_vendor = mac_vendor.rstrip()
+        if address_type == "ipv4":
+            ip_address = ip.get('addr')
+            ip_address = ip_address.rstrip()
+    for hostname in host.findall("./hostnames/hostname"):
+        hostname = hostname.get('name')
+        hostname = hostname.rstrip()
+    # If mac address is missing, it's the local interface
+    if len(mac_address) == 0:
+        return None
+    if len(hostname) < 1:
+        hostname = "%s (%s)" % (ip_address, mac_address)
+
+    _logger.info('found device:' + str((hostname, str(ip_address), mac_address, mac_vendor)))
+    return {'hostname': hostname, 'ip': str(ip_address), 'mac': mac_address, 'vendor': mac_vendor}
 
-    _logger.info('Beginning Ping Sweep')
-    if not os.path.exists('/opt/easy_net_visibility/client/nmap_scans'):
-        os.makedirs('/opt/easy_net_visibility/client/nmap_scans')
-    ip = network_utils.get_ip()
-    netmask = network_utils.get_netmask()
 
-    os.popen("nmap -sn %s/%s -e %s -oX /opt/easy_net_visibility/client/nmap_scans/pingSweep.xml" % (
-        ip, str(netmask), network_utils.get_interface())).read()
-    result_file = '/opt/easy_net_visibility/client/nmap_scans/pingSweep.xml'
+def init_ping_sweep(concurrency, max_rate):
+    """
+    Args:
+        concurrency: Number of networks swept at the same time
+        max_rate: Probes per second for all concurrent sweeps together, split evenly between them (0 = no limit)
+    """
+    global _ping_sweep_concurrency
+    global _ping_sweep_max_rate
+    _ping_sweep_concurrency = max(1, int(concurrency))
+    _ping_sweep_max_rate = max(0, int(max_rate))
+    _logger.info(f"Ping sweep set for {_ping_sweep_concurrency} concurrent networks, "
+                 f"max rate {_ping_sweep_max_rate or 'unlimited'}")
+
+
+def _sweep_network(network, interface, max_rate, output):
+    """
+    Ping sweep one network, putting each device found, tagged with the interface, on the output queue.
+    Returns the error if the sweep failed, the devices found before the failure are still put on the queue.
+    """
+    args = ['-sn', network]
+    if interface:
+        args += ['-e', interface]
+    if max_rate:
+        args += ['--max-rate', str(max_rate)]
+    count = 0
     try:
-        tree = ElementTree.parse(result_file)
-        root = tree.getroot()
-        # Parse the nmap.xml file
-        for host in root.findall("./host"):
-            ip_address = ""
-            mac_address = ""
-            hostname = ""
-            # host_state = ""
-            mac_vendor = ""
-            # for status in host.findall("./status"):
-            #     host_state = status.get('state')
-            #     host_state = host_state.rstrip()
-            for ip in host.findall("./address"):
-                address_type = ip.get('addrtype')
-                if address_type == "mac":
-                    mac_address = ip.get('addr')
-                    mac_address = mac_address.rstrip()
-                    mac_address = network_utils.convert_mac(mac_address)
-                    mac_vendor = ip.get('vendor')
-                    if mac_vendor is None:
-                        mac_vendor = 'Unknown'
-                    mac_vendor = mac_vendor.rstrip()
-                if address_type == "ipv4":
-                    ip_address = ip.get('addr')
-                    ip_address = ip_address.rstrip()
-            for hostname in host.findall("./hostnames/hostname"):
-                hostname = hostname.get('name')
-                hostname = hostname.rstrip()
-            # If mac address is missing, it's the local interface
-            if len(mac_address) > 0:
-                if len(hostname) < 1:
-                    hostname = "%s (%s)" % (ip_address, mac_address)
-
-                _logger.info('found device:' + str((hostname, str(ip_address), mac_address, mac_vendor)))
-
-                result_devices.append(
-                    {'hostname': hostname, 'ip': str(ip_address), 'mac': mac_address, 'vendor': mac_vendor}
-                )
+        for host in _run_nmap(args, _ping_sweep_processes):
+            device = _parse_ping_host(host)
+            if device is not None:
+                device['interface'] = interface
+                output.put(device)
+                count += 1
     except Exception as e:
-        _logger.error("Error with ping sweep XML file: " + str(e))
-    os.system('rm ' + result_file)
+        _logger.error(f"Error with ping sweep of {network} on {interface or 'default route'} "
+                      f"after {count} devices: {e}")
+        return e
+    _logger.info(f"Ping sweep of {network} on {interface or 'default route'} found {count} devices")
+    return None
 
-    _found_devices = {d['mac']: d['ip'] for d in result_devices}
 
-    return result_devices
+def iter_ping_sweep():
+    """
+    Ping sweep the subnets of the configured interfaces and the configured networks, several at a
+    time, yielding each device while the sweeps are still running. A device seen on more than one
+    network is yielded once. The devices found are remembered for the next port scan once the sweep ends.
+    Raises once every network was swept if the sweep of any of them failed, naming each failed network.
+    If the caller stops early, pending sweeps are cancelled and running nmap processes terminated.
+    """
+    global _found_devices
+    found_devices = {}
 
+    targets = network_utils.get_sweep_targets()
+    _logger.info(f"Beginning Ping Sweep of {', '.join(network for network, _ in targets) or 'no networks'}")
+    if not targets:
+        _found_devices = found_devices
+        return
 
-def port_scan():
-    _logger.info("Beginning port scan")
-    if not os.path.exists('/opt/easy_net_visibility/client/nmap_scans'):
-        os.makedirs('/opt/easy_net_visibility/client/nmap_scans')
-
-    for device_mac, device_ip in _found_devices.items():
-        result_ports = []
-        _logger.info(f"Port scanning {device_ip}")
-        result_file = "/opt/easy_net_visibility/client/nmap_scans/portScan_%s_%s.xml" % (
-            datetime.now().strftime('%Y-%m-%d_%H-%M'), device_ip)
-
-        try:
-            os.popen("nmap -sV -oX %s %s" % (result_file, device_ip)).read()
-            tree = ElementTree.parse(result_file)
-            root = tree.getroot()
-            # Parse the portScan.xml file
-            for port in root.findall("./host/ports/port"):
+    workers = min(_ping_sweep_concurrency, len(targets))
+    # The rate budget is shared by the sweeps running at the same time
+    max_rate = max(1, _ping_sweep_max_rate // workers) if _ping_sweep_max_rate else 0
+    output = queue.Queue()
+    finished = object()
+    _ping_sweep_processes.start()
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='ping-sweep')
+    try:
+        futures = []
+        for network, interface in targets:
+            future = executor.submit(_sweep_network, network, interface, max_rate, output)
+            future.add_done_callback(lambda _: output.put(finished))
+            futures.append(future)
+        remaining = len(targets)
+        while remaining:
+            device = output.get()
+            if device is finished:
+                remaining -= 1
+                continue
+            if device['mac'] in found_devices:
+                continue
+            found_devices[device['mac']] = device['ip']
+            yield device
+
+        failed = [f"{network} on {interface or 'default route'} ({future.result()})"
+                  for (network, interface), future in zip(targets, futures) if future.result() is not None]
+        if failed:
+            raise Exception(f"Ping sweep failed for {len(failed)} of {len(targets)} networks: {', '.join(failed)}")
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+        _ping_sweep_processes.stop()
+        _found_devices = found_devices
+
+
+def ping_sweep():
+    return list(iter_ping_sweep())
+
+
+def init_port_scan(concurrency, host_timeout_seconds, incremental=True, full_scan_interval_hours=24,
+                   rotating_slices=8):
+    global _port_scan_concurrency
+    global _port_scan_host_timeout
+    global _incremental_scan
+    global _full_scan_interval
+    global _rotating_slices
+    _port_scan_concurrency = max(1, int(concurrency))
+    _port_scan_host_timeout = int(host_timeout_seconds)
+    _incremental_scan = incremental
+    _full_scan_interval = int(full_scan_interval_hours * 60 * 60)
+    _rotating_slices = max(1, int(rotating_slices))
+    _logger.info(f"Port scan set for {_port_scan_concurrency} concurrent hosts, "
+                 f"host timeout {_port_scan_host_timeout}s, incremental={_incremental_scan}")
+
+
+def _scan_host(device_mac, device_ip, ports=None):
+    """
+    Service scan one host, either nmap's default ports or only the given port numbers.
+    Returns the list of open ports, or None if the scan failed, hit the host timeout or found
+    the host down, so nothing is recorded for it and it is scanned again next cycle.
+    """
+    result_ports = []
+    completed = False
+    _logger.info(f"Port scanning {device_ip}" + (" (%d ports)" % len(ports) if ports else ""))
+    args = ['-sV']
+    if _port_scan_host_timeout > 0:
+        args += ['--host-timeout', '%ds' % _port_scan_host_timeout]
+    if ports:
+        args += ['-p', scan_state.format_ports(ports)]
+
+    try:
+        for host in _run_nmap(args + [device_ip], _port_scan_processes):
+            if host.get('timedout') == 'true':
+                continue
+            status = host.find("./status")
+            if status is not None and status.get('state') != 'up':
+                continue
+            completed = True
+            for port in host.findall("./ports/port"):
                 port_state = 'filtered'
                 for state in port.findall("./state"):
                     port_state = state.get('state')
@@ -108,7 +273,48 @@ def port_scan():
                                  'product': service_product}
                     _logger.info('found port: ' + str(port_info))
                     result_ports.append(port_info)
-        except Exception as e:
-            _logger.error("Error with port scan: " + str(e))
-        os.system('rm ' + result_file)
-        yield result_ports
+    except Exception as e:
+        _logger.error("Error with port scan: " + str(e))
+        return None
+    if not completed:
+        _logger.warning(f"Port scan of {device_ip} did not complete (host timeout or host down)")
+        return None
+    return result_ports
+
+
+def port_scan():
+    """
+    Scan the devices found by the last ping sweep, several hosts at a time.
+    Yields the open ports of each host as soon as its scan completes.
+    With incremental scanning, stable devices only get a cheap scan of their known ports.
+    If the caller stops early, pending scans are cancelled and running nmap processes terminated.
+    """
+    _logger.info("Beginning port scan")
+    _port_scan_processes.start()
+
+    state = None
+    if _incremental_scan:
+        state = scan_state.PortScanState(_state_file, _full_scan_interval, _rotating_slices)
+        state.load()
+
+    executor = ThreadPoolExecutor(max_workers=_port_scan_concurrency, thread_name_prefix='port-scan')
+    try:
+        futures = {}
+        for device_mac, device_ip in list(_found_devices.items()):
+            ports = state.ports_to_scan(device_mac, device_ip) if state else None
+            futures[executor.submit(_scan_host, device_mac, device_ip, ports)] = (device_mac, device_ip, ports)
+        for future in as_completed(futures):
+            result_ports = future.result()
+            if result_ports is None:
+                yield []
+                continue
+            if state:
+                device_mac, device_ip, ports = futures[future]
+                state.record(device_mac, device_ip, [p['port'] for p in result_ports], full_scan=ports is None)
+            yield result_ports
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+        _port_scan_processes.stop()
+        if state:
+            state.finish_cycle()
+            state.save()
@@ -0,0 +1,115 @@
+"""
+Local record of what the port scanner last saw on each device.
+
+Devices that are new, moved to another IP, changed their open ports or are due for a
+periodic full scan get a full nmap service scan. Stable devices only get their known
+open ports re-checked plus a rotating slice of the well-known port range, so every
+port in that range is still looked at once every few cycles.
+"""
+
+import json
+import logging
+import math
+import os
+import time
+
+_logger = logging.getLogger('EasyNetVisibility')
+
+# Port range that stable devices are swept through, one slice per scan cycle
+_ROTATING_RANGE = (1, 1024)
+
+# Devices not scanned for this long are dropped from the state file
+_STALE_SECONDS = 30 * 24 * 60 * 60
+
+
+def format_ports(ports):
+    """Format port numbers for nmap -p, collapsing consecutive numbers into ranges."""
+    parts = []
+    ports = sorted(set(ports))
+    start = prev = None
+    for port in ports:
+        if start is None:
+            start = prev = port
+        elif port == prev + 1:
+            prev = port
+        else:
+            parts.append(str(start) if start == prev else "%d-%d" % (start, prev))
+            start = prev = port
+    if start is not None:
+        parts.append(str(start) if start == prev else "%d-%d" % (start, prev))
+    return ','.join(parts)
+
+
+class PortScanState:
+    def __init__(self, path, full_scan_interval_seconds, rotating_slices):
+        """
+        Args:
+            path: JSON file the state is persisted to
+            full_scan_interval_seconds: Maximum age of a device's last full scan
+            rotating_slices: Number of slices the rotating port range is split into
+        """
+        self.path = path
+        self.full_scan_interval_seconds = full_scan_interval_seconds
+        self.rotating_slices = max(1, rotating_slices)
+        self.devices = {}
+        self.rotation = 0
+
+    def load(self):
+        try:
+            with open(self.path) as state_file:
+                data = json.load(state_file)
+            self.devices = data.get('devices', {})
+            self.rotation = data.get('rotation', 0) % self.rotating_slices
+        except FileNotFoundError:
+            _logger.info("No port scan state found, all devices will get a full scan")
+        except (OSError, ValueError) as e:
+            _logger.error("Error reading port scan state, starting over: " + str(e))
+            self.devices = {}
+            self.rotation = 0
+
+    def save(self):
+        temp_path = self.path + '.tmp'
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            with open(temp_path, 'w') as state_file:
+                json.dump({'devices': self.devices, 'rotation': self.rotation}, state_file)
+            os.replace(temp_path, self.path)
+        except OSError as e:
+            _logger.error("Error saving port scan state: " + str(e))
+
+    def rotating_slice(self):
+        low, high = _ROTATING_RANGE
+        size = math.ceil((high - low + 1) / self.rotating_slices)
+        start = low + self.rotation * size
+        return range(start, min(start + size - 1, high) + 1)
+
+    def ports_to_scan(self, mac, ip, now=None):
+        """
+        Returns None when the device needs a full scan, otherwise the sorted port numbers to check.
+        """
+        now = time.time() if now is None else now
+        entry = self.devices.get(mac)
+        if (entry is None or entry.get('ip') != ip or entry.get('last_full_scan') is None or
+                now - entry['last_full_scan'] >= self.full_scan_interval_seconds):
+            return None
+        return sorted(set(entry.get('ports', [])) | set(self.rotating_slice()))
+
+    def record(self, mac, ip, open_ports, full_scan, now=None):
+        now = time.time() if now is None else now
+        entry = self.devices.setdefault(mac, {'last_full_scan': None})
+        ports = sorted({int(port) for port in open_ports})
+        if full_scan:
+            entry['last_full_scan'] = now
+        elif ports != entry.get('ports', []):
+            # Open ports changed since the last scan, do a full service scan next time
+            entry['last_full_scan'] = None
+        entry['ip'] = ip
+        entry['ports'] = ports
+        entry['last_scan'] = now
+
+    def finish_cycle(self, now=None):
+        """Advance the rotating slice and drop devices that haven't been scanned for a long time."""
+        now = time.time() if now is None else now
+        self.rotation = (self.rotation + 1) % self.rotating_slices
+        self.devices = {mac: entry for mac, entry in self.devices.items()
+                        if now - entry.get('last_scan', 0) < _STALE_SECONDS}
@@ -0,0 +1,207 @@
+"""
+Runs the sensor's periodic jobs from one place.
+
+Due times are kept in a heap and the scheduler thread starts each job on a worker thread
+when it is due. Every run is pushed back by a random jitter so jobs with the same interval
+don't hit the network and the server at the same moment. A job that is still running when
+it is due again (up to its concurrency limit) is skipped, not queued, so a slow job can't
+stack up runs.
+
+An adaptive job adjusts its interval after every run. A job function returns the number
+of changes it saw, e.g. new devices or IP changes. Changes bring the interval down to the
+minimum, a quiet run or a failure doubles it up to the maximum. A job returning None
+keeps its interval.
+
+stop() is safe to call from a signal handler: it only sets a flag, which the scheduler
+thread checks at least once a second.
+"""
+
+import heapq
+import itertools
+import logging
+import random
+import threading
+import time
+
+_POLL_SECONDS = 1
+
+logger = logging.getLogger('EasyNetVisibility')
+
+
+class Job:
+    def __init__(self, name, func, interval_seconds, jitter_seconds=0, concurrency=1, initial_delay_seconds=0,
+                 min_interval_seconds=None, max_interval_seconds=None):
+        """
+        Args:
+            name: Job name, used in logs
+            func: Callable doing one run of the job, returning the number of changes it saw or None
+            interval_seconds: Seconds between the starts of two runs
+            jitter_seconds: Each run is delayed by a random 0 to jitter_seconds
+            concurrency: Runs of this job allowed at the same time, a due run beyond it is skipped
+            initial_delay_seconds: Seconds before the first run
+            min_interval_seconds: With max_interval_seconds, makes the job adaptive: the interval
+                after a run that saw changes
+            max_interval_seconds: Upper bound of the interval of an adaptive job
+        """
+        if interval_seconds <= 0:
+            raise ValueError(f"Job {name}: interval must be positive")
+        if concurrency < 1:
+            raise ValueError(f"Job {name}: concurrency must be at least 1")
+        self.adaptive = min_interval_seconds is not None and max_interval_seconds is not None
+        if self.adaptive and not 0 < min_interval_seconds <= interval_seconds <= max_interval_seconds:
+            raise ValueError(f"Job {name}: the interval must be between the minimum and the maximum interval")
+        self.name = name
+        self.func = func
+        self.interval_seconds = interval_seconds
+        self.jitter_seconds = max(0, jitter_seconds)
+        self.concurrency = concurrency
+        self.initial_delay_seconds = max(0, initial_delay_seconds)
+        self.min_interval_seconds = min_interval_seconds
+        self.max_interval_seconds = max_interval_seconds
+        self.current_interval_seconds = interval_seconds
+        self.running = 0
+        self.runs = 0
+        self.skipped = 0
+        self.consecutive_failures = 0
+        # Un-jittered due time, advanced by the interval so jitter doesn't accumulate
+        self.base_time = None
+        # Bumped when an adaptive job is rescheduled, older heap entries are then ignored
+        self.generation = 0
+
+    def adapt(self, changes, failed):
+        """Returns the interval after a run that saw changes (an int, or None) or failed."""
+        if failed:
+            self.consecutive_failures += 1
+        else:
+            self.consecutive_failures = 0
+        if not self.adaptive:
+            return self.current_interval_seconds
+        if failed or changes == 0:
+            return min(self.max_interval_seconds, self.current_interval_seconds * 2)
+        if changes is not None:
+            return self.min_interval_seconds
+        return self.current_interval_seconds
+
+
+class Scheduler:
+    def __init__(self, clock=time.monotonic, sleep=time.sleep, jitter=random.uniform):
+        self._clock = clock
+        self._sleep = sleep
+        self._jitter = jitter
+        self._jobs = {}
+        self._heap = []
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+        self._threads = set()
+        self._stopping = False
+
+    def add_job(self, name, func, interval_seconds, jitter_seconds=0, concurrency=1, initial_delay_seconds=0,
+                min_interval_seconds=None, max_interval_seconds=None):
+        if name in self._jobs:
+            raise ValueError(f"Job {name} is already scheduled")
+        job = Job(name, func, interval_seconds, jitter_seconds, concurrency, initial_delay_seconds,
+                  min_interval_seconds, max_interval_seconds)
+        with self._lock:
+            self._jobs[name] = job
+            job.base_time = self._clock() + job.initial_delay_seconds
+            self._push(job)
+        if job.adaptive:
+            logger.info(f"Scheduled {name} every {min_interval_seconds}-{max_interval_seconds}s, starting at "
+                        f"{interval_seconds}s (jitter {job.jitter_seconds}s, concurrency {concurrency})")
+        else:
+            logger.info(f"Scheduled {name} every {interval_seconds}s (jitter {job.jitter_seconds}s, "
+                        f"concurrency {concurrency})")
+        return job
+
+    def jobs(self):
+        return list(self._jobs.values())
+
+    def _push(self, job):
+        """Queue the job's next run at its base time plus jitter. Call with the lock held."""
+        due = job.base_time + (self._jitter(0, job.jitter_seconds) if job.jitter_seconds else 0)
+        heapq.heappush(self._heap, (due, next(self._sequence), job.name, job.generation))
+
+    def run_pending(self):
+        """Start every job that is due. Returns the seconds until the next job is due."""
+        now = self._clock()
+        due_runs = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now and not self._stopping:
+                _, _, name, generation = heapq.heappop(self._heap)
+                job = self._jobs[name]
+                if generation != job.generation:
+                    continue
+                due_runs.append((job, job.base_time))
+                job.base_time += job.current_interval_seconds
+                if job.base_time < now:
+                    # We fell behind (the machine was suspended, or a clock jump), don't replay missed runs
+                    job.base_time = now + job.current_interval_seconds
+                self._push(job)
+            next_due = self._heap[0][0] if self._heap else None
+
+        for job, run_base_time in due_runs:
+            self._start(job, run_base_time)
+        if next_due is None:
+            return None
+        return max(0, next_due - now)
+
+    def _start(self, job, run_base_time):
+        with self._lock:
+            if job.running >= job.concurrency:
+                job.skipped += 1
+                logger.warning(f"Skipping {job.name}: the previous run is still going")
+                return
+            job.running += 1
+            job.runs += 1
+            thread = threading.Thread(target=self._run_job, args=(job, run_base_time), name=f"job-{job.name}",
+                                      daemon=True)
+            self._threads.add(thread)
+        thread.start()
+
+    def _run_job(self, job, run_base_time):
+        changes = None
+        failed = False
+        try:
+            changes = job.func()
+        except Exception as e:
+            failed = True
+            logger.exception(f"Job {job.name} failed: {e}")
+        finally:
+            with self._lock:
+                job.running -= 1
+                self._threads.discard(threading.current_thread())
+                self._adapt(job, run_base_time, changes, failed)
+
+    def _adapt(self, job, run_base_time, changes, failed):
+        """Reschedule an adaptive job whose interval changed. Call with the lock held."""
+        interval = job.adapt(changes, failed)
+        if interval == job.current_interval_seconds:
+            return
+        reason = 'failed' if failed else 'changes seen' if changes else 'quiet'
+        logger.info(f"{job.name}: interval {job.current_interval_seconds:g}s -> {interval:g}s ({reason})")
+        job.current_interval_seconds = interval
+        job.base_time = run_base_time + interval
+        job.generation += 1
+        self._push(job)
+
+    def run(self):
+        """Run jobs until stop() is called."""
+        while not self._stopping:
+            delay = self.run_pending()
+            if self._stopping:
+                break
+            self._sleep(_POLL_SECONDS if delay is None else min(delay, _POLL_SECONDS))
+
+    def stop(self):
+        """Stop starting new runs. Running jobs are left to finish, see wait_for_jobs()."""
+        self._stopping = True
+
+    def wait_for_jobs(self, timeout):
+        """Wait up to timeout seconds for running jobs to finish. Returns True if none is left running."""
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            threads = list(self._threads)
+        for thread in threads:
+            thread.join(timeout=max(0, deadline - time.monotonic()))
+        with self._lock:
+            return not any(thread.is_alive() for thread in self._threads)
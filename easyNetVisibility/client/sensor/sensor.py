@@ -1,13 +1,15 @@
 import configparser
 import logging
-import threading
-from time import sleep
+import signal
 
+import device_delta
 import healthCheck
 import logs
 import network_utils
 import nmap
+import sensor_metrics
 import server_api
+from scheduler import Scheduler
 
 # Router integrations are optional
 fortigate = None
@@ -46,115 +48,129 @@ except ImportError:
 logs.setup()
 _logger = logging.getLogger('EasyNetVisibility')
 
+# Devices each discovery source saw last time, to tell a changing network from a quiet one
+_churn = device_delta.ChurnTracker()
+
+
+def _collected(devices, into):
+    """Yield the devices, appending each to the into list."""
+    for device in devices:
+        into.append(device)
+        yield device
+
+
+def ping_sweep():
+    """Returns the number of devices that are new or changed IP, for the adaptive cadence."""
+    devices = []
+    with sensor_metrics.cycle('ping_sweep') as cycle:
+        # Devices are uploaded in chunks while the sweep is still running
+        count = server_api.add_devices_progressively('ping_sweep', _collected(nmap.iter_ping_sweep(), devices))
+        changes = _churn.count('ping_sweep', devices)
+        cycle.found(count)
+        cycle.changed(changes)
+    _logger.info(f"Detected {count} devices, {changes} new or changed")
+    return changes
+
+
+def port_scan():
+    with sensor_metrics.cycle('port_scan') as cycle:
+        total_ports = 0
+        for ports in nmap.port_scan():
+            _logger.info(f"Detected {len(ports)} open ports")
+            total_ports += len(ports)
+            if len(ports) > 0:
+                try:
+                    server_api.add_ports(ports)
+                except Exception as e:
+                    # The ports are spooled for a later upload, carry on with the other hosts
+                    _logger.error(f"Error uploading {len(ports)} open ports: {e}")
+        cycle.found(total_ports)
 
-def start_ping_sweep():
-    while 1:
-        try:
-            devices = nmap.ping_sweep()
-            _logger.info(f"Detected {len(devices)} devices")
-            if len(devices) > 0:
-                server_api.add_devices(devices)
-        except Exception as e:
-            _logger.exception("Ping sweep error: " + str(e))
-
-        sleep(60 * 10)
 
+def _router_scan(name, display_name, router_module):
+    """
+    Discover devices through a router integration and report them.
+    Returns the number of devices that are new or changed IP, for the adaptive cadence.
+    """
+    if not router_module:
+        _logger.warning(f"{display_name} module not available")
+        return None
+    with sensor_metrics.cycle(name) as cycle:
+        devices = router_module.discover_devices()
+        changes = _churn.count(name, devices)
+        cycle.found(len(devices))
+        cycle.changed(changes)
+        _logger.info(f"{display_name} detected {len(devices)} devices, {changes} new or changed")
+        if len(devices) > 0:
+            server_api.report_devices(name, devices)
+    return changes
+
+
+def fortigate_scan():
+    """Scan Fortigate firewall for devices."""
+    return _router_scan('fortigate', 'Fortigate', fortigate)
 
-def start_port_scan():
-    while 1:
-        # Port Scan Every Hour, sleeping first to let first ping sweep finish
-        sleep(60)
-        try:
-            for ports in nmap.port_scan():
-                _logger.info(f"Detected {len(ports)} open ports")
-                if len(ports) > 0:
-                    server_api.add_ports(ports)
-        except Exception as e:
-            _logger.exception("Port scan error: " + str(e))
 
-        sleep(60 * 60)
+def openwrt_scan():
+    """Scan OpenWRT router for devices."""
+    return _router_scan('openwrt', 'OpenWRT', openwrt)
 
 
-def start_fortigate_scan():
-    """Scan Fortigate firewall for devices."""
-    while 1:
-        try:
-            if fortigate:
-                devices = fortigate.discover_devices()
-                _logger.info(f"Fortigate detected {len(devices)} devices")
-                if len(devices) > 0:
-                    server_api.add_devices(devices)
-            else:
-                _logger.warning("Fortigate module not available")
-        except Exception as e:
-            _logger.exception("Fortigate scan error: " + str(e))
-
-        sleep(60 * 10)  # Scan every 10 minutes
-
-
-def start_openwrt_scan():
-    """Scan OpenWRT router for devices."""
-    while 1:
-        try:
-            if openwrt:
-                devices = openwrt.discover_devices()
-                _logger.info(f"OpenWRT detected {len(devices)} devices")
-                if len(devices) > 0:
-                    server_api.add_devices(devices)
-            else:
-                _logger.warning("OpenWRT module not available")
-        except Exception as e:
-            _logger.exception("OpenWRT scan error: " + str(e))
-
-        sleep(60 * 10)  # Scan every 10 minutes
-
-
-def start_ddwrt_scan():
+def ddwrt_scan():
     """Scan DD-WRT router for devices."""
-    while 1:
-        try:
-            if ddwrt:
-                devices = ddwrt.discover_devices()
-                _logger.info(f"DD-WRT detected {len(devices)} devices")
-                if len(devices) > 0:
-                    server_api.add_devices(devices)
-            else:
-                _logger.warning("DD-WRT module not available")
-        except Exception as e:
-            _logger.exception("DD-WRT scan error: " + str(e))
-
-        sleep(60 * 10)  # Scan every 10 minutes
-
-
-def start_generic_router_scan():
+    return _router_scan('ddwrt', 'DD-WRT', ddwrt)
+
+
+def generic_router_scan():
     """Scan generic router for devices."""
-    while 1:
-        try:
-            if router_generic:
-                devices = router_generic.discover_devices()
-                _logger.info(f"Generic Router detected {len(devices)} devices")
-                if len(devices) > 0:
-                    server_api.add_devices(devices)
-            else:
-                _logger.warning("Generic router module not available")
-        except Exception as e:
-            _logger.exception("Generic Router scan error: " + str(e))
+    return _router_scan('router_generic', 'Generic Router', router_generic)
+
+
+def health_check():
+    with sensor_metrics.cycle('health_check'):
+        healthCheck.report_health()
 
-        sleep(60 * 10)  # Scan every 10 minutes
 
+def spool_replay():
+    server_api.replay_spool()
 
-def start_health_check():
-    while 1:
-        try:
-            # report health
-            healthCheck.report_health()
-        except Exception as e:
-            _logger.exception("Health check error: " + str(e))
 
-        sleep(60 * 5)
+# Job name: (config key prefix, interval, jitter, initial delay) in seconds.
+# The port scan waits a minute to let the first ping sweep finish.
+_JOB_DEFAULTS = {
+    'health_check': ('healthCheck', 60 * 5, 30, 0),
+    'spool_replay': ('spoolReplay', 60, 10, 60),
+    'ping_sweep': ('pingSweep', 60 * 10, 60, 0),
+    'port_scan': ('portScan', 60 * 60, 60 * 5, 60),
+    'fortigate': ('fortigate', 60 * 10, 60, 0),
+    'openwrt': ('openwrt', 60 * 10, 60, 0),
+    'ddwrt': ('ddwrt', 60 * 10, 60, 0),
+    'router_generic': ('routerGeneric', 60 * 10, 60, 0),
+}
 
 
-def _initialize_router_integration(config, section_name, router_module, scan_function,
+def _schedule(scheduler, config, name, func):
+    """
+    Add a job to the scheduler with its interval, jitter and concurrency from the [Scheduler] section.
+    An adaptive job runs every <job>MinInterval to <job>MaxInterval seconds, by default a quarter
+    and four times its interval.
+    """
+    prefix, interval, jitter, initial_delay = _JOB_DEFAULTS[name]
+    interval = config.getfloat('Scheduler', prefix + 'Interval', fallback=interval)
+    min_interval = max_interval = None
+    if config.getboolean('Scheduler', prefix + 'Adaptive', fallback=False):
+        min_interval = config.getfloat('Scheduler', prefix + 'MinInterval', fallback=interval / 4)
+        max_interval = config.getfloat('Scheduler', prefix + 'MaxInterval', fallback=interval * 4)
+    scheduler.add_job(name, func,
+                      interval_seconds=interval,
+                      jitter_seconds=config.getfloat('Scheduler', prefix + 'Jitter', fallback=jitter),
+                      concurrency=config.getint('Scheduler', prefix + 'Concurrency', fallback=1),
+                      initial_delay_seconds=initial_delay,
+                      min_interval_seconds=min_interval,
+                      max_interval_seconds=max_interval)
+
+
+def _initialize_router_integration(config, section_name, router_module,
                                    auth_type='username_password', router_display_name=None):
     """
     Helper function to initialize router integrations with consistent logic.
@@ -163,12 +179,11 @@ def _initialize_router_integration(config, section_name, router_module, scan_fun
         config: ConfigParser object with configuration
         section_name: Name of the config section (e.g., 'OpenWRT', 'DDWRT')
         router_module: The imported router module (e.g., openwrt, ddwrt)
-        scan_function: The scan function to run in a thread
         auth_type: 'api_key' for Fortigate, 'username_password' for others
         router_display_name: Display name for logging (defaults to section_name)
 
     Returns:
-        bool: True if initialization succeeded, False otherwise
+        bool: True if initialization succeeded and the scan should be scheduled, False otherwise
     """
     if router_display_name is None:
         router_display_name = section_name
@@ -223,10 +238,6 @@ def _initialize_router_integration(config, section_name, router_module, scan_fun
             password = config.get(section_name, 'password')
             router_module.init(host, username, password, validate_ssl)
 
-        # Start scanning thread
-        scan_thread = threading.Thread(target=scan_function)
-        scan_thread.start()
-
         _logger.info(f"{router_display_name} integration initialized successfully")
         return True
 
@@ -261,24 +272,63 @@ def run():
         call_timeout = 10000
 
     server_api.init(server_url, server_username, server_password, validate_server_identity, call_timeout)
+    sensor_metrics.init(config.get('General', 'statusFile',
+                                   fallback='/opt/easy_net_visibility/client/sensor_status.json'))
+
+    server_api.init_compression(config.get('ServerAPI', 'compression', fallback='gzip'))
+    server_api.init_delta_sync(config.getboolean('ServerAPI', 'deltaSync', fallback=True),
+                               config.getfloat('ServerAPI', 'fullResendHours', fallback=6))
+    if config.getboolean('ServerAPI', 'offlineSpool', fallback=True):
+        server_api.init_spool('/opt/easy_net_visibility/client/upload_spool.db',
+                              config.getint('ServerAPI', 'spoolMaxEntries', fallback=50000))
+    server_api.init_upload(config.getint('PingSweep', 'uploadChunkSize', fallback=100),
+                           config.getfloat('PingSweep', 'uploadMaxDelaySeconds', fallback=5))
 
     interface = config.get('General', 'interface')
-    network_utils.init(interface)
+    network_utils.init(interface, config.get('General', 'networks', fallback=''))
+    nmap.init_ping_sweep(config.getint('PingSweep', 'concurrency', fallback=4),
+                         config.getint('PingSweep', 'maxRate', fallback=0))
+
+    nmap.init_port_scan(config.getint('PortScan', 'concurrency', fallback=4),
+                        config.getint('PortScan', 'hostTimeout', fallback=900),
+                        config.getboolean('PortScan', 'incremental', fallback=True),
+                        config.getfloat('PortScan', 'fullScanIntervalHours', fallback=24),
+                        config.getint('PortScan', 'rotatingSlices', fallback=8))
+
+    scheduler = Scheduler()
+    _schedule(scheduler, config, 'health_check', health_check)
+    _schedule(scheduler, config, 'ping_sweep', ping_sweep)
+    _schedule(scheduler, config, 'port_scan', port_scan)
+    if server_api.spool_depth() is not None:
+        _schedule(scheduler, config, 'spool_replay', spool_replay)
 
     # Initialize router integrations using helper function
-    _initialize_router_integration(config, 'Fortigate', fortigate, start_fortigate_scan, auth_type='api_key')
-    _initialize_router_integration(config, 'OpenWRT', openwrt, start_openwrt_scan, auth_type='username_password')
-    _initialize_router_integration(config, 'DDWRT', ddwrt, start_ddwrt_scan, auth_type='username_password',
-                                   router_display_name='DD-WRT')
-    _initialize_router_integration(config, 'GenericRouter', router_generic, start_generic_router_scan,
-                                   auth_type='username_password', router_display_name='Generic Router')
-
-    health_check_thread = threading.Thread(target=start_health_check)
-    health_check_thread.start()
-    ping_sweep_thread = threading.Thread(target=start_ping_sweep)
-    ping_sweep_thread.start()
-    port_scan_thread = threading.Thread(target=start_port_scan)
-    port_scan_thread.start()
+    if _initialize_router_integration(config, 'Fortigate', fortigate, auth_type='api_key'):
+        _schedule(scheduler, config, 'fortigate', fortigate_scan)
+    if _initialize_router_integration(config, 'OpenWRT', openwrt, auth_type='username_password'):
+        _schedule(scheduler, config, 'openwrt', openwrt_scan)
+    if _initialize_router_integration(config, 'DDWRT', ddwrt, auth_type='username_password',
+                                      router_display_name='DD-WRT'):
+        _schedule(scheduler, config, 'ddwrt', ddwrt_scan)
+    if _initialize_router_integration(config, 'GenericRouter', router_generic, auth_type='username_password',
+                                      router_display_name='Generic Router'):
+        _schedule(scheduler, config, 'router_generic', generic_router_scan)
+
+    def handle_sigterm(signum, frame):
+        _logger.info('SIGTERM received, shutting down')
+        scheduler.stop()
+
+    signal.signal(signal.SIGTERM, handle_sigterm)
+    try:
+        scheduler.run()
+    except KeyboardInterrupt:
+        scheduler.stop()
+
+    shutdown_timeout = config.getfloat('Scheduler', 'shutdownTimeout', fallback=30)
+    if not scheduler.wait_for_jobs(shutdown_timeout):
+        _logger.warning(f"Jobs still running after {shutdown_timeout}s, exiting anyway")
+    sensor_metrics.write_status_file()
+    _logger.info('EasyNetVisibility Sensor stopped')
 
 
 if __name__ == '__main__':
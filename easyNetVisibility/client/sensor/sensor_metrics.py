@@ -0,0 +1,179 @@
+"""
+Timing and counters of the sensor's loops.
+
+Every loop iteration runs inside cycle(), which records its duration, what it found and
+whether it failed. Uploads made by post() are attributed to the loop running on the
+calling thread. The numbers are written to a JSON status file after every cycle and
+sent to the server with each health report.
+"""
+
+import contextlib
+import datetime
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+_status_file = None
+_started_at = None
+_loops = {}
+_lock = threading.Lock()
+_current = threading.local()
+
+logger = logging.getLogger('EasyNetVisibility')
+
+
+def init(param_status_file):
+    global _status_file
+    global _started_at
+    global _loops
+
+    _status_file = param_status_file
+    _started_at = _now_iso()
+    with _lock:
+        _loops = {}
+    if _status_file:
+        logger.info("Sensor status file: " + _status_file)
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(_status_file)), exist_ok=True)
+        except OSError as e:
+            logger.warning(f"Unable to create the directory of the sensor status file {_status_file}: {e}")
+
+
+def _now_iso():
+    return datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds')
+
+
+def _new_loop_stats():
+    return {
+        'cycles': 0,
+        'failures': 0,
+        'last_started_at': None,
+        'last_duration_seconds': None,
+        'max_duration_seconds': 0.0,
+        'last_found': None,
+        'last_changed': None,
+        'last_error': None,
+        'uploads': 0,
+        'upload_failures': 0,
+        'upload_retries': 0,
+        'upload_seconds_total': 0.0,
+        'bytes_sent': 0,
+    }
+
+
+def _loop_stats(name):
+    """Returns the stats dict of a loop. Call with the lock held."""
+    if name not in _loops:
+        _loops[name] = _new_loop_stats()
+    return _loops[name]
+
+
+class _Cycle:
+    def __init__(self):
+        self.found_count = None
+        self.changed_count = None
+
+    def found(self, count):
+        """Record how many hosts, devices or ports this cycle found."""
+        self.found_count = count
+
+    def changed(self, count):
+        """Record how many devices this cycle saw for the first time or with a new IP."""
+        self.changed_count = count
+
+
+@contextlib.contextmanager
+def cycle(name):
+    """
+    Time one iteration of the named loop. An exception raised inside is recorded as a
+    failure and re-raised.
+    """
+    current = _Cycle()
+    previous_name = getattr(_current, 'name', None)
+    _current.name = name
+    started_at = _now_iso()
+    started = time.monotonic()
+    error = None
+    try:
+        yield current
+    except Exception as e:
+        error = e
+        raise
+    finally:
+        _current.name = previous_name
+        duration = time.monotonic() - started
+        with _lock:
+            stats = _loop_stats(name)
+            stats['cycles'] += 1
+            stats['last_started_at'] = started_at
+            stats['last_duration_seconds'] = round(duration, 3)
+            stats['max_duration_seconds'] = round(max(stats['max_duration_seconds'], duration), 3)
+            stats['last_found'] = current.found_count
+            stats['last_changed'] = current.changed_count
+            stats['last_error'] = f"{type(error).__name__}: {error}" if error is not None else None
+            if error is not None:
+                stats['failures'] += 1
+        write_status_file()
+
+
+def record_upload(bytes_sent, latency_seconds, failed=False):
+    """Record a request to the server, attributed to the loop running on this thread."""
+    with _lock:
+        stats = _loop_stats(getattr(_current, 'name', None) or 'other')
+        stats['uploads'] += 1
+        stats['bytes_sent'] += bytes_sent
+        stats['upload_seconds_total'] += latency_seconds
+        if failed:
+            stats['upload_failures'] += 1
+
+
+def record_retry():
+    """Record a request that had to be sent again."""
+    with _lock:
+        _loop_stats(getattr(_current, 'name', None) or 'other')['upload_retries'] += 1
+
+
+def snapshot():
+    """Returns the stats of every loop, with the average upload latency in milliseconds."""
+    with _lock:
+        loops = {name: dict(stats) for name, stats in _loops.items()}
+    for stats in loops.values():
+        total = stats.pop('upload_seconds_total')
+        stats['avg_upload_ms'] = round(1000 * total / stats['uploads'], 1) if stats['uploads'] else None
+    return {'started_at': _started_at, 'updated_at': _now_iso(), 'loops': loops}
+
+
+def process_stats():
+    """
+    Returns the resident memory of this process in bytes (None where /proc isn't available)
+    and the CPU seconds used so far, including finished child processes such as nmap.
+    """
+    times = os.times()
+    stats = {'rss_bytes': None, 'cpu_seconds': round(times.user + times.system + times.children_user + times.children_system, 2)}
+    try:
+        with open('/proc/self/statm') as f:
+            stats['rss_bytes'] = int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        pass
+    return stats
+
+
+def write_status_file():
+    """Write the snapshot to the status file, replacing it atomically."""
+    if not _status_file:
+        return
+    try:
+        directory = os.path.dirname(os.path.abspath(_status_file))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.sensor_status_')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(snapshot(), f, indent=2)
+            os.replace(tmp_path, _status_file)
+        except Exception:
+            os.unlink(tmp_path)
+            raise
+    except Exception as e:
+        logger.warning(f"Unable to write the sensor status file {_status_file}: {e}")
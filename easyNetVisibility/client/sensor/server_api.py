@@ -1,12 +1,60 @@
+import datetime
+import gzip
+import json
 import logging
+import queue
+import threading
+import time
 
 import requests
+from requests.adapters import HTTPAdapter
+
+import device_delta
+import sensor_metrics
+import upload_spool
+
+# zstd compression is optional
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Keep-alive connections kept per host, sized for the sensor's concurrent scan threads
+_POOL_MAXSIZE = 10
+
+# Request bodies smaller than this are sent uncompressed
+_COMPRESSION_MIN_BYTES = 1024
+
+# Spooled items sent per replay request
+_REPLAY_BATCH_SIZE = 500
+# Wait between replay attempts while the server keeps failing, doubled up to the max
+_REPLAY_MIN_BACKOFF = 30
+_REPLAY_MAX_BACKOFF = 60 * 60
 
 _server_api_address = ''
 _server_username = None
 _server_password = None
 _validate_server_identity = False
 _call_timeout = None
+_upload_chunk_size = 100
+_upload_max_delay = 5
+_compression = 'gzip'
+_delta_sync = False
+_full_resend_interval = 6 * 60 * 60
+_delta_trackers = {}
+_delta_trackers_lock = threading.Lock()
+
+# One long-lived session per sensor process, shared by all threads
+_session = None
+_csrf_token = None
+_session_lock = threading.Lock()
+_csrf_lock = threading.Lock()
+
+# Uploads that failed while the server was unreachable, None when spooling is disabled
+_spool = None
+_replay_backoff = 0
+_next_replay_at = 0
+_replay_lock = threading.Lock()
 
 logger = logging.getLogger('EasyNetVisibility')
 
@@ -18,6 +66,8 @@ def init(param_server_api_address, param_server_username, param_server_password,
     global _server_password
     global _validate_server_identity
     global _call_timeout
+    global _session
+    global _csrf_token
 
     _server_api_address = param_server_api_address
     if param_server_username is not None and len(param_server_username) > 0:
@@ -29,16 +79,96 @@ def init(param_server_api_address, param_server_username, param_server_password,
 
     _validate_server_identity = param_validate_server_identity
     _call_timeout = param_call_timeout
+    _session = None
+    _csrf_token = None
     logger.info("Server connection set for server:" + _server_api_address)
 
 
+def init_upload(param_chunk_size, param_max_delay_seconds):
+    global _upload_chunk_size
+    global _upload_max_delay
+
+    _upload_chunk_size = max(1, param_chunk_size)
+    _upload_max_delay = param_max_delay_seconds
+    logger.info(f"Device upload chunks: {_upload_chunk_size} devices or {_upload_max_delay}s")
+
+
+def init_compression(param_compression):
+    global _compression
+
+    compression = (param_compression or 'none').lower()
+    if compression == 'zstd' and zstandard is None:
+        logger.warning("zstd compression requested but the zstandard package is not installed, using gzip")
+        compression = 'gzip'
+    if compression not in ('gzip', 'zstd', 'none'):
+        logger.warning(f"Unknown compression '{param_compression}', sending uncompressed requests")
+        compression = 'none'
+    _compression = compression
+    logger.info("Request compression: " + _compression)
+
+
+def init_delta_sync(param_enabled, param_full_resend_hours):
+    global _delta_sync
+    global _full_resend_interval
+    global _delta_trackers
+
+    _delta_sync = param_enabled
+    _full_resend_interval = param_full_resend_hours * 60 * 60
+    _delta_trackers = {}
+    logger.info(f"Delta sync {'enabled' if _delta_sync else 'disabled'}, full resend every {param_full_resend_hours}h")
+
+
+def _get_delta_tracker(source):
+    with _delta_trackers_lock:
+        if source not in _delta_trackers:
+            _delta_trackers[source] = device_delta.DeviceDeltaTracker(_full_resend_interval)
+        return _delta_trackers[source]
+
+
+def init_spool(param_spool_file, param_max_entries):
+    global _spool
+    global _replay_backoff
+    global _next_replay_at
+
+    _replay_backoff = 0
+    _next_replay_at = 0
+    try:
+        _spool = upload_spool.UploadSpool(param_spool_file, param_max_entries)
+        logger.info(f"Offline upload spool at {param_spool_file} holds {_spool.count()} entries")
+    except Exception as e:
+        _spool = None
+        logger.error("Unable to open the offline upload spool, failed uploads will be dropped: " + str(e))
+
+
+def spool_depth():
+    """Returns the number of uploads waiting in the offline spool, None when spooling is disabled."""
+    if _spool is None:
+        return None
+    try:
+        return _spool.count()
+    except Exception:
+        return None
+
+
 def generate_session():
     session = requests.Session()
     if _server_username is not None:
         session.auth = (_server_username, _server_password)
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=_POOL_MAXSIZE)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
     return session
 
 
+def get_session():
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = generate_session()
+    return _session
+
+
 def get_csrf_token(session):
     logger.info("Obtaining CSRF token")
     response_code, response = get('/api/csrf')
@@ -49,34 +179,305 @@ def get_csrf_token(session):
     return csrf_token
 
 
+def _get_cached_csrf_token(session, stale_token=None):
+    """
+    Return the cached CSRF token, fetching it on first use.
+    When stale_token is given and still cached, it is replaced by a fresh token.
+    """
+    global _csrf_token
+    with _csrf_lock:
+        if _csrf_token is None or _csrf_token == stale_token:
+            _csrf_token = get_csrf_token(session)
+        return _csrf_token
+
+
+def _request_body(data):
+    """
+    Returns the session.post keyword arguments and extra headers for sending data as JSON,
+    compressed when compression is enabled and the body is large enough to benefit.
+    """
+    if _compression == 'none':
+        return {'json': data}, {}
+    body = json.dumps(data).encode('utf-8')
+    if len(body) < _COMPRESSION_MIN_BYTES:
+        return {'json': data}, {}
+    if _compression == 'zstd':
+        body = zstandard.ZstdCompressor().compress(body)
+    else:
+        body = gzip.compress(body, compresslevel=6)
+    return {'data': body}, {'Content-Type': 'application/json', 'Content-Encoding': _compression}
+
+
+def _sent_bytes(response):
+    body = getattr(getattr(response, 'request', None), 'body', None)
+    return len(body) if isinstance(body, (bytes, str)) else 0
+
+
+def _timed_post(session, url, **kwargs):
+    """session.post, recording its latency and body size in the sensor metrics."""
+    started = time.monotonic()
+    try:
+        response = session.post(url, **kwargs)
+    except Exception:
+        sensor_metrics.record_upload(0, time.monotonic() - started, failed=True)
+        raise
+    sensor_metrics.record_upload(_sent_bytes(response), time.monotonic() - started,
+                                 failed=response.status_code >= 500)
+    return response
+
+
+def _response_json(response):
+    """The JSON body of a response, {} when there is none, e.g. an HTML error page."""
+    try:
+        return response.json()
+    except ValueError:
+        return {}
+
+
 def post(url_postfix, data):
-    session = generate_session()
+    global _compression
+
+    session = get_session()
     url = _server_api_address + url_postfix
     logger.info("Performing post to " + url)
-    headers = {'X-CSRFToken': get_csrf_token(session), 'Accept': 'application/json', "Referer": url}
+    csrf_token = _get_cached_csrf_token(session)
+    headers = {'X-CSRFToken': csrf_token, 'Accept': 'application/json', "Referer": url}
+    body, body_headers = _request_body(data)
 
-    response = session.post(url, json=data, verify=_validate_server_identity, headers=headers, timeout=_call_timeout)
-    logger.info("Server response:" + str(response.status_code) + "-" + str(response.json()))
-    return response.status_code, response.json()
+    response = _timed_post(session, url, verify=_validate_server_identity, headers={**headers, **body_headers},
+                           timeout=_call_timeout, **body)
+    if response.status_code in (400, 415) and body_headers:
+        # Older servers can't decompress request bodies, they answer 415 or take the body for
+        # invalid JSON (400). Retry uncompressed and stop compressing for this process, unless
+        # the plain body is rejected as well and the request itself is bad
+        body, body_headers = {'json': data}, {}
+        sensor_metrics.record_retry()
+        plain_response = _timed_post(session, url, json=data, verify=_validate_server_identity, headers=headers,
+                                     timeout=_call_timeout)
+        if response.status_code == 415 or plain_response.status_code != 400:
+            logger.warning("Server does not accept " + _compression + " compressed requests, disabling compression")
+            _compression = 'none'
+        response = plain_response
+    if response.status_code == 403:
+        # The server rejected the token (expired or server restarted), refresh it and retry once
+        logger.info("Server rejected the request, refreshing CSRF token")
+        headers['X-CSRFToken'] = _get_cached_csrf_token(session, stale_token=csrf_token)
+        sensor_metrics.record_retry()
+        response = _timed_post(session, url, verify=_validate_server_identity, headers={**headers, **body_headers},
+                               timeout=_call_timeout, **body)
+    logger.info("Server response:" + str(response.status_code) + "-" + str(response.content))
+    return response.status_code, _response_json(response)
 
 
 def get(url_postfix):
-    session = generate_session()
+    session = get_session()
     url = _server_api_address + url_postfix
     logger.info("Performing get to " + url)
     headers = {'Accept': 'application/json'}
     response = session.get(url, verify=_validate_server_identity, headers=headers, timeout=_call_timeout)
     logger.info("Server response:" + str(response.status_code) + "-" + str(response.content))
-    return response.status_code, response.json()
+    return response.status_code, _response_json(response)
+
+
+_SPOOL_ENDPOINTS = [
+    (upload_spool.DEVICES, '/api/addDevices', lambda items: [{"devices": items}]),
+    (upload_spool.PORTS, '/api/addPorts', lambda items: [{"ports": items}]),
+    # Health reports are sent one by one, the endpoint takes a single sensor
+    (upload_spool.HEALTH, '/api/sensorHealth', lambda items: items),
+]
+
+
+def _spool_items(kind, items):
+    if _spool is None:
+        return
+    if kind != upload_spool.HEALTH:
+        # Replayed later, the server must keep the time the devices and ports were actually seen
+        seen_at = datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds')
+        items = [dict(item, seen_at=item.get('seen_at', seen_at)) for item in items]
+    try:
+        _spool.add(kind, items)
+        logger.info(f"Spooled {len(items)} {kind} entries for later upload")
+    except Exception as e:
+        logger.error(f"Unable to spool {len(items)} {kind} entries: {e}")
+
+
+def _upload(kind, url_postfix, items, data):
+    """
+    Post data to the server. When the server can't be reached or fails, the items are spooled
+    and replayed later by replay_spool().
+    """
+    try:
+        response_code, response = post(url_postfix, data)
+    except Exception:
+        _spool_items(kind, items)
+        raise
+    if response_code >= 500:
+        _spool_items(kind, items)
+    return response_code, response
+
+
+def replay_spool():
+    """
+    Send spooled uploads in bulk, run by the sensor's spool_replay job. Does nothing while a
+    previous replay failure is backing off or another thread is already replaying.
+    """
+    global _replay_backoff
+    global _next_replay_at
+
+    if _spool is None or time.monotonic() < _next_replay_at:
+        return
+    if not _replay_lock.acquire(blocking=False):
+        return
+    try:
+        for kind, url_postfix, to_requests in _SPOOL_ENDPOINTS:
+            while True:
+                rows = _spool.peek(kind, _REPLAY_BATCH_SIZE)
+                if not rows:
+                    break
+                for data in to_requests([item for _, item in rows]):
+                    response_code, _ = post(url_postfix, data)
+                    if response_code >= 500:
+                        raise Exception("Server failed with response code " + str(response_code))
+                    if response_code != 200:
+                        # The server won't take these items no matter how often they are sent
+                        logger.error(f"Server rejected spooled {kind} entries. Response code: {response_code}")
+                _spool.remove([row_id for row_id, _ in rows])
+                logger.info(f"Replayed {len(rows)} spooled {kind} entries")
+        _replay_backoff = 0
+    except Exception as e:
+        _replay_backoff = min(_REPLAY_MAX_BACKOFF, max(_REPLAY_MIN_BACKOFF, _replay_backoff * 2))
+        _next_replay_at = time.monotonic() + _replay_backoff
+        logger.warning(f"Replay of spooled uploads failed, retrying in {_replay_backoff}s: {e}")
+    finally:
+        _replay_lock.release()
 
 
 def add_devices(devices):
-    return post('/api/addDevices', {"devices": devices})
+    return _upload(upload_spool.DEVICES, '/api/addDevices', devices, {"devices": devices})
+
+
+def _iter_chunks(items, chunk_size, max_delay_seconds):
+    """
+    Group items into lists of at most chunk_size, yielding a partial chunk once its first
+    item has waited max_delay_seconds. The items are read on a separate thread so a slow
+    producer doesn't hold back what was already collected.
+    """
+    done = object()
+    pending = queue.Queue()
+    errors = []
+
+    def produce():
+        try:
+            for item in items:
+                pending.put(item)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            pending.put(done)
+
+    threading.Thread(target=produce, daemon=True).start()
+
+    chunk = []
+    deadline = None
+    while True:
+        timeout = None if deadline is None else max(0, deadline - time.monotonic())
+        try:
+            item = pending.get(timeout=timeout)
+        except queue.Empty:
+            yield chunk
+            chunk = []
+            deadline = None
+            continue
+
+        if item is done:
+            break
+        chunk.append(item)
+        if deadline is None:
+            deadline = time.monotonic() + max_delay_seconds
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+            deadline = None
+
+    if chunk:
+        yield chunk
+    if errors:
+        raise errors[0]
+
+
+def add_devices_progressively(source, devices):
+    """
+    Upload devices in chunks while they are still being discovered.
+    A failed chunk is logged and skipped, the remaining chunks are still sent.
+    Returns the number of devices discovered.
+    """
+    count = 0
+    for chunk in _iter_chunks(devices, _upload_chunk_size, _upload_max_delay):
+        count += len(chunk)
+        try:
+            report_devices(source, chunk)
+        except Exception as e:
+            logger.error(f"Error uploading a chunk of {len(chunk)} devices: {e}")
+    return count
+
+
+def report_devices(source, devices):
+    """
+    Report devices found by a discovery source. With delta sync enabled only devices that
+    changed since the source last reported them are sent in full, the others just get
+    their last_seen refreshed.
+    """
+    global _delta_sync
+
+    if not _delta_sync:
+        _report_full(devices)
+        return
+
+    tracker = _get_delta_tracker(source)
+    seen_at = datetime.datetime.now(datetime.timezone.utc)
+    changed, unchanged_macs = tracker.split(devices)
+    if unchanged_macs:
+        try:
+            response_code, response = devices_seen(unchanged_macs, seen_at)
+        except Exception as e:
+            logger.error(f"Error refreshing {len(unchanged_macs)} unchanged devices: {e}")
+            response_code = None
+        if response_code == 200 and response.get('unknown_macs'):
+            # Deleted on the server, send them in full on the next cycle
+            logger.info(f"Server doesn't know {len(response['unknown_macs'])} devices from {source}")
+            tracker.forget(response['unknown_macs'])
+        if response_code == 404:
+            # Older server without the endpoint, go back to full uploads
+            logger.warning("Server does not support delta sync, sending full device lists")
+            _delta_sync = False
+            _report_full(devices)
+            return
+        if response_code != 200:
+            # Send them in full next time, the full upload is spooled if the server is still down
+            tracker.forget(unchanged_macs)
+
+    if changed:
+        response_code, response = _report_full(changed)
+        if response_code == 200:
+            failed = {error.get('index') for error in response.get('errors', [])}
+            tracker.record([device for idx, device in enumerate(changed) if idx not in failed])
+    logger.info(f"Reported {len(changed)} changed and {len(unchanged_macs)} unchanged devices from {source}")
+
+
+def _report_full(devices):
+    response_code, response = add_devices(devices)
+    if response_code != 200:
+        logger.error(f"Server rejected {len(devices)} devices. Response code: {response_code}")
+    return response_code, response
+
+
+def devices_seen(macs, seen_at):
+    return post('/api/devicesSeen', {"macs": macs, "timestamp": seen_at.isoformat(timespec='seconds')})
 
 
 def add_ports(ports):
-    return post('/api/addPorts', {"ports": ports})
+    return _upload(upload_spool.PORTS, '/api/addPorts', ports, {"ports": ports})
 
 
 def report_sensor_health(health_info):
-    return post('/api/sensorHealth', health_info)
+    return _upload(upload_spool.HEALTH, '/api/sensorHealth', [health_info], health_info)
@@ -0,0 +1,87 @@
+"""
+Disk-backed spool for uploads the server couldn't take.
+
+Payloads are kept in a small SQLite file, one row per device, port or sensor health
+report. Spooling the same device again replaces the older row, so a sensor that is
+offline for hours only replays the latest view of each device once the server is back.
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+_logger = logging.getLogger('EasyNetVisibility')
+
+DEVICES = 'devices'
+PORTS = 'ports'
+HEALTH = 'health'
+
+
+def _item_key(kind, item):
+    if kind == PORTS:
+        return "%s/%s" % (item.get('mac'), item.get('port'))
+    return str(item.get('mac'))
+
+
+class UploadSpool:
+    def __init__(self, path, max_entries):
+        """
+        Args:
+            path: SQLite file the spool is kept in
+            max_entries: Oldest rows are dropped once the spool holds more than this
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._connect() as db:
+            # AUTOINCREMENT so ids are never reused by a replaced row
+            db.execute("CREATE TABLE IF NOT EXISTS spool ("
+                       "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                       "kind TEXT NOT NULL, "
+                       "item_key TEXT NOT NULL, "
+                       "payload TEXT NOT NULL, "
+                       "spooled_at REAL NOT NULL, "
+                       "UNIQUE (kind, item_key))")
+
+    @contextmanager
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=30)
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    def add(self, kind, items):
+        """Spool items of the given kind, replacing older rows for the same device or port."""
+        now = time.time()
+        rows = [(kind, _item_key(kind, item), json.dumps(item), now) for item in items]
+        with self._lock, self._connect() as db:
+            # REPLACE gives the row a new id, so a replay in flight won't delete the newer payload
+            db.executemany("INSERT OR REPLACE INTO spool (kind, item_key, payload, spooled_at) "
+                           "VALUES (?, ?, ?, ?)", rows)
+            overflow = db.execute("SELECT COUNT(*) FROM spool").fetchone()[0] - self.max_entries
+            if overflow > 0:
+                _logger.warning(f"Upload spool is full, dropping {overflow} oldest entries")
+                db.execute("DELETE FROM spool WHERE id IN "
+                           "(SELECT id FROM spool ORDER BY id LIMIT ?)", (overflow,))
+
+    def peek(self, kind, limit):
+        """Returns up to limit (id, item) pairs of the given kind, oldest first."""
+        with self._lock, self._connect() as db:
+            rows = db.execute("SELECT id, payload FROM spool WHERE kind = ? ORDER BY id LIMIT ?",
+                              (kind, limit)).fetchall()
+        return [(row_id, json.loads(payload)) for row_id, payload in rows]
+
+    def remove(self, ids):
+        with self._lock, self._connect() as db:
+            db.executemany("DELETE FROM spool WHERE id = ?", [(row_id,) for row_id in ids])
+
+    def count(self):
+        with self._lock, self._connect() as db:
+            return db.execute("SELECT COUNT(*) FROM spool").fetchone()[0]
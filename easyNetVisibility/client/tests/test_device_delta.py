@@ -0,0 +1,83 @@
+import os
+import sys
+import unittest
+
+# Add the sensor directory to Python path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'sensor'))
+
+import device_delta
+
+
+def _device(mac, ip='10.0.0.1', hostname='host', vendor='Vendor'):
+    return {'mac': mac, 'ip': ip, 'hostname': hostname, 'vendor': vendor}
+
+
+class TestDeviceDeltaTracker(unittest.TestCase):
+    def setUp(self):
+        self.tracker = device_delta.DeviceDeltaTracker(3600)
+
+    def test_new_devices_are_changed(self):
+        changed, unchanged = self.tracker.split([_device('AA'), _device('BB')], now=0)
+
+        self.assertEqual([d['mac'] for d in changed], ['AA', 'BB'])
+        self.assertEqual(unchanged, [])
+
+    def test_recorded_devices_are_unchanged(self):
+        self.tracker.record([_device('AA')], now=0)
+
+        changed, unchanged = self.tracker.split([_device('AA')], now=60)
+
+        self.assertEqual(changed, [])
+        self.assertEqual(unchanged, ['AA'])
+
+    def test_ip_hostname_or_vendor_change_is_sent(self):
+        self.tracker.record([_device('AA'), _device('BB'), _device('CC')], now=0)
+
+        changed, unchanged = self.tracker.split([_device('AA', ip='10.0.0.2'),
+                                                 _device('BB', hostname='renamed'),
+                                                 _device('CC', vendor='Other')], now=60)
+
+        self.assertEqual([d['mac'] for d in changed], ['AA', 'BB', 'CC'])
+        self.assertEqual(unchanged, [])
+
+    def test_full_resend_after_interval(self):
+        self.tracker.record([_device('AA')], now=0)
+
+        changed, unchanged = self.tracker.split([_device('AA')], now=3600)
+
+        self.assertEqual([d['mac'] for d in changed], ['AA'])
+
+    def test_forget(self):
+        self.tracker.record([_device('AA')], now=0)
+        self.tracker.forget(['AA'])
+
+        changed, unchanged = self.tracker.split([_device('AA')], now=60)
+
+        self.assertEqual([d['mac'] for d in changed], ['AA'])
+
+
+class TestChurnTracker(unittest.TestCase):
+    def setUp(self):
+        self.tracker = device_delta.ChurnTracker()
+
+    def test_new_devices_are_churn(self):
+        self.assertEqual(self.tracker.count('ping_sweep', [_device('AA'), _device('BB')]), 2)
+
+    def test_same_devices_are_quiet(self):
+        self.tracker.count('ping_sweep', [_device('AA'), _device('BB')])
+
+        self.assertEqual(self.tracker.count('ping_sweep', [_device('AA'), _device('BB', hostname='renamed')]), 0)
+
+    def test_ip_change_is_churn(self):
+        self.tracker.count('ping_sweep', [_device('AA'), _device('BB')])
+
+        self.assertEqual(self.tracker.count('ping_sweep', [_device('AA'), _device('BB', ip='10.0.0.2')]), 1)
+
+    def test_sources_are_tracked_separately(self):
+        self.tracker.count('ping_sweep', [_device('AA')])
+
+        self.assertEqual(self.tracker.count('openwrt', [_device('AA')]), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -27,6 +27,63 @@ class TestNetworkUtilsInit(unittest.TestCase):
     def test_get_interface_returns_none_when_not_set(self):
         self.assertIsNone(network_utils.get_interface())
 
+    def test_init_with_interface_list(self):
+        network_utils.init('eth0, eth0.10,eth0.20')
+        self.assertEqual(network_utils.get_interface(), 'eth0')
+        self.assertEqual(network_utils.get_interfaces(), ['eth0', 'eth0.10', 'eth0.20'])
+
+    def test_init_parses_networks(self):
+        network_utils.init('eth0', '10.20.0.5/24@eth0.20, 10.30.0.0/16, not-a-network, fd00::/64')
+        self.assertEqual(network_utils._networks, [('10.20.0.0/24', 'eth0.20'), ('10.30.0.0/16', None)])
+
+
+_ROUTES = """Iface\tDestination\tGateway \tFlags\tRefCnt\tUse\tMetric\tMask\t\tMTU\tWindow\tIRTT
+eth0\t00000000\t0101A8C0\t0003\t0\t0\t0\t00000000\t0\t0\t0
+eth0\t0001A8C0\t00000000\t0001\t0\t0\t0\t00FFFFFF\t0\t0\t0
+eth0.20\t0000140A\t00000000\t0001\t0\t0\t0\t0000FFFF\t0\t0\t0"""
+
+
+class TestSweepTargets(unittest.TestCase):
+    def setUp(self):
+        network_utils._interface = None
+        network_utils._extra_interfaces = []
+        network_utils._networks = []
+
+    def tearDown(self):
+        network_utils.init(None)
+
+    @patch('builtins.open', new_callable=mock_open, read_data=_ROUTES)
+    def test_route_interface_longest_prefix(self, mock_file):
+        self.assertEqual(network_utils.route_interface('10.20.5.0/24'), 'eth0.20')
+        self.assertEqual(network_utils.route_interface('192.168.1.0/24'), 'eth0')
+        self.assertEqual(network_utils.route_interface('172.16.0.0/12'), 'eth0')
+
+    @patch('network_utils.route_interface', return_value='eth0.30')
+    @patch('network_utils.get_netmask')
+    @patch('network_utils.get_ip')
+    def test_interfaces_then_networks(self, mock_ip, mock_netmask, mock_route):
+        addresses = {'eth0': ('192.168.1.100', 24), 'eth0.20': ('10.20.0.2', 24)}
+        mock_ip.side_effect = lambda interface: addresses[interface][0]
+        mock_netmask.side_effect = lambda interface: addresses[interface][1]
+        network_utils.init('eth0,eth0.20', '10.20.0.0/24, 10.30.0.0/24, 10.40.0.0/24@eth0.40')
+
+        targets = network_utils.get_sweep_targets()
+
+        self.assertEqual(targets, [('192.168.1.100/24', 'eth0'), ('10.20.0.2/24', 'eth0.20'),
+                                   ('10.30.0.0/24', 'eth0.30'), ('10.40.0.0/24', 'eth0.40')])
+
+    @patch('network_utils.get_netmask', return_value=24)
+    @patch('network_utils.get_ip')
+    def test_interface_without_address_is_skipped(self, mock_ip, mock_netmask):
+        mock_ip.side_effect = lambda interface: '192.168.1.100' if interface == 'eth0' else self._no_address()
+        network_utils.init('eth0,eth1')
+
+        self.assertEqual(network_utils.get_sweep_targets(), [('192.168.1.100/24', 'eth0')])
+
+    @staticmethod
+    def _no_address():
+        raise OSError(99, 'Cannot assign requested address')
+
 
 class TestConvertMac(unittest.TestCase):
     def test_convert_mac_colon_format(self):
@@ -1,8 +1,11 @@
+import io
+import json
 import os
 import sys
+import tempfile
+import threading
 import unittest
-import xml.etree.ElementTree as ET
-from unittest.mock import patch, MagicMock
+from unittest.mock import MagicMock, patch
 
 # Add the sensor directory to Python path
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'sensor'))
@@ -10,26 +13,27 @@ sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'sensor'))
 import nmap
 
 
+def _mock_nmap_output(mock_popen, xml_content):
+    """Make the mocked nmap process stream xml_content on stdout."""
+    process = mock_popen.return_value
+    process.stdout = io.BytesIO(xml_content.encode('utf-8'))
+    process.poll.return_value = 0
+    return process
+
+
 class TestPingSweep(unittest.TestCase):
     def setUp(self):
         nmap._found_devices = {}
 
-    @patch('os.system')
-    @patch('os.path.exists')
-    @patch('os.makedirs')
-    @patch('os.popen')
+    @patch('subprocess.Popen')
     @patch('network_utils.get_ip')
     @patch('network_utils.get_netmask')
     @patch('network_utils.get_interface')
-    @patch('xml.etree.ElementTree.parse')
-    def test_ping_sweep_success(self, mock_parse, mock_interface, mock_netmask,
-                                mock_ip, mock_popen, mock_makedirs, mock_exists, mock_system):
+    def test_ping_sweep_success(self, mock_interface, mock_netmask, mock_ip, mock_popen):
         # Setup mocks
         mock_ip.return_value = '192.168.1.100'
         mock_netmask.return_value = 24
         mock_interface.return_value = 'eth0'
-        mock_exists.return_value = True
-        mock_popen.return_value.read.return_value = ''
 
         # Create mock XML structure
         xml_content = """<?xml version="1.0"?>
@@ -51,10 +55,7 @@ class TestPingSweep(unittest.TestCase):
         </nmaprun>
         """
 
-        root = ET.fromstring(xml_content)
-        mock_tree = MagicMock()
-        mock_tree.getroot.return_value = root
-        mock_parse.return_value = mock_tree
+        _mock_nmap_output(mock_popen, xml_content)
 
         # Execute
         result = nmap.ping_sweep()
@@ -76,25 +77,21 @@ class TestPingSweep(unittest.TestCase):
         self.assertEqual(len(nmap._found_devices), 2)
         self.assertEqual(nmap._found_devices['AABBCCDDEEFF'], '192.168.1.1')
 
-        # Verify that os.system was called to clean up the XML file
-        mock_system.assert_called_once()
+        # nmap streams its XML report on stdout, no temp files or shell involved
+        args = mock_popen.call_args[0][0]
+        self.assertEqual(args[0], 'nmap')
+        self.assertEqual(args[-2:], ['-oX', '-'])
+        self.assertIn('192.168.1.100/24', args)
 
-    @patch('os.system')
-    @patch('os.path.exists')
-    @patch('os.makedirs')
-    @patch('os.popen')
+    @patch('subprocess.Popen')
     @patch('network_utils.get_ip')
     @patch('network_utils.get_netmask')
     @patch('network_utils.get_interface')
-    @patch('xml.etree.ElementTree.parse')
-    def test_ping_sweep_no_mac(self, mock_parse, mock_interface, mock_netmask,
-                               mock_ip, mock_popen, mock_makedirs, mock_exists, mock_system):
+    def test_ping_sweep_no_mac(self, mock_interface, mock_netmask, mock_ip, mock_popen):
         """Test that devices without MAC (local interface) are skipped"""
         mock_ip.return_value = '192.168.1.100'
         mock_netmask.return_value = 24
         mock_interface.return_value = 'eth0'
-        mock_exists.return_value = True
-        mock_popen.return_value.read.return_value = ''
 
         # Device without MAC address
         xml_content = """<?xml version="1.0"?>
@@ -109,10 +106,7 @@ class TestPingSweep(unittest.TestCase):
         </nmaprun>
         """
 
-        root = ET.fromstring(xml_content)
-        mock_tree = MagicMock()
-        mock_tree.getroot.return_value = root
-        mock_parse.return_value = mock_tree
+        _mock_nmap_output(mock_popen, xml_content)
 
         result = nmap.ping_sweep()
 
@@ -121,22 +115,15 @@ class TestPingSweep(unittest.TestCase):
         # Verify _found_devices is also empty
         self.assertEqual(len(nmap._found_devices), 0)
 
-    @patch('os.system')
-    @patch('os.path.exists')
-    @patch('os.makedirs')
-    @patch('os.popen')
+    @patch('subprocess.Popen')
     @patch('network_utils.get_ip')
     @patch('network_utils.get_netmask')
     @patch('network_utils.get_interface')
-    @patch('xml.etree.ElementTree.parse')
-    def test_ping_sweep_no_vendor(self, mock_parse, mock_interface, mock_netmask,
-                                  mock_ip, mock_popen, mock_makedirs, mock_exists, mock_system):
+    def test_ping_sweep_no_vendor(self, mock_interface, mock_netmask, mock_ip, mock_popen):
         """Test handling of devices with no vendor information"""
         mock_ip.return_value = '192.168.1.100'
         mock_netmask.return_value = 24
         mock_interface.return_value = 'eth0'
-        mock_exists.return_value = True
-        mock_popen.return_value.read.return_value = ''
 
         xml_content = """<?xml version="1.0"?>
         <nmaprun>
@@ -151,43 +138,171 @@ class TestPingSweep(unittest.TestCase):
         </nmaprun>
         """
 
-        root = ET.fromstring(xml_content)
-        mock_tree = MagicMock()
-        mock_tree.getroot.return_value = root
-        mock_parse.return_value = mock_tree
+        _mock_nmap_output(mock_popen, xml_content)
 
         result = nmap.ping_sweep()
 
         self.assertEqual(len(result), 1)
         self.assertEqual(result[0]['vendor'], 'Unknown')
 
-    @patch('os.system')
-    @patch('os.path.exists')
-    @patch('os.popen')
+    @patch('subprocess.Popen')
     @patch('network_utils.get_ip')
     @patch('network_utils.get_netmask')
     @patch('network_utils.get_interface')
-    @patch('xml.etree.ElementTree.parse')
-    def test_ping_sweep_creates_directory(self, mock_parse, mock_interface, mock_netmask,
-                                          mock_ip, mock_popen, mock_exists, mock_system):
-        """Test that directory is created if it doesn't exist"""
+    def test_ping_sweep_invalid_output(self, mock_interface, mock_netmask, mock_ip, mock_popen):
+        """Test that a truncated nmap report fails the sweep but keeps the devices parsed so far"""
         mock_ip.return_value = '192.168.1.100'
         mock_netmask.return_value = 24
         mock_interface.return_value = 'eth0'
-        mock_exists.return_value = False
-        mock_popen.return_value.read.return_value = ''
+        _mock_nmap_output(mock_popen, """<?xml version="1.0"?>
+        <nmaprun>
+            <host>
+                <address addr="192.168.1.1" addrtype="ipv4"/>
+                <address addr="AA:BB:CC:DD:EE:FF" addrtype="mac"/>
+            </host>
+            <host>""")
+
+        result = []
+        with self.assertRaises(Exception):
+            for device in nmap.iter_ping_sweep():
+                result.append(device)
+
+        self.assertEqual(len(result), 1)
+        self.assertEqual(nmap._found_devices, {'AABBCCDDEEFF': '192.168.1.1'})
 
-        mock_parse.side_effect = Exception("File not found")
 
-        with patch('os.makedirs') as mock_makedirs:
-            try:
-                nmap.ping_sweep()
-            except Exception:
-                # ping_sweep is expected to raise due to the mocked parse failure;
-                # ignore the exception here since this test only verifies directory creation.
-                pass
+def _ping_host_xml(ip, mac):
+    return f'<host><status state="up"/><address addr="{ip}" addrtype="ipv4"/>' \
+           f'<address addr="{mac}" addrtype="mac" vendor="V"/><hostnames/></host>'
 
-            mock_makedirs.assert_called_once_with('/opt/easy_net_visibility/client/nmap_scans')
+
+class TestMultiNetworkPingSweep(unittest.TestCase):
+    def setUp(self):
+        nmap._found_devices = {}
+        self._original = (nmap._ping_sweep_concurrency, nmap._ping_sweep_max_rate)
+
+    def tearDown(self):
+        nmap._ping_sweep_concurrency, nmap._ping_sweep_max_rate = self._original
+
+    def _fake_popen(self, hosts_by_network):
+        calls = []
+
+        def popen(args, stdout=None):
+            calls.append(args)
+            network = args[args.index('-sn') + 1]
+            if isinstance(hosts_by_network[network], Exception):
+                raise hosts_by_network[network]
+            xml = '<?xml version="1.0"?><nmaprun>' + ''.join(
+                _ping_host_xml(ip, mac) for ip, mac in hosts_by_network[network]) + '</nmaprun>'
+            process = MagicMock()
+            process.stdout = io.BytesIO(xml.encode('utf-8'))
+            process.poll.return_value = 0
+            return process
+        return popen, calls
+
+    @patch('network_utils.get_sweep_targets')
+    def test_sweeps_every_network_and_tags_the_interface(self, mock_targets):
+        mock_targets.return_value = [('192.168.1.10/24', 'eth0'), ('10.20.0.0/24', 'eth0.20')]
+        popen, calls = self._fake_popen({
+            '192.168.1.10/24': [('192.168.1.1', 'AA:BB:CC:DD:EE:01')],
+            '10.20.0.0/24': [('10.20.0.5', 'AA:BB:CC:DD:EE:02'), ('10.20.0.6', 'AA:BB:CC:DD:EE:03')],
+        })
+        nmap.init_ping_sweep(4, 0)
+
+        with patch('subprocess.Popen', side_effect=popen):
+            result = nmap.ping_sweep()
+
+        self.assertEqual({(d['mac'], d['interface']) for d in result},
+                         {('AABBCCDDEE01', 'eth0'), ('AABBCCDDEE02', 'eth0.20'), ('AABBCCDDEE03', 'eth0.20')})
+        self.assertEqual(len(nmap._found_devices), 3)
+        self.assertEqual(len(calls), 2)
+        for args in calls:
+            self.assertIn('-e', args)
+            self.assertNotIn('--max-rate', args)
+
+    @patch('network_utils.get_sweep_targets')
+    def test_device_seen_on_two_networks_is_reported_once(self, mock_targets):
+        mock_targets.return_value = [('192.168.1.10/24', 'eth0'), ('10.20.0.0/24', 'eth0.20')]
+        popen, _ = self._fake_popen({
+            '192.168.1.10/24': [('192.168.1.1', 'AA:BB:CC:DD:EE:01')],
+            '10.20.0.0/24': [('10.20.0.1', 'AA:BB:CC:DD:EE:01')],
+        })
+
+        with patch('subprocess.Popen', side_effect=popen):
+            result = nmap.ping_sweep()
+
+        self.assertEqual(len(result), 1)
+
+    @patch('network_utils.get_sweep_targets')
+    def test_failed_network_is_reported_after_the_others_are_swept(self, mock_targets):
+        mock_targets.return_value = [('192.168.1.10/24', 'eth0'), ('10.20.0.0/24', 'eth0.20')]
+        popen, calls = self._fake_popen({
+            '192.168.1.10/24': [('192.168.1.1', 'AA:BB:CC:DD:EE:01')],
+            '10.20.0.0/24': OSError("interface is down"),
+        })
+
+        result = []
+        with patch('subprocess.Popen', side_effect=popen):
+            with self.assertRaises(Exception) as context:
+                for device in nmap.iter_ping_sweep():
+                    result.append(device)
+
+        self.assertEqual([d['mac'] for d in result], ['AABBCCDDEE01'])
+        self.assertEqual(nmap._found_devices, {'AABBCCDDEE01': '192.168.1.1'})
+        self.assertEqual(len(calls), 2)
+        message = str(context.exception)
+        self.assertIn('1 of 2 networks', message)
+        self.assertIn('10.20.0.0/24 on eth0.20 (interface is down)', message)
+        self.assertNotIn('192.168.1.10/24', message)
+
+    @patch('network_utils.get_sweep_targets')
+    def test_rate_budget_is_split_between_concurrent_sweeps(self, mock_targets):
+        mock_targets.return_value = [('10.0.%d.0/24' % i, None) for i in range(3)]
+        popen, calls = self._fake_popen({'10.0.%d.0/24' % i: [] for i in range(3)})
+        nmap.init_ping_sweep(2, 300)
+
+        with patch('subprocess.Popen', side_effect=popen):
+            nmap.ping_sweep()
+
+        self.assertEqual(len(calls), 3)
+        for args in calls:
+            self.assertEqual(args[args.index('--max-rate') + 1], '150')
+            self.assertNotIn('-e', args)
+
+    @patch('subprocess.Popen')
+    @patch('network_utils.get_sweep_targets')
+    def test_stopping_early_terminates_running_sweeps(self, mock_targets, mock_popen):
+        mock_targets.return_value = [('192.168.1.10/24', 'eth0'), ('10.20.0.0/24', 'eth0.20')]
+        read_fd, write_fd = os.pipe()
+        hanging = MagicMock()
+        hanging.stdout = os.fdopen(read_fd, 'rb')
+        hanging.poll.return_value = None
+        hanging.terminate.side_effect = lambda: os.close(write_fd)
+        finished = MagicMock()
+        finished.stdout = io.BytesIO(('<?xml version="1.0"?><nmaprun>' +
+                                      _ping_host_xml('192.168.1.1', 'AA:BB:CC:DD:EE:01') + '</nmaprun>').encode('utf-8'))
+        finished.poll.return_value = 0
+        mock_popen.side_effect = lambda args, stdout=None: finished if '192.168.1.10/24' in args else hanging
+        nmap.init_ping_sweep(2, 0)
+
+        sweep = nmap.iter_ping_sweep()
+        self.assertEqual(next(sweep)['mac'], 'AABBCCDDEE01')
+        # Wait for the second sweep to start its nmap
+        for _ in range(500):
+            if mock_popen.call_count == 2:
+                break
+            threading.Event().wait(0.01)
+        sweep.close()
+
+        hanging.terminate.assert_called_once()
+
+    @patch('network_utils.get_sweep_targets')
+    def test_no_networks(self, mock_targets):
+        mock_targets.return_value = []
+        nmap._found_devices = {'AABBCCDDEEFF': '192.168.1.1'}
+
+        self.assertEqual(nmap.ping_sweep(), [])
+        self.assertEqual(nmap._found_devices, {})
 
 
 class TestPortScan(unittest.TestCase):
@@ -195,16 +310,16 @@ class TestPortScan(unittest.TestCase):
         nmap._found_devices = {
             'AABBCCDDEEFF': '192.168.1.1'
         }
+        self._state_dir = tempfile.TemporaryDirectory()
+        self._original_state_file = nmap._state_file
+        nmap._state_file = os.path.join(self._state_dir.name, 'port_scan_state.json')
 
-    @patch('os.system')
-    @patch('os.path.exists')
-    @patch('os.makedirs')
-    @patch('os.popen')
-    @patch('xml.etree.ElementTree.parse')
-    def test_port_scan_success(self, mock_parse, mock_popen, mock_makedirs,
-                               mock_exists, mock_system):
-        mock_exists.return_value = True
-        mock_popen.return_value.read.return_value = ''
+    def tearDown(self):
+        nmap._state_file = self._original_state_file
+        self._state_dir.cleanup()
+
+    @patch('subprocess.Popen')
+    def test_port_scan_success(self, mock_popen):
 
         xml_content = """<?xml version="1.0"?>
         <nmaprun>
@@ -227,10 +342,7 @@ class TestPortScan(unittest.TestCase):
         </nmaprun>
         """
 
-        root = ET.fromstring(xml_content)
-        mock_tree = MagicMock()
-        mock_tree.getroot.return_value = root
-        mock_parse.return_value = mock_tree
+        _mock_nmap_output(mock_popen, xml_content)
 
         result = list(nmap.port_scan())
 
@@ -249,16 +361,9 @@ class TestPortScan(unittest.TestCase):
         self.assertEqual(ports[0]['version'], '1.18.0')
         self.assertEqual(ports[0]['mac'], 'AABBCCDDEEFF')
 
-    @patch('os.system')
-    @patch('os.path.exists')
-    @patch('os.makedirs')
-    @patch('os.popen')
-    @patch('xml.etree.ElementTree.parse')
-    def test_port_scan_no_open_ports(self, mock_parse, mock_popen, mock_makedirs,
-                                     mock_exists, mock_system):
+    @patch('subprocess.Popen')
+    def test_port_scan_no_open_ports(self, mock_popen):
         """Test device with no open ports"""
-        mock_exists.return_value = True
-        mock_popen.return_value.read.return_value = ''
 
         xml_content = """<?xml version="1.0"?>
         <nmaprun>
@@ -273,10 +378,7 @@ class TestPortScan(unittest.TestCase):
         </nmaprun>
         """
 
-        root = ET.fromstring(xml_content)
-        mock_tree = MagicMock()
-        mock_tree.getroot.return_value = root
-        mock_parse.return_value = mock_tree
+        _mock_nmap_output(mock_popen, xml_content)
 
         result = list(nmap.port_scan())
 
@@ -284,26 +386,129 @@ class TestPortScan(unittest.TestCase):
         self.assertEqual(len(result), 1)
         self.assertEqual(len(result[0]), 0)
 
-    @patch('os.system')
-    @patch('os.path.exists')
-    @patch('os.popen')
-    @patch('xml.etree.ElementTree.parse')
-    def test_port_scan_creates_directory(self, mock_parse, mock_popen, mock_exists, mock_system):
-        """Test that directory is created if it doesn't exist"""
-        mock_exists.return_value = False
-        mock_popen.return_value.read.return_value = ''
-
-        mock_parse.side_effect = Exception("File not found")
-
-        with patch('os.makedirs') as mock_makedirs:
-            try:
-                list(nmap.port_scan())
-            except Exception:
-                # port_scan is expected to raise due to the mocked parse failure;
-                # ignore the exception here since this test only verifies directory creation.
-                pass
-
-            mock_makedirs.assert_called_once_with('/opt/easy_net_visibility/client/nmap_scans')
+    @patch('subprocess.Popen')
+    def test_port_scan_failed_scan_yields_empty(self, mock_popen):
+        """Test that an unreadable nmap report yields no ports and isn't recorded as scanned"""
+        _mock_nmap_output(mock_popen, "")
+
+        result = list(nmap.port_scan())
+
+        self.assertEqual(result, [[]])
+        with open(nmap._state_file) as state_file:
+            self.assertEqual(json.load(state_file)['devices'], {})
+
+    @patch('subprocess.Popen')
+    def test_timed_out_host_is_not_recorded(self, mock_popen):
+        """A host that hit --host-timeout keeps no full scan record, so it is fully scanned again next cycle"""
+        nmap.init_port_scan(1, 60, incremental=True)
+        _mock_nmap_output(mock_popen, '<nmaprun><host starttime="1" endtime="901" timedout="true">'
+                                      '<status state="up"/><address addr="192.168.1.1" addrtype="ipv4"/></host></nmaprun>')
+
+        result = list(nmap.port_scan())
+
+        self.assertEqual(result, [[]])
+        with open(nmap._state_file) as state_file:
+            self.assertEqual(json.load(state_file)['devices'], {})
+
+    @patch('subprocess.Popen')
+    def test_host_down_is_not_recorded(self, mock_popen):
+        _mock_nmap_output(mock_popen, '<nmaprun><runstats><hosts up="0" down="1" total="1"/></runstats></nmaprun>')
+
+        self.assertIsNone(nmap._scan_host('AABBCCDDEEFF', '192.168.1.1'))
+
+    @patch('subprocess.Popen')
+    def test_completed_scan_is_recorded(self, mock_popen):
+        nmap.init_port_scan(1, 60, incremental=True)
+        _mock_nmap_output(mock_popen, '<nmaprun><host><status state="up"/><ports/></host></nmaprun>')
+
+        list(nmap.port_scan())
+
+        with open(nmap._state_file) as state_file:
+            entry = json.load(state_file)['devices']['AABBCCDDEEFF']
+        self.assertIsNotNone(entry['last_full_scan'])
+
+    @patch('nmap._scan_host')
+    def test_port_scan_runs_hosts_concurrently(self, mock_scan_host):
+        """Test that hosts are scanned in parallel and yielded per host"""
+        nmap._found_devices = {'AABBCCDDEE0%d' % i: '192.168.1.%d' % i for i in range(3)}
+        nmap.init_port_scan(3, 60)
+        barrier = threading.Barrier(3, timeout=5)
+
+        def scan(device_mac, device_ip, ports):
+            # Only completes if all three scans run at the same time
+            barrier.wait()
+            return [{'mac': device_mac, 'port': '80'}]
+
+        mock_scan_host.side_effect = scan
+
+        result = list(nmap.port_scan())
+
+        self.assertEqual(len(result), 3)
+        self.assertEqual({ports[0]['mac'] for ports in result}, set(nmap._found_devices))
+
+    @patch('subprocess.Popen')
+    def test_scan_host_passes_host_timeout_and_ports(self, mock_popen):
+        nmap.init_port_scan(2, 120)
+        _mock_nmap_output(mock_popen, "<nmaprun/>")
+
+        nmap._scan_host('AABBCCDDEEFF', '192.168.1.1', [22, 80, 81])
+
+        args = mock_popen.call_args[0][0]
+        self.assertEqual(args[:6], ['nmap', '-sV', '--host-timeout', '120s', '-p', '22,80-81'])
+        self.assertEqual(args[-3:], ['192.168.1.1', '-oX', '-'])
+
+    @patch('nmap._scan_host')
+    def test_port_scan_incremental_after_full_scan(self, mock_scan_host):
+        """Test that an unchanged device only gets its known ports re-checked on the next cycle"""
+        nmap.init_port_scan(1, 60, incremental=True, full_scan_interval_hours=24, rotating_slices=8)
+        mock_scan_host.return_value = [{'mac': 'AABBCCDDEEFF', 'port': '8080'}]
+
+        list(nmap.port_scan())
+        list(nmap.port_scan())
+
+        first_ports = mock_scan_host.call_args_list[0][0][2]
+        second_ports = mock_scan_host.call_args_list[1][0][2]
+        self.assertIsNone(first_ports)
+        self.assertIn(8080, second_ports)
+        # Second slice of the rotating range
+        self.assertIn(129, second_ports)
+        self.assertNotIn(1, second_ports)
+
+    @patch('nmap._scan_host')
+    def test_port_scan_full_scan_when_disabled(self, mock_scan_host):
+        nmap.init_port_scan(1, 60, incremental=False)
+        mock_scan_host.return_value = []
+
+        list(nmap.port_scan())
+        list(nmap.port_scan())
+
+        self.assertEqual([c[0][2] for c in mock_scan_host.call_args_list], [None, None])
+        self.assertEqual(os.listdir(self._state_dir.name), [])
+
+    @patch('subprocess.Popen')
+    def test_stopping_early_terminates_running_scans(self, mock_popen):
+        nmap._found_devices = {'AABBCCDDEE01': '192.168.1.1', 'AABBCCDDEE02': '192.168.1.2'}
+        nmap.init_port_scan(2, 60, incremental=False)
+        read_fd, write_fd = os.pipe()
+        hanging = MagicMock()
+        hanging.stdout = os.fdopen(read_fd, 'rb')
+        hanging.poll.return_value = None
+        hanging.terminate.side_effect = lambda: os.close(write_fd)
+        finished = MagicMock()
+        finished.stdout = io.BytesIO(b'<nmaprun><host><ports/></host></nmaprun>')
+        finished.poll.return_value = 0
+        mock_popen.side_effect = lambda args, stdout=None: finished if '192.168.1.1' in args else hanging
+
+        scan = nmap.port_scan()
+        self.assertEqual(next(scan), [])
+        # Wait for the second scan to start its nmap
+        for _ in range(500):
+            if mock_popen.call_count == 2:
+                break
+            threading.Event().wait(0.01)
+        scan.close()
+
+        hanging.terminate.assert_called_once()
 
     def test_port_scan_empty_devices(self):
         """Test port scan when no devices found"""
@@ -0,0 +1,86 @@
+import os
+import sys
+import tempfile
+import unittest
+
+# Add the sensor directory to Python path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'sensor'))
+
+import scan_state
+
+
+class TestFormatPorts(unittest.TestCase):
+    def test_collapses_ranges(self):
+        self.assertEqual(scan_state.format_ports([80, 1, 2, 3, 443, 22, 23]), '1-3,22-23,80,443')
+
+    def test_empty(self):
+        self.assertEqual(scan_state.format_ports([]), '')
+
+
+class TestPortScanState(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self._dir.name, 'state.json')
+        self.state = scan_state.PortScanState(self.path, full_scan_interval_seconds=3600, rotating_slices=4)
+
+    def tearDown(self):
+        self._dir.cleanup()
+
+    def test_unknown_device_needs_full_scan(self):
+        self.assertIsNone(self.state.ports_to_scan('AABBCCDDEEFF', '10.0.0.1', now=1000))
+
+    def test_stable_device_gets_known_ports_and_slice(self):
+        self.state.record('AABBCCDDEEFF', '10.0.0.1', ['22', '8080'], full_scan=True, now=1000)
+
+        ports = self.state.ports_to_scan('AABBCCDDEEFF', '10.0.0.1', now=2000)
+
+        self.assertEqual(ports, list(range(1, 257)) + [8080])
+
+    def test_ip_change_needs_full_scan(self):
+        self.state.record('AABBCCDDEEFF', '10.0.0.1', ['22'], full_scan=True, now=1000)
+        self.assertIsNone(self.state.ports_to_scan('AABBCCDDEEFF', '10.0.0.2', now=2000))
+
+    def test_full_scan_interval_expired(self):
+        self.state.record('AABBCCDDEEFF', '10.0.0.1', ['22'], full_scan=True, now=1000)
+        self.assertIsNone(self.state.ports_to_scan('AABBCCDDEEFF', '10.0.0.1', now=1000 + 3600))
+
+    def test_port_change_in_cheap_scan_forces_full_scan(self):
+        self.state.record('AABBCCDDEEFF', '10.0.0.1', ['22'], full_scan=True, now=1000)
+        self.state.record('AABBCCDDEEFF', '10.0.0.1', ['22', '80'], full_scan=False, now=1100)
+        self.assertIsNone(self.state.ports_to_scan('AABBCCDDEEFF', '10.0.0.1', now=1200))
+
+    def test_save_and_load_round_trip(self):
+        self.state.record('AABBCCDDEEFF', '10.0.0.1', ['22'], full_scan=True, now=1000)
+        self.state.finish_cycle(now=1000)
+        self.state.save()
+
+        loaded = scan_state.PortScanState(self.path, full_scan_interval_seconds=3600, rotating_slices=4)
+        loaded.load()
+
+        self.assertEqual(loaded.rotation, 1)
+        self.assertEqual(loaded.devices['AABBCCDDEEFF']['ports'], [22])
+        self.assertEqual(list(loaded.rotating_slice())[0], 257)
+
+    def test_save_creates_missing_directory(self):
+        path = os.path.join(self._dir.name, 'missing', 'state.json')
+        state = scan_state.PortScanState(path, full_scan_interval_seconds=3600, rotating_slices=4)
+        state.record('AABBCCDDEEFF', '10.0.0.1', ['22'], full_scan=True, now=1000)
+
+        state.save()
+
+        self.assertTrue(os.path.exists(path))
+
+    def test_finish_cycle_drops_stale_devices(self):
+        self.state.record('AABBCCDDEEFF', '10.0.0.1', ['22'], full_scan=True, now=0)
+        self.state.finish_cycle(now=31 * 24 * 60 * 60)
+        self.assertEqual(self.state.devices, {})
+
+    def test_load_corrupt_file_starts_empty(self):
+        with open(self.path, 'w') as state_file:
+            state_file.write('not json')
+        self.state.load()
+        self.assertEqual(self.state.devices, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,204 @@
+import os
+import sys
+import threading
+import unittest
+
+# Add the sensor directory to Python path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'sensor'))
+
+from scheduler import Scheduler
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class TestScheduler(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.scheduler = Scheduler(clock=self.clock, sleep=self.clock.sleep, jitter=lambda low, high: high)
+
+    def tearDown(self):
+        self.scheduler.wait_for_jobs(5)
+
+    def _counting_job(self):
+        calls = []
+        done = threading.Event()
+
+        def job():
+            calls.append(self.clock.now)
+            done.set()
+        return calls, done, job
+
+    def test_job_runs_after_initial_delay_plus_jitter(self):
+        calls, _, job = self._counting_job()
+        self.scheduler.add_job('scan', job, interval_seconds=600, jitter_seconds=60, initial_delay_seconds=30)
+
+        self.assertEqual(self.scheduler.run_pending(), 90)
+        self.clock.now += 89
+        self.scheduler.run_pending()
+        self.scheduler.wait_for_jobs(5)
+        self.assertEqual(calls, [])
+
+        self.clock.now += 1
+        self.assertEqual(self.scheduler.run_pending(), 600)
+        self.scheduler.wait_for_jobs(5)
+        self.assertEqual(calls, [1090.0])
+
+    def test_jitter_does_not_accumulate(self):
+        calls, _, job = self._counting_job()
+        self.scheduler.add_job('scan', job, interval_seconds=100, jitter_seconds=10)
+
+        for _ in range(3):
+            self.clock.now += self.scheduler.run_pending()
+            self.scheduler.run_pending()
+            self.scheduler.wait_for_jobs(5)
+
+        self.assertEqual(calls, [1010.0, 1110.0, 1210.0])
+
+    def test_overrunning_job_is_skipped(self):
+        release = threading.Event()
+        started = threading.Event()
+
+        def slow_job():
+            started.set()
+            release.wait(5)
+        job = self.scheduler.add_job('port_scan', slow_job, interval_seconds=10)
+
+        self.scheduler.run_pending()
+        self.assertTrue(started.wait(5))
+        self.clock.now += 10
+        self.scheduler.run_pending()
+        self.clock.now += 10
+        self.scheduler.run_pending()
+
+        self.assertEqual(job.runs, 1)
+        self.assertEqual(job.skipped, 2)
+        release.set()
+        self.assertTrue(self.scheduler.wait_for_jobs(5))
+
+    def test_concurrency_limit_allows_parallel_runs(self):
+        release = threading.Event()
+        job = self.scheduler.add_job('router', lambda: release.wait(5), interval_seconds=10, concurrency=2)
+
+        for _ in range(3):
+            self.scheduler.run_pending()
+            self.clock.now += 10
+
+        self.assertEqual(job.runs, 2)
+        self.assertEqual(job.skipped, 1)
+        release.set()
+
+    def test_failing_job_keeps_its_schedule(self):
+        def failing_job():
+            raise RuntimeError('router unreachable')
+        job = self.scheduler.add_job('router', failing_job, interval_seconds=10)
+
+        self.scheduler.run_pending()
+        self.scheduler.wait_for_jobs(5)
+        self.clock.now += 10
+        self.scheduler.run_pending()
+        self.scheduler.wait_for_jobs(5)
+
+        self.assertEqual(job.runs, 2)
+        self.assertEqual(job.running, 0)
+
+    def test_missed_runs_are_not_replayed(self):
+        calls, _, job = self._counting_job()
+        self.scheduler.add_job('scan', job, interval_seconds=10)
+        self.scheduler.run_pending()
+        self.scheduler.wait_for_jobs(5)
+
+        self.clock.now += 1000
+        self.assertEqual(self.scheduler.run_pending(), 10)
+        self.scheduler.wait_for_jobs(5)
+
+        self.assertEqual(len(calls), 2)
+
+    def test_stop_ends_run(self):
+        calls, done, job = self._counting_job()
+        self.scheduler.add_job('health_check', job, interval_seconds=300)
+
+        def stop_after_first_run():
+            done.wait(5)
+            self.scheduler.stop()
+        threading.Thread(target=stop_after_first_run).start()
+        self.scheduler._sleep = lambda seconds: done.wait(5)
+
+        self.scheduler.run()
+
+        self.assertEqual(len(calls), 1)
+        self.assertTrue(self.scheduler.wait_for_jobs(5))
+
+    def _run_until(self, job, runs):
+        while True:
+            self.scheduler.run_pending()
+            self.scheduler.wait_for_jobs(5)
+            if job.runs >= runs:
+                return
+            self.clock.now += self.scheduler.run_pending()
+
+    def test_adaptive_job_backs_off_when_quiet(self):
+        calls, _, job = self._counting_job()
+        scheduled = self.scheduler.add_job('ping_sweep', lambda: job() or 0, interval_seconds=100,
+                                           min_interval_seconds=25, max_interval_seconds=400)
+
+        self._run_until(scheduled, 5)
+
+        self.assertEqual(calls, [1000.0, 1200.0, 1600.0, 2000.0, 2400.0])
+
+    def test_adaptive_job_speeds_up_on_changes(self):
+        results = iter([0, 0, 3, 0])
+        calls, _, job = self._counting_job()
+        scheduled = self.scheduler.add_job('ping_sweep', lambda: job() or next(results), interval_seconds=100,
+                                           min_interval_seconds=25, max_interval_seconds=400)
+
+        self._run_until(scheduled, 4)
+
+        self.assertEqual(calls, [1000.0, 1200.0, 1600.0, 1625.0])
+        self.assertEqual(scheduled.current_interval_seconds, 50)
+
+    def test_adaptive_job_backs_off_after_failures(self):
+        def failing_job():
+            raise RuntimeError('router unreachable')
+        job = self.scheduler.add_job('openwrt', failing_job, interval_seconds=100,
+                                     min_interval_seconds=25, max_interval_seconds=300)
+
+        self._run_until(job, 3)
+
+        self.assertEqual(job.consecutive_failures, 3)
+        self.assertEqual(job.current_interval_seconds, 300)
+
+    def test_fixed_job_ignores_changes(self):
+        job = self.scheduler.add_job('ping_sweep', lambda: 0, interval_seconds=100)
+
+        self._run_until(job, 1)
+
+        self.assertEqual(job.current_interval_seconds, 100)
+        self.assertEqual(self.scheduler.run_pending(), 100)
+
+    def test_adaptive_interval_must_be_within_bounds(self):
+        with self.assertRaises(ValueError):
+            self.scheduler.add_job('scan', lambda: None, interval_seconds=10, min_interval_seconds=20,
+                                   max_interval_seconds=40)
+
+    def test_duplicate_job_name_is_rejected(self):
+        self.scheduler.add_job('scan', lambda: None, interval_seconds=10)
+
+        with self.assertRaises(ValueError):
+            self.scheduler.add_job('scan', lambda: None, interval_seconds=10)
+
+    def test_invalid_interval_is_rejected(self):
+        with self.assertRaises(ValueError):
+            self.scheduler.add_job('scan', lambda: None, interval_seconds=0)
+
+
+if __name__ == '__main__':
+    unittest.main()
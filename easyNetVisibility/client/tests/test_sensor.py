@@ -0,0 +1,41 @@
+import os
+import sys
+import unittest
+from unittest.mock import patch
+
+# Add the sensor directory to Python path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'sensor'))
+
+import sensor
+
+
+class TestPortScanJob(unittest.TestCase):
+    @patch('server_api.add_ports')
+    @patch('nmap.port_scan')
+    def test_upload_error_does_not_stop_the_scan(self, mock_port_scan, mock_add_ports):
+        mock_port_scan.return_value = iter([[{'mac': 'AA', 'port': '22'}], [{'mac': 'BB', 'port': '80'}]])
+        mock_add_ports.side_effect = [Exception("Connection refused"), (200, {})]
+
+        sensor.port_scan()
+
+        self.assertEqual(mock_add_ports.call_count, 2)
+
+
+class TestPingSweepJob(unittest.TestCase):
+    @patch('server_api.report_devices')
+    @patch('nmap.iter_ping_sweep')
+    def test_failed_sweep_raises_after_uploading_what_was_found(self, mock_iter_ping_sweep, mock_report_devices):
+        def sweep():
+            yield {'mac': 'AABBCCDDEE01', 'ip': '192.168.1.1'}
+            raise Exception("Ping sweep failed for 1 of 2 networks")
+        mock_iter_ping_sweep.return_value = sweep()
+
+        # The scheduler sees the failure and backs off
+        with self.assertRaises(Exception):
+            sensor.ping_sweep()
+
+        mock_report_devices.assert_called_once_with('ping_sweep', [{'mac': 'AABBCCDDEE01', 'ip': '192.168.1.1'}])
+
+
+if __name__ == '__main__':
+    unittest.main()
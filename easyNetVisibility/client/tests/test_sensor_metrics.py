@@ -0,0 +1,139 @@
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+from unittest.mock import MagicMock, patch
+
+# Add the sensor directory to Python path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'sensor'))
+
+import sensor_metrics
+import server_api
+
+
+class TestSensorMetrics(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.status_file = os.path.join(self.temp_dir, 'sensor_status.json')
+        sensor_metrics.init(self.status_file)
+
+    def tearDown(self):
+        sensor_metrics.init(None)
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def test_cycle_records_duration_and_found(self):
+        with sensor_metrics.cycle('ping_sweep') as cycle:
+            cycle.found(12)
+
+        stats = sensor_metrics.snapshot()['loops']['ping_sweep']
+        self.assertEqual(stats['cycles'], 1)
+        self.assertEqual(stats['failures'], 0)
+        self.assertEqual(stats['last_found'], 12)
+        self.assertIsNotNone(stats['last_duration_seconds'])
+        self.assertIsNone(stats['last_error'])
+
+    def test_failed_cycle_is_recorded_and_reraised(self):
+        with self.assertRaises(ValueError):
+            with sensor_metrics.cycle('fortigate'):
+                raise ValueError("connection refused")
+
+        stats = sensor_metrics.snapshot()['loops']['fortigate']
+        self.assertEqual((stats['cycles'], stats['failures']), (1, 1))
+        self.assertEqual(stats['last_error'], "ValueError: connection refused")
+
+    def test_uploads_are_attributed_to_the_running_loop(self):
+        with sensor_metrics.cycle('port_scan'):
+            sensor_metrics.record_upload(1000, 0.2)
+            sensor_metrics.record_upload(0, 0.4, failed=True)
+            sensor_metrics.record_retry()
+
+        # Another thread outside of any cycle
+        thread = threading.Thread(target=sensor_metrics.record_upload, args=(50, 0.1))
+        thread.start()
+        thread.join()
+
+        loops = sensor_metrics.snapshot()['loops']
+        self.assertEqual(loops['port_scan']['uploads'], 2)
+        self.assertEqual(loops['port_scan']['upload_failures'], 1)
+        self.assertEqual(loops['port_scan']['upload_retries'], 1)
+        self.assertEqual(loops['port_scan']['bytes_sent'], 1000)
+        self.assertEqual(loops['port_scan']['avg_upload_ms'], 300.0)
+        self.assertEqual(loops['other']['bytes_sent'], 50)
+
+    def test_status_file_is_written_after_each_cycle(self):
+        with sensor_metrics.cycle('health_check'):
+            pass
+
+        with open(self.status_file) as f:
+            status = json.load(f)
+        self.assertEqual(status['loops']['health_check']['cycles'], 1)
+        self.assertEqual(os.listdir(self.temp_dir), ['sensor_status.json'])
+
+    def test_missing_status_directory_is_created(self):
+        status_file = os.path.join(self.temp_dir, 'missing', 'sensor_status.json')
+        sensor_metrics.init(status_file)
+
+        with sensor_metrics.cycle('health_check'):
+            pass
+
+        self.assertTrue(os.path.exists(status_file))
+
+    def test_unwritable_status_file_does_not_fail_the_cycle(self):
+        # A file where the directory should be
+        blocker = os.path.join(self.temp_dir, 'blocker')
+        open(blocker, 'w').close()
+        sensor_metrics.init(os.path.join(blocker, 'sensor_status.json'))
+
+        with sensor_metrics.cycle('ping_sweep'):
+            pass
+
+        self.assertEqual(sensor_metrics.snapshot()['loops']['ping_sweep']['cycles'], 1)
+
+
+    def test_process_stats(self):
+        stats = sensor_metrics.process_stats()
+
+        self.assertGreater(stats['cpu_seconds'], 0)
+        if os.path.exists('/proc/self/statm'):
+            self.assertGreater(stats['rss_bytes'], 0)
+
+
+class TestServerApiMetrics(unittest.TestCase):
+    def setUp(self):
+        sensor_metrics.init(None)
+        server_api.init('http://server', None, None, False, 10)
+        server_api.init_compression('none')
+        server_api._csrf_token = 'token'
+
+    @patch('server_api.get_session')
+    def test_post_records_upload(self, mock_get_session):
+        response = MagicMock(status_code=200)
+        response.json.return_value = {}
+        response.request.body = b'{"devices": []}'
+        mock_get_session.return_value.post.return_value = response
+
+        with sensor_metrics.cycle('openwrt'):
+            server_api.post('/api/addDevices', {'devices': []})
+
+        stats = sensor_metrics.snapshot()['loops']['openwrt']
+        self.assertEqual(stats['uploads'], 1)
+        self.assertEqual(stats['bytes_sent'], len(b'{"devices": []}'))
+        self.assertEqual(stats['upload_failures'], 0)
+
+    @patch('server_api.get_session')
+    def test_post_records_failed_upload(self, mock_get_session):
+        mock_get_session.return_value.post.side_effect = ConnectionError("unreachable")
+
+        with self.assertRaises(ConnectionError):
+            with sensor_metrics.cycle('ddwrt'):
+                server_api.post('/api/addDevices', {'devices': []})
+
+        stats = sensor_metrics.snapshot()['loops']['ddwrt']
+        self.assertEqual((stats['uploads'], stats['upload_failures'], stats['failures']), (1, 1, 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,5 +1,11 @@
+import datetime
+import gzip
+import http.server
+import json
 import os
 import sys
+import tempfile
+import threading
 import unittest
 from unittest.mock import patch, MagicMock
 
@@ -72,6 +78,8 @@ class TestGenerateSession(unittest.TestCase):
 
         self.assertIsNotNone(session)
         self.assertEqual(session.auth, ('user', 'pass'))
+        # Connection pooling adapter is mounted for both schemes
+        self.assertEqual(mock_session.mount.call_count, 2)
 
     @patch('server_api.requests.Session')
     def test_generate_session_without_auth(self, mock_session_class):
@@ -114,6 +122,8 @@ class TestPost(unittest.TestCase):
         server_api._call_timeout = 30
         server_api._server_username = 'testuser'
         server_api._server_password = 'testpass'
+        server_api._session = None
+        server_api._csrf_token = None
 
     @patch('server_api.get_csrf_token')
     @patch('server_api.generate_session')
@@ -162,12 +172,190 @@ class TestPost(unittest.TestCase):
         self.assertIn('Referer', headers)
 
 
+    @patch('server_api.get_csrf_token')
+    @patch('server_api.generate_session')
+    def test_post_reuses_session_and_csrf_token(self, mock_generate_session, mock_get_csrf):
+        mock_session = MagicMock()
+        mock_session.post.return_value.status_code = 200
+        mock_session.post.return_value.json.return_value = {}
+        mock_generate_session.return_value = mock_session
+        mock_get_csrf.return_value = 'csrf-token-123'
+
+        server_api.post('/api/test', {})
+        server_api.post('/api/test', {})
+
+        mock_generate_session.assert_called_once()
+        mock_get_csrf.assert_called_once()
+        self.assertEqual(mock_session.post.call_count, 2)
+
+    @patch('server_api.get_csrf_token')
+    @patch('server_api.generate_session')
+    def test_post_refreshes_rejected_csrf_token(self, mock_generate_session, mock_get_csrf):
+        mock_session = MagicMock()
+        rejected = MagicMock(status_code=403)
+        accepted = MagicMock(status_code=200)
+        accepted.json.return_value = {'status': 'success'}
+        mock_session.post.side_effect = [rejected, accepted]
+        mock_generate_session.return_value = mock_session
+        mock_get_csrf.side_effect = ['old-token', 'new-token']
+
+        status_code, response_data = server_api.post('/api/test', {})
+
+        self.assertEqual(status_code, 200)
+        self.assertEqual(mock_get_csrf.call_count, 2)
+        self.assertEqual(mock_session.post.call_args[1]['headers']['X-CSRFToken'], 'new-token')
+        self.assertEqual(server_api._csrf_token, 'new-token')
+
+
+class _OldServerHandler(http.server.BaseHTTPRequestHandler):
+    """An older server: no request decompression and no /api/devicesSeen."""
+    received = []
+
+    def _reply(self, status_code, body, content_type='application/json'):
+        self.send_response(status_code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self._reply(200, json.dumps({'csrfToken': 'csrf-token-123'}).encode())
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.received.append((self.path, self.headers.get('Content-Encoding'), body))
+        if self.path not in ('/api/addDevices', '/api/addPorts'):
+            self._reply(404, b'<html><body><h1>Not Found</h1></body></html>', content_type='text/html')
+            return
+        try:
+            json.loads(body)
+        except ValueError:
+            self._reply(400, json.dumps({'error': 'Invalid JSON body.'}).encode())
+            return
+        self._reply(200, json.dumps({'success_count': 1, 'errors': []}).encode())
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _OldServer:
+    def __enter__(self):
+        _OldServerHandler.received = []
+        self.httpd = http.server.ThreadingHTTPServer(('127.0.0.1', 0), _OldServerHandler)
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        server_api._server_api_address = 'http://127.0.0.1:%d' % self.httpd.server_address[1]
+        server_api._session = None
+        server_api._csrf_token = None
+        return _OldServerHandler.received
+
+    def __exit__(self, *exc_info):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        server_api._session = None
+        server_api._csrf_token = None
+
+
+class TestCompression(unittest.TestCase):
+    def setUp(self):
+        server_api._server_api_address = 'https://test-server.com'
+        server_api._session = None
+        server_api._csrf_token = None
+        self._original_compression = server_api._compression
+
+    def tearDown(self):
+        server_api._compression = self._original_compression
+
+    def _mock_session(self, mock_generate_session, mock_get_csrf, *status_codes):
+        mock_session = MagicMock()
+        responses = []
+        for status_code in status_codes:
+            response = MagicMock(status_code=status_code)
+            response.json.return_value = {}
+            responses.append(response)
+        mock_session.post.side_effect = responses
+        mock_generate_session.return_value = mock_session
+        mock_get_csrf.return_value = 'csrf-token-123'
+        return mock_session
+
+    @patch('server_api.get_csrf_token')
+    @patch('server_api.generate_session')
+    def test_large_body_is_gzipped(self, mock_generate_session, mock_get_csrf):
+        mock_session = self._mock_session(mock_generate_session, mock_get_csrf, 200)
+        server_api.init_compression('gzip')
+        data = {'ports': [{'mac': 'AABBCCDDEEFF', 'port': port, 'product': 'OpenSSH'} for port in range(100)]}
+
+        server_api.post('/api/addPorts', data)
+
+        call_args = mock_session.post.call_args
+        self.assertEqual(call_args[1]['headers']['Content-Encoding'], 'gzip')
+        self.assertEqual(call_args[1]['headers']['Content-Type'], 'application/json')
+        self.assertEqual(json.loads(gzip.decompress(call_args[1]['data'])), data)
+        self.assertNotIn('json', call_args[1])
+
+    @patch('server_api.get_csrf_token')
+    @patch('server_api.generate_session')
+    def test_small_body_is_not_compressed(self, mock_generate_session, mock_get_csrf):
+        mock_session = self._mock_session(mock_generate_session, mock_get_csrf, 200)
+        server_api.init_compression('gzip')
+
+        server_api.post('/api/sensorHealth', {'mac': 'AABBCCDDEEFF'})
+
+        call_args = mock_session.post.call_args
+        self.assertEqual(call_args[1]['json'], {'mac': 'AABBCCDDEEFF'})
+        self.assertNotIn('Content-Encoding', call_args[1]['headers'])
+
+    @patch('server_api.get_csrf_token')
+    @patch('server_api.generate_session')
+    def test_unsupported_compression_falls_back(self, mock_generate_session, mock_get_csrf):
+        mock_session = self._mock_session(mock_generate_session, mock_get_csrf, 415, 200)
+        server_api.init_compression('gzip')
+        data = {'devices': [{'mac': '%012d' % i} for i in range(100)]}
+
+        status_code, _ = server_api.post('/api/addDevices', data)
+
+        self.assertEqual(status_code, 200)
+        self.assertEqual(mock_session.post.call_args[1]['json'], data)
+        self.assertEqual(server_api._compression, 'none')
+
+    def test_server_without_decompression_falls_back(self):
+        server_api.init_compression('gzip')
+        data = {'devices': [{'mac': '%012d' % i} for i in range(100)]}
+
+        with _OldServer() as received:
+            status_code, _ = server_api.post('/api/addDevices', data)
+
+        self.assertEqual(status_code, 200)
+        self.assertEqual([encoding for _, encoding, _ in received], ['gzip', None])
+        self.assertEqual(json.loads(received[1][2]), data)
+        self.assertEqual(server_api._compression, 'none')
+
+    @patch('server_api.get_csrf_token')
+    @patch('server_api.generate_session')
+    def test_bad_request_keeps_compression(self, mock_generate_session, mock_get_csrf):
+        mock_session = self._mock_session(mock_generate_session, mock_get_csrf, 400, 400)
+        server_api.init_compression('gzip')
+        data = {'devices': [{'mac': 'bad'} for _ in range(100)]}
+
+        status_code, _ = server_api.post('/api/addDevices', data)
+
+        self.assertEqual(status_code, 400)
+        self.assertEqual(mock_session.post.call_count, 2)
+        self.assertEqual(server_api._compression, 'gzip')
+
+    @patch('server_api.zstandard', None)
+    def test_zstd_without_package_uses_gzip(self):
+        server_api.init_compression('zstd')
+
+        self.assertEqual(server_api._compression, 'gzip')
+
+
 class TestGet(unittest.TestCase):
     def setUp(self):
         server_api._server_api_address = 'https://test-server.com'
         server_api._validate_server_identity = False
         server_api._call_timeout = 60
         server_api._server_username = None
+        server_api._session = None
 
     @patch('server_api.generate_session')
     def test_get_success(self, mock_generate_session):
@@ -234,5 +422,217 @@ class TestApiHelpers(unittest.TestCase):
         mock_post.assert_called_once_with('/api/sensorHealth', health_info)
 
 
+class TestProgressiveUpload(unittest.TestCase):
+    def setUp(self):
+        self._original_chunk_size = server_api._upload_chunk_size
+        self._original_max_delay = server_api._upload_max_delay
+
+    def tearDown(self):
+        server_api._upload_chunk_size = self._original_chunk_size
+        server_api._upload_max_delay = self._original_max_delay
+
+    @patch('server_api.add_devices')
+    def test_uploads_in_chunks(self, mock_add_devices):
+        mock_add_devices.return_value = (200, {'status': 'success'})
+        server_api.init_upload(2, 60)
+        devices = [{'mac': str(i)} for i in range(5)]
+
+        count = server_api.add_devices_progressively('ping_sweep', iter(devices))
+
+        self.assertEqual(count, 5)
+        self.assertEqual([call[0][0] for call in mock_add_devices.call_args_list],
+                         [devices[0:2], devices[2:4], devices[4:5]])
+
+    @patch('server_api.add_devices')
+    def test_sends_partial_chunk_after_max_delay(self, mock_add_devices):
+        mock_add_devices.return_value = (200, {'status': 'success'})
+        server_api.init_upload(100, 0.05)
+        first_chunk_sent = threading.Event()
+        mock_add_devices.side_effect = lambda chunk: first_chunk_sent.set() or (200, {})
+
+        def slow_sweep():
+            yield {'mac': '1'}
+            # The first device must not wait for the rest of the sweep
+            self.assertTrue(first_chunk_sent.wait(timeout=5))
+            yield {'mac': '2'}
+
+        count = server_api.add_devices_progressively('ping_sweep', slow_sweep())
+
+        self.assertEqual(count, 2)
+        self.assertEqual([call[0][0] for call in mock_add_devices.call_args_list],
+                         [[{'mac': '1'}], [{'mac': '2'}]])
+
+    @patch('server_api.add_devices')
+    def test_failed_chunk_does_not_stop_upload(self, mock_add_devices):
+        mock_add_devices.side_effect = [Exception("Read timed out"), (200, {'status': 'success'})]
+        server_api.init_upload(1, 60)
+
+        count = server_api.add_devices_progressively('ping_sweep', iter([{'mac': '1'}, {'mac': '2'}]))
+
+        self.assertEqual(count, 2)
+        self.assertEqual(mock_add_devices.call_count, 2)
+
+    @patch('server_api.add_devices')
+    def test_nothing_sent_for_empty_sweep(self, mock_add_devices):
+        count = server_api.add_devices_progressively('ping_sweep', iter([]))
+
+        self.assertEqual(count, 0)
+        mock_add_devices.assert_not_called()
+
+
+class TestDeltaSync(unittest.TestCase):
+    def setUp(self):
+        server_api.init_delta_sync(True, 6)
+        self.device = {'mac': 'AABBCCDDEEFF', 'ip': '10.0.0.1', 'hostname': 'host', 'vendor': 'Vendor'}
+
+    def tearDown(self):
+        server_api.init_delta_sync(False, 6)
+
+    @patch('server_api.post')
+    def test_unchanged_devices_only_refresh_last_seen(self, mock_post):
+        mock_post.return_value = (200, {'success_count': 1, 'errors': []})
+
+        server_api.report_devices('fortigate', [self.device])
+        server_api.report_devices('fortigate', [self.device])
+
+        self.assertEqual(mock_post.call_args_list[0][0], ('/api/addDevices', {'devices': [self.device]}))
+        url, data = mock_post.call_args_list[1][0]
+        self.assertEqual(url, '/api/devicesSeen')
+        self.assertEqual(data['macs'], ['AABBCCDDEEFF'])
+        self.assertTrue(data['timestamp'].endswith('+00:00'))
+
+    @patch('server_api.post')
+    def test_unknown_devices_are_sent_in_full_next_time(self, mock_post):
+        mock_post.return_value = (200, {'success_count': 1, 'errors': []})
+        server_api.report_devices('fortigate', [self.device])
+        mock_post.return_value = (200, {'updated_count': 0, 'unknown_macs': ['AABBCCDDEEFF'], 'errors': []})
+        server_api.report_devices('fortigate', [self.device])
+
+        mock_post.return_value = (200, {'success_count': 1, 'errors': []})
+        server_api.report_devices('fortigate', [self.device])
+
+        self.assertEqual([call[0][0] for call in mock_post.call_args_list],
+                         ['/api/addDevices', '/api/devicesSeen', '/api/addDevices'])
+
+    @patch('server_api.post')
+    def test_sources_are_tracked_separately(self, mock_post):
+        mock_post.return_value = (200, {'success_count': 1, 'errors': []})
+
+        server_api.report_devices('fortigate', [self.device])
+        server_api.report_devices('openwrt', [self.device])
+
+        self.assertEqual([call[0][0] for call in mock_post.call_args_list], ['/api/addDevices', '/api/addDevices'])
+
+    @patch('server_api.post')
+    def test_rejected_device_is_sent_again(self, mock_post):
+        mock_post.return_value = (200, {'success_count': 0, 'errors': [{'index': 0, 'error': 'ip: invalid'}]})
+
+        server_api.report_devices('fortigate', [self.device])
+        server_api.report_devices('fortigate', [self.device])
+
+        self.assertEqual([call[0][0] for call in mock_post.call_args_list], ['/api/addDevices', '/api/addDevices'])
+
+    @patch('server_api.post')
+    def test_failed_refresh_sends_full_next_time(self, mock_post):
+        mock_post.return_value = (200, {'success_count': 1, 'errors': []})
+        server_api.report_devices('fortigate', [self.device])
+        mock_post.side_effect = [Exception("Connection refused")]
+        server_api.report_devices('fortigate', [self.device])
+
+        mock_post.side_effect = None
+        server_api.report_devices('fortigate', [self.device])
+
+        self.assertEqual(mock_post.call_args[0][0], '/api/addDevices')
+
+    def test_server_without_endpoint_disables_delta_sync(self):
+        with _OldServer() as received:
+            server_api.report_devices('fortigate', [self.device])
+            # The old server answers /api/devicesSeen with an HTML 404 page
+            server_api.report_devices('fortigate', [self.device])
+
+        self.assertEqual([path for path, _, _ in received], ['/api/addDevices', '/api/devicesSeen', '/api/addDevices'])
+        self.assertEqual(json.loads(received[2][2]), {'devices': [self.device]})
+        self.assertFalse(server_api._delta_sync)
+
+
+class TestOfflineSpool(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        server_api.init_spool(os.path.join(self._dir.name, 'spool.db'), 100)
+
+    def tearDown(self):
+        server_api._spool = None
+        self._dir.cleanup()
+
+    @patch('server_api.post')
+    def test_failed_upload_is_spooled_and_replayed_with_its_timestamp(self, mock_post):
+        mock_post.side_effect = Exception("Connection refused")
+        devices = [{'mac': 'AA', 'ip': '10.0.0.1'}]
+
+        with self.assertRaises(Exception):
+            server_api.add_devices(devices)
+        self.assertEqual(server_api._spool.count(), 1)
+
+        # The next upload doesn't wait for the replay
+        mock_post.side_effect = None
+        mock_post.return_value = (200, {'status': 'success'})
+        server_api.add_ports([{'mac': 'BB', 'port': 22}])
+        self.assertEqual(mock_post.call_count, 2)
+        self.assertEqual(server_api._spool.count(), 1)
+
+        server_api.replay_spool()
+
+        url_postfix, data = mock_post.call_args[0]
+        self.assertEqual(url_postfix, '/api/addDevices')
+        replayed = data['devices'][0]
+        self.assertEqual(replayed['mac'], 'AA')
+        seen_at = datetime.datetime.fromisoformat(replayed['seen_at'])
+        self.assertLess(datetime.datetime.now(datetime.timezone.utc) - seen_at, datetime.timedelta(minutes=1))
+        self.assertEqual(server_api._spool.count(), 0)
+
+    @patch('server_api.post')
+    def test_server_error_is_spooled(self, mock_post):
+        mock_post.return_value = (503, {})
+
+        result = server_api.report_sensor_health({'mac': 'AA', 'hostname': 'sensor1'})
+
+        self.assertEqual(result, (503, {}))
+        self.assertEqual(server_api._spool.count(), 1)
+
+    @patch('server_api.post')
+    def test_rejected_upload_is_not_spooled(self, mock_post):
+        mock_post.return_value = (400, {'error': 'invalid mac'})
+
+        server_api.add_devices([{'mac': 'bad'}])
+
+        self.assertEqual(server_api._spool.count(), 0)
+
+    @patch('server_api.time.monotonic')
+    @patch('server_api.post')
+    def test_failed_replay_backs_off(self, mock_post, mock_monotonic):
+        mock_monotonic.return_value = 1000
+        server_api._spool.add('devices', [{'mac': 'AA'}])
+        mock_post.return_value = (500, {})
+
+        server_api.replay_spool()
+        self.assertEqual(mock_post.call_count, 1)
+        self.assertEqual(server_api._replay_backoff, server_api._REPLAY_MIN_BACKOFF)
+
+        # Still backing off, nothing is sent
+        server_api.replay_spool()
+        self.assertEqual(mock_post.call_count, 1)
+
+        mock_monotonic.return_value = 1000 + server_api._REPLAY_MIN_BACKOFF
+        server_api.replay_spool()
+        self.assertEqual(mock_post.call_count, 2)
+        self.assertEqual(server_api._replay_backoff, server_api._REPLAY_MIN_BACKOFF * 2)
+
+        mock_monotonic.return_value = 2000
+        mock_post.return_value = (200, {})
+        server_api.replay_spool()
+        self.assertEqual(server_api._spool.count(), 0)
+        self.assertEqual(server_api._replay_backoff, 0)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,74 @@
+import os
+import sys
+import tempfile
+import unittest
+
+# Add the sensor directory to Python path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'sensor'))
+
+import upload_spool
+
+
+class TestUploadSpool(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self.spool = upload_spool.UploadSpool(os.path.join(self._dir.name, 'spool.db'), 100)
+
+    def tearDown(self):
+        self._dir.cleanup()
+
+    def test_add_and_peek(self):
+        self.spool.add(upload_spool.DEVICES, [{'mac': 'AA', 'ip': '10.0.0.1'}, {'mac': 'BB', 'ip': '10.0.0.2'}])
+
+        rows = self.spool.peek(upload_spool.DEVICES, 10)
+
+        self.assertEqual([item for _, item in rows], [{'mac': 'AA', 'ip': '10.0.0.1'}, {'mac': 'BB', 'ip': '10.0.0.2'}])
+        self.assertEqual(self.spool.peek(upload_spool.PORTS, 10), [])
+
+    def test_same_device_is_merged(self):
+        self.spool.add(upload_spool.DEVICES, [{'mac': 'AA', 'ip': '10.0.0.1'}])
+        self.spool.add(upload_spool.DEVICES, [{'mac': 'AA', 'ip': '10.0.0.9'}])
+
+        rows = self.spool.peek(upload_spool.DEVICES, 10)
+
+        self.assertEqual([item for _, item in rows], [{'mac': 'AA', 'ip': '10.0.0.9'}])
+
+    def test_ports_are_merged_per_device_and_port(self):
+        self.spool.add(upload_spool.PORTS, [{'mac': 'AA', 'port': 22}, {'mac': 'AA', 'port': 80}])
+        self.spool.add(upload_spool.PORTS, [{'mac': 'AA', 'port': 80, 'name': 'http'}])
+
+        self.assertEqual(self.spool.count(), 2)
+
+    def test_remove_keeps_newer_payload(self):
+        self.spool.add(upload_spool.DEVICES, [{'mac': 'AA', 'ip': '10.0.0.1'}])
+        replayed = self.spool.peek(upload_spool.DEVICES, 10)
+        # The device is spooled again while the replay is in flight
+        self.spool.add(upload_spool.DEVICES, [{'mac': 'AA', 'ip': '10.0.0.9'}])
+
+        self.spool.remove([row_id for row_id, _ in replayed])
+
+        self.assertEqual([item for _, item in self.spool.peek(upload_spool.DEVICES, 10)], [{'mac': 'AA', 'ip': '10.0.0.9'}])
+
+    def test_oldest_entries_dropped_when_full(self):
+        self.spool.max_entries = 2
+        self.spool.add(upload_spool.DEVICES, [{'mac': 'AA'}, {'mac': 'BB'}, {'mac': 'CC'}])
+
+        self.assertEqual([item for _, item in self.spool.peek(upload_spool.DEVICES, 10)], [{'mac': 'BB'}, {'mac': 'CC'}])
+
+    def test_missing_directory_is_created(self):
+        spool = upload_spool.UploadSpool(os.path.join(self._dir.name, 'missing', 'spool.db'), 100)
+
+        spool.add(upload_spool.DEVICES, [{'mac': 'AA', 'ip': '10.0.0.1'}])
+
+        self.assertEqual(len(spool.peek(upload_spool.DEVICES, 10)), 1)
+
+    def test_spool_survives_reopen(self):
+        self.spool.add(upload_spool.HEALTH, [{'mac': 'AA', 'hostname': 'sensor1'}])
+
+        reopened = upload_spool.UploadSpool(self.spool.path, 100)
+
+        self.assertEqual(reopened.count(), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+import gzip
+import io
+import zlib
+
+from django.conf import settings
+from django.http import HttpResponse
+
+# zstd support is optional
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+_READ_CHUNK_SIZE = 64 * 1024
+
+_DECOMPRESSION_ERRORS = (OSError, EOFError, zlib.error, ValueError)
+if zstandard is not None:
+    _DECOMPRESSION_ERRORS += (zstandard.ZstdError,)
+
+
+class _BodyTooLarge(Exception):
+    pass
+
+
+def _read_limited(stream, limit):
+    """Read a decompressing stream, giving up once more than limit bytes come out."""
+    chunks = []
+    size = 0
+    while True:
+        chunk = stream.read(_READ_CHUNK_SIZE)
+        if not chunk:
+            return b''.join(chunks)
+        size += len(chunk)
+        if limit is not None and size > limit:
+            raise _BodyTooLarge()
+        chunks.append(chunk)
+
+
+def _decompress(encoding, body, limit):
+    if encoding == 'gzip':
+        with gzip.GzipFile(fileobj=io.BytesIO(body)) as stream:
+            return _read_limited(stream, limit)
+    with zstandard.ZstdDecompressor().stream_reader(body) as stream:
+        return _read_limited(stream, limit)
+
+
+class RequestDecompressionMiddleware:
+    """
+    Transparently decompress request bodies sent with Content-Encoding gzip or zstd,
+    so the views and DRF parsers see plain JSON.
+    The decompressed size is held to DATA_UPLOAD_MAX_MEMORY_SIZE like any other body.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        encoding = request.META.get('HTTP_CONTENT_ENCODING', '').strip().lower()
+        if encoding and encoding != 'identity':
+            if encoding not in self.supported_encodings():
+                return HttpResponse(f"Unsupported Content-Encoding: {encoding}", status=415)
+            try:
+                body = _decompress(encoding, request.body, settings.DATA_UPLOAD_MAX_MEMORY_SIZE)
+            except _BodyTooLarge:
+                return HttpResponse("Request body exceeded DATA_UPLOAD_MAX_MEMORY_SIZE", status=413)
+            except _DECOMPRESSION_ERRORS as e:
+                return HttpResponse(f"Invalid {encoding} request body: {e}", status=400)
+
+            # Replace the body before anything parses it
+            request._body = body
+            request.META['CONTENT_LENGTH'] = str(len(body))
+            del request.META['HTTP_CONTENT_ENCODING']
+
+        return self.get_response(request)
+
+    @staticmethod
+    def supported_encodings():
+        if zstandard is None:
+            return ('gzip',)
+        return ('gzip', 'zstd')
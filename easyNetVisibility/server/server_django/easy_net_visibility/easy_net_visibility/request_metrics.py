@@ -0,0 +1,34 @@
+import time
+
+from django.db import connection
+from easy_net_visibility_server import metrics
+
+
+class RequestMetricsMiddleware:
+    """
+    Records the latency and the number of database queries of every request, labelled
+    with the name of the URL pattern it resolved to. Requests that didn't resolve to a
+    view (404s) share one label so the label set stays bounded.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        query_count = 0
+
+        def count_queries(execute, sql, params, many, context):
+            nonlocal query_count
+            query_count += 1
+            return execute(sql, params, many, context)
+
+        started = time.perf_counter()
+        with connection.execute_wrapper(count_queries):
+            response = self.get_response(request)
+        elapsed = time.perf_counter() - started
+
+        match = getattr(request, 'resolver_match', None)
+        view = match.url_name if match is not None and match.url_name else 'unmatched'
+        metrics.REQUEST_DURATION.labels(view).observe(elapsed)
+        metrics.REQUEST_DB_QUERIES.labels(view).observe(query_count)
+        return response
@@ -1,8 +1,10 @@
 from django.contrib import admin
 
-from .models import Device, Port, Sensor
+from .models import Device, NotificationOutbox, Port, Sensor, SensorStats
 
 # Register your models here.
 admin.site.register(Device)
 admin.site.register(Port)
 admin.site.register(Sensor)
+admin.site.register(NotificationOutbox)
+admin.site.register(SensorStats)
@@ -1,21 +1,30 @@
 import datetime
 import logging
 import traceback
+from collections import defaultdict
 
 from django.conf import settings
 from django.core.exceptions import ValidationError
+from django.db import connections, router, transaction
+from django.db.models import Q
 from django.http import HttpResponse, JsonResponse
+from django.utils.dateparse import parse_datetime
 from django.views.decorators.csrf import get_token
-from rest_framework.decorators import api_view
+from rest_framework.decorators import api_view, renderer_classes
+from rest_framework.renderers import BaseRenderer
 from rest_framework.response import Response
 
-from . import validators
+from . import metrics, sensor_telemetry, validators, write_coalescing
 from .models import Device, Port, Sensor
-from .pushover_notifier import get_notifier
+from .notification_dispatcher import enqueue_new_devices, get_notification_dispatcher
 
-# If a device was seen within this threshold, don't update last_seen again
-# This is disabled because it didn't effect the performance in a meaningful way
-_LAST_SEEN_THRESHOLD_MINUTES = 0
+# Maximum number of rows per INSERT/UPDATE statement when writing batches
+_BULK_BATCH_SIZE = 500
+_DEVICE_UPDATE_FIELDS = ['hostname', 'ip', 'ip_key', 'subnet_key', 'vendor', 'last_seen']
+_PORT_UPDATE_FIELDS = ['protocol', 'name', 'product', 'version', 'last_seen']
+
+# Number of devices whose ports are looked up in a single query, keeps the OR chain short
+_PORT_PREFETCH_DEVICE_CHUNK = 200
 
 _logger = logging.getLogger(__name__)
 
@@ -96,60 +105,164 @@ def get_csrf_token(request):
     return HttpResponse(token)
 
 
-def _process_device(device: Device, existing_devices_map):
+def _bulk_create_conflict_kwargs(model, unique_fields, update_fields):
+    """
+    Build bulk_create() arguments that turn a conflicting insert into an update.
+    Uses native upserts (ON CONFLICT / ON DUPLICATE KEY) when the database supports them.
+    """
+    features = connections[router.db_for_write(model)].features
+    if features.supports_update_conflicts_with_target:
+        return {'update_conflicts': True, 'unique_fields': unique_fields, 'update_fields': update_fields}
+    if features.supports_update_conflicts:
+        return {'update_conflicts': True, 'update_fields': update_fields}
+    return {}
+
+
+def _merge_device(target: Device, device: Device, seen_at):
+    """
+    Copy the reported fields of device into target, seen at seen_at, and validate the result.
+    On validation errors target is restored and the ValidationError is raised.
+    """
+    previous = (target.hostname, target.ip, target.vendor, target.last_seen)
+    target.hostname = device.hostname
+    target.ip = device.ip
+
+    # Only update vendor if provided, to avoid overwriting with empty value
+    if device.vendor:
+        target.vendor = device.vendor
+
+    target.last_seen = seen_at
+    try:
+        target.clean()
+    except ValidationError:
+        target.hostname, target.ip, target.vendor, target.last_seen = previous
+        raise
+    target.update_ip_keys()
+
+
+def _parse_seen_timestamp(value, now):
     """
-    Helper to add or update a device. Returns (status_code: int, error: str or None)
-    existing_devices_map: dict mapping mac -> Device
+    Parse an optional ISO 8601 timestamp of a sensor report into a naive local datetime.
+    Returns now when no timestamp is given, raises ValueError when it can't be parsed.
     """
+    if value in (None, ''):
+        return now
+    timestamp = parse_datetime(value) if isinstance(value, str) else None
+    if timestamp is None:
+        raise ValueError(f"Invalid timestamp: {value}")
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone().replace(tzinfo=None)
+    # A sensor clock running ahead must not push last_seen into the future
+    return min(timestamp, now)
+
+
+def _device_fingerprint(device: Device):
+    """The reported fields of a device, identical fingerprints need no write."""
+    return device.hostname, device.ip, device.vendor
+
+
+def _upsert_devices(devices, seen_at=None):
+    """
+    Add or update a batch of devices with set-based writes in a single transaction.
+    seen_at optionally holds the raw seen_at of each device, for records observed before the
+    request (e.g. replayed from a sensor's offline spool); a record older than the stored
+    device is skipped.
+    Returns a list of (status_code: int, error: str or None), one entry per input device.
+    """
+    results = [(200, None)] * len(devices)
     now = datetime.datetime.now()
-    if device.mac not in existing_devices_map:
+    threshold = datetime.timedelta(seconds=write_coalescing.threshold_seconds(write_coalescing.DEVICE))
+    if seen_at is None:
+        seen_at = [None] * len(devices)
+
+    # Devices written with the same details a moment ago don't need the database at all
+    fingerprints = {d.mac: _device_fingerprint(d) for d in devices if d.mac}
+    coalesced_macs = write_coalescing.unchanged_keys(write_coalescing.DEVICE, fingerprints)
+    coalesced_count = sum(1 for d in devices if d.mac in coalesced_macs)
+    devices_to_write = [(idx, d) for idx, d in enumerate(devices) if d.mac not in coalesced_macs]
+
+    existing_devices = Device.objects.filter(mac__in={d.mac for _, d in devices_to_write if d.mac})
+    existing_devices_map = {d.mac: d for d in existing_devices}
+
+    new_devices = {}
+    changed_devices = {}
+    fresh_macs = set()
+    # Written with an older timestamp, not remembered as just seen by write coalescing
+    backdated_macs = set()
+    pending_indexes = defaultdict(list)
+    for idx, device in devices_to_write:
         try:
-            # Model validation will occur in save()
-            device.save()
-            # Send Pushover notification for new device
             try:
-                notifier = get_notifier()
-                device_name = device.hostname or device.mac
-                notifier.notify_new_device(device_name, device.ip, device.mac)
-            except Exception as e:
-                _logger.error(
-                    "Failed to send new device notification (%s): %s",
-                    type(e).__name__,
-                    e,
-                )
-            return 200, None
+                observed = _parse_seen_timestamp(seen_at[idx], now)
+            except ValueError as e:
+                raise ValidationError({'seen_at': str(e)})
+            existing_device = existing_devices_map.get(device.mac, new_devices.get(device.mac))
+            if (existing_device is not None and existing_device.last_seen is not None and
+                    observed < existing_device.last_seen):
+                # The server already has a newer view of this device
+                coalesced_count += 1
+                continue
+            if device.mac in existing_devices_map:
+                if (existing_device.hostname == device.hostname and
+                        existing_device.ip == device.ip and
+                        (not device.vendor or existing_device.vendor == device.vendor) and
+                        existing_device.last_seen is not None and
+                        existing_device.last_seen > now - threshold):
+                    coalesced_count += 1
+                    fresh_macs.add(device.mac)
+                    continue
+                _merge_device(existing_device, device, observed)
+                changed_devices[device.mac] = existing_device
+            elif existing_device is not None:
+                # Same MAC reported twice in one batch, the later record wins
+                _merge_device(existing_device, device, observed)
+            else:
+                device.clean()
+                device.update_ip_keys()
+                device.first_seen = device.last_seen = observed
+                new_devices[device.mac] = device
+            if observed < now:
+                backdated_macs.add(device.mac)
+            else:
+                backdated_macs.discard(device.mac)
+            pending_indexes[device.mac].append(idx)
         except ValidationError as e:
             # Extract all validation error messages
-            return 400, _extract_validation_errors(e)
-        except Exception as e:
-            _logger.exception(f"Error adding device: {e}")
-            return 500, f"Error adding device: {str(e)}"
-    else:
-        existing_device = existing_devices_map.get(device.mac)
+            results[idx] = (400, _extract_validation_errors(e))
 
-        if (existing_device.hostname == device.hostname and
-                existing_device.ip == device.ip and
-                existing_device.last_seen is not None and
-                existing_device.last_seen > now - datetime.timedelta(minutes=_LAST_SEEN_THRESHOLD_MINUTES)):
-            return 200, None
-        else:
-            try:
-                existing_device.hostname = device.hostname
-                existing_device.ip = device.ip
-
-                # Only update vendor if provided, to avoid overwriting with empty value
-                if device.vendor:
-                    existing_device.vendor = device.vendor
+    written = {mac: fingerprints[mac] for mac in (fresh_macs | new_devices.keys() | changed_devices.keys()) - backdated_macs}
+    if not new_devices and not changed_devices:
+        write_coalescing.remember(write_coalescing.DEVICE, written)
+    else:
+        try:
+            with transaction.atomic():
+                if new_devices:
+                    Device.objects.bulk_create(
+                        new_devices.values(),
+                        batch_size=_BULK_BATCH_SIZE,
+                        **_bulk_create_conflict_kwargs(Device, ['mac'], ['hostname', 'ip', 'ip_key', 'subnet_key', 'last_seen'])
+                    )
+                    # Pushover notifications are sent by the outbox dispatcher, not by this request
+                    enqueue_new_devices(new_devices.values())
+                    transaction.on_commit(get_notification_dispatcher().wake)
+                if changed_devices:
+                    Device.objects.bulk_update(changed_devices.values(), _DEVICE_UPDATE_FIELDS,
+                                               batch_size=_BULK_BATCH_SIZE)
+                transaction.on_commit(lambda: write_coalescing.remember(write_coalescing.DEVICE, written))
+        except Exception as e:
+            _logger.exception(f"Error saving devices: {e}")
+            for mac, indexes in pending_indexes.items():
+                action = 'adding' if mac in new_devices else 'updating'
+                for idx in indexes:
+                    results[idx] = (500, f"Error {action} device: {str(e)}")
+            return results
 
-                existing_device.last_seen = now
-                existing_device.save()
-                return 200, None
-            except ValidationError as e:
-                # Extract all validation error messages
-                return 400, _extract_validation_errors(e)
-            except Exception as e:
-                traceback.print_exc()
-                return 500, f"Error updating device: {str(e)}"
+    write_coalescing.get_write_counters().add(write_coalescing.DEVICE,
+                                              written=len(new_devices) + len(changed_devices),
+                                              coalesced=coalesced_count)
+    metrics.record_batch(write_coalescing.DEVICE, len(devices),
+                         inserted=len(new_devices), updated=len(changed_devices), skipped=coalesced_count)
+    return results
 
 
 @api_view(['POST'])
@@ -165,13 +278,11 @@ def add_devices(request):
         return _return_error("'devices' must be a list.", status=400, request=request)
 
     devices = [_create_device_obj_from_data(device_data) for device_data in raw_devices]
-    existing_devices = Device.objects.filter(mac__in=[d.mac for d in devices if d.mac])
-    existing_devices_map = {d.mac: d for d in existing_devices}
+    seen_at = [device_data.get('seen_at') for device_data in raw_devices]
 
     success_count = 0
     errors = []
-    for idx, device_obj in enumerate(devices):
-        response_code, err = _process_device(device_obj, existing_devices_map)
+    for idx, (response_code, err) in enumerate(_upsert_devices(devices, seen_at)):
         if response_code == 200:
             success_count += 1
         else:
@@ -182,13 +293,79 @@ def add_devices(request):
     }, status=200)
 
 
+def _refresh_last_seen(macs, timestamp):
+    """
+    Set last_seen of the given normalized MACs to timestamp, never moving it backwards.
+    Returns (updated_count, known_macs).
+    """
+    updated_count = 0
+    known_macs = set()
+    macs = list(macs)
+    with transaction.atomic():
+        for start in range(0, len(macs), _BULK_BATCH_SIZE):
+            chunk = macs[start:start + _BULK_BATCH_SIZE]
+            updated_count += Device.objects.filter(
+                Q(last_seen__lt=timestamp) | Q(last_seen__isnull=True), mac__in=chunk
+            ).update(last_seen=timestamp)
+            known_macs.update(Device.objects.filter(mac__in=chunk).values_list('mac', flat=True))
+    return updated_count, known_macs
+
+
+@api_view(['POST'])
+def devices_seen(request):
+    """
+    Refresh last_seen of devices the sensor already reported and that haven't changed since.
+    Takes {"macs": [...], "timestamp": "<ISO 8601>"} and answers with the MACs the server
+    doesn't know, so the sensor can send them in full.
+    """
+    # Only accept JSON
+    if not _client_expects_json(request):
+        return _return_error("Only JSON format supported for batch add.", status=400, request=request)
+    try:
+        raw_macs = request.data.get('macs', None)
+        raw_timestamp = request.data.get('timestamp', None)
+    except Exception:
+        return _return_error("Invalid JSON body.", status=400, request=request)
+    if not isinstance(raw_macs, list):
+        return _return_error("'macs' must be a list.", status=400, request=request)
+    try:
+        timestamp = _parse_seen_timestamp(raw_timestamp, datetime.datetime.now())
+    except ValueError as e:
+        return _return_error(str(e), status=400, request=request)
+
+    macs = {}
+    errors = []
+    for idx, mac in enumerate(raw_macs):
+        if not isinstance(mac, str) or not validators.mac_address(mac):
+            errors.append({"index": idx, "error": "mac: Invalid MAC address"})
+        else:
+            macs[mac] = validators.convert_mac(mac)
+
+    updated_count = 0
+    # Devices written a moment ago are known and fresh, no need to touch them again
+    known_macs = write_coalescing.recent_keys(write_coalescing.DEVICE, set(macs.values()))
+    write_coalescing.get_write_counters().add(write_coalescing.DEVICE, coalesced=len(known_macs))
+    pending_macs = set(macs.values()) - known_macs
+    if pending_macs:
+        try:
+            updated_count, refreshed_macs = _refresh_last_seen(pending_macs, timestamp)
+            known_macs |= refreshed_macs
+            write_coalescing.get_write_counters().add(write_coalescing.DEVICE, written=updated_count)
+        except Exception as e:
+            _logger.exception(f"Error refreshing last_seen: {e}")
+            return _return_error(f"Error updating devices: {str(e)}", status=500, request=request)
+    return JsonResponse({
+        "updated_count": updated_count,
+        # Reported the way the sensor sent them so it can match them to its own records
+        "unknown_macs": [mac for mac, normalized in macs.items() if normalized not in known_macs],
+        "errors": errors
+    }, status=200)
+
+
 @api_view(['POST'])
 def add_device(request):
     device_obj = _read_device_details_from_request_body(request)
-    # Fetch existing device for this MAC
-    existing_devices = Device.objects.filter(mac=device_obj.mac) if device_obj.mac else None
-    existing_devices_map = {d.mac: d for d in existing_devices} if existing_devices else {}
-    status_code, err = _process_device(device_obj, existing_devices_map)
+    status_code, err = _upsert_devices([device_obj])[0]
     if status_code == 200:
         return _return_success("Device information processed", request=request)
     else:
@@ -199,102 +376,209 @@ def add_device(request):
 def add_port(request):
     # Use request.data for DRF, fallback to request.POST
     data = getattr(request, 'data', request.POST)
-    mac = data.get('mac', '')
-    port_num = data.get('port', '')
-
-    if mac:
-        mac = validators.convert_mac(mac)
-
-    devices = Device.objects.filter(mac=mac) if mac else None
-    existing_devices_map = {d.mac: d for d in devices} if devices else {}
-    ports = Port.objects.filter(device__mac=mac, port_num=port_num) if port_num and mac else None
-    existing_ports_map = {(p.device.mac, str(p.port_num)): p for p in ports} if ports else {}
 
-    code, err = _process_port(data, existing_devices_map, existing_ports_map)
+    code, err = _upsert_ports([data])[0]
     if code == 200:
         return _return_success('Port information processed', request=request)
     else:
         return _return_error(err, status=code, request=request)
 
 
-def _process_port(port_data, existing_devices_map, existing_ports_map):
-    """
-    Helper to add or update a port. Returns (status_code: int, error: str or None)
-    existing_devices_map: dict mapping mac -> Device
-    existing_ports_map: dict mapping (mac, port_num) -> Port
-    """
+def _read_port_fields(port_data):
     mac = port_data.get('mac', '')
     port_num = port_data.get('port', '')
-    protocol = port_data.get('protocol', '')
-    name = port_data.get('name', '')
-    version = port_data.get('version', '') or 'Unknown'
-    product = port_data.get('product', '') or 'Unknown'
-
     if mac:
         mac = validators.convert_mac(mac)
-
+    return {
+        'mac': mac,
+        'port_num': '' if port_num is None else str(port_num),
+        'protocol': port_data.get('protocol', ''),
+        'name': port_data.get('name', ''),
+        'version': port_data.get('version', '') or 'Unknown',
+        'product': port_data.get('product', '') or 'Unknown',
+        'seen_at': port_data.get('seen_at'),
+    }
+
+
+def _validate_port_fields(fields):
+    """
+    Returns an error message for missing required fields, or None.
+    """
     # Early validation of required fields before checking device existence.
     # This provides better error messages to API clients and maintains backward
     # compatibility with existing API behavior where field validation errors
     # are reported before device existence errors.
-    if len(mac) == 0:
-        return 400, 'missing mac address'
-    if len(port_num) == 0:
-        return 400, 'missing port number'
-    if len(protocol) == 0:
-        return 400, 'missing protocol'
-    if len(name) == 0:
-        return 400, 'missing port name'
-
-    device = existing_devices_map.get(mac)
-    if not device:
-        return 400, 'device not found'
-
-    key = (mac, str(port_num))
+    if len(fields['mac']) == 0:
+        return 'missing mac address'
+    if len(fields['port_num']) == 0:
+        return 'missing port number'
+    if len(fields['protocol']) == 0:
+        return 'missing protocol'
+    if len(fields['name']) == 0:
+        return 'missing port name'
+    return None
+
+
+def _fetch_existing_ports(port_nums_by_device):
+    """
+    Fetch exactly the requested (device, port_num) pairs.
+    port_nums_by_device: dict mapping device_id -> set of port numbers
+    Returns a dict mapping (device_id, port_num) -> Port
+    """
+    existing_ports_map = {}
+    device_ids = list(port_nums_by_device)
+    for i in range(0, len(device_ids), _PORT_PREFETCH_DEVICE_CHUNK):
+        condition = Q()
+        for device_id in device_ids[i:i + _PORT_PREFETCH_DEVICE_CHUNK]:
+            condition |= Q(device_id=device_id, port_num__in=port_nums_by_device[device_id])
+        for port in Port.objects.filter(condition):
+            existing_ports_map[(port.device_id, port.port_num)] = port
+    return existing_ports_map
+
+
+def _port_coalescing_key(fields):
+    """Returns the write coalescing key of a port record, or None when the record is invalid."""
+    if _validate_port_fields(fields) is not None:
+        return None
+    try:
+        return write_coalescing.port_key(fields['mac'], int(fields['port_num']))
+    except ValueError:
+        return None
+
+
+def _port_fingerprint(fields):
+    """The reported details of a port, identical fingerprints need no write."""
+    return tuple(fields[field] for field in _PORT_UPDATE_FIELDS if field != 'last_seen')
+
+
+def _upsert_ports(raw_ports):
+    """
+    Add or update a batch of ports with set-based writes in a single transaction.
+    A port record may carry the seen_at it was observed at, see _upsert_devices().
+    Returns a list of (status_code: int, error: str or None), one entry per input port.
+    """
+    results = [(200, None)] * len(raw_ports)
     now = datetime.datetime.now()
-    if key not in existing_ports_map:
-        try:
+    threshold = datetime.timedelta(seconds=write_coalescing.threshold_seconds(write_coalescing.PORT))
+
+    parsed_ports = [_read_port_fields(port_data) for port_data in raw_ports]
+
+    # Ports written with the same details a moment ago don't need the database at all
+    coalescing_keys = [_port_coalescing_key(fields) for fields in parsed_ports]
+    fingerprints = {key: _port_fingerprint(fields)
+                    for key, fields in zip(coalescing_keys, parsed_ports) if key is not None}
+    coalesced_keys = write_coalescing.unchanged_keys(write_coalescing.PORT, fingerprints)
+    skipped = [key is not None and key in coalesced_keys for key in coalescing_keys]
+    coalesced_count = sum(skipped)
+
+    devices = Device.objects.filter(mac__in={p['mac'] for p, skip in zip(parsed_ports, skipped) if p['mac'] and not skip})
+    existing_devices_map = {d.mac: d for d in devices}
+
+    # Resolve every record to its (device, port_num) key before touching the ports table
+    keys = [None] * len(parsed_ports)
+    observed = [None] * len(parsed_ports)
+    port_nums_by_device = defaultdict(set)
+    for idx, fields in enumerate(parsed_ports):
+        if skipped[idx]:
+            continue
+        err = _validate_port_fields(fields)
+        if err is None and fields['mac'] not in existing_devices_map:
+            err = 'device not found'
+        if err is None:
+            try:
+                fields['port_num'] = int(fields['port_num'])
+            except ValueError:
+                err = 'invalid port number'
+        if err is None:
+            try:
+                observed[idx] = _parse_seen_timestamp(fields['seen_at'], now)
+            except ValueError as e:
+                err = f'seen_at: {e}'
+        if err is not None:
+            results[idx] = (400, err)
+            continue
+        device = existing_devices_map[fields['mac']]
+        keys[idx] = (device.id, fields['port_num'])
+        port_nums_by_device[device.id].add(fields['port_num'])
+
+    existing_ports_map = _fetch_existing_ports(port_nums_by_device)
+
+    new_ports = {}
+    changed_ports = {}
+    fresh_keys = set()
+    # Written with an older timestamp, not remembered as just seen by write coalescing
+    backdated_keys = set()
+    pending_indexes = defaultdict(list)
+    for idx, fields in enumerate(parsed_ports):
+        key = keys[idx]
+        if key is None:
+            continue
+        port_obj = existing_ports_map.get(key, new_ports.get(key))
+        if port_obj is not None and port_obj.last_seen is not None and observed[idx] < port_obj.last_seen:
+            # The server already has a newer view of this port
+            coalesced_count += 1
+            continue
+        if key in existing_ports_map:
+            # Only last_seen is updated, but optionally update other info if provided
+            if (port_obj.last_seen is not None and
+                    port_obj.last_seen > now - threshold and
+                    all(not fields[field] or fields[field] == getattr(port_obj, field)
+                        for field in _PORT_UPDATE_FIELDS if field != 'last_seen')):
+                coalesced_count += 1
+                fresh_keys.add(coalescing_keys[idx])
+                continue
+            changed_ports[key] = port_obj
+        elif port_obj is None:
             port_obj = Port()
-            port_obj.device = device
-            port_obj.port_num = port_num
-            port_obj.protocol = protocol
-            port_obj.name = name
-            port_obj.product = product
-            port_obj.version = version
-            port_obj.first_seen = now
-            port_obj.last_seen = now
-            # Model validation will occur in save()
-            port_obj.save()
-            return 200, None
-        except ValidationError as e:
-            # Extract all validation error messages
-            return 400, _extract_validation_errors(e)
-        except Exception as e:
-            traceback.print_exc()
-            return 500, f'Error adding port: {str(e)}'
-    else:
-        port_obj = existing_ports_map[key]
-        # Only last_seen is updated, but optionally update other info if provided
-        if (port_obj.last_seen is not None and
-                port_obj.last_seen > now - datetime.timedelta(minutes=_LAST_SEEN_THRESHOLD_MINUTES)):
-            return 200, None
+            port_obj.device = existing_devices_map[fields['mac']]
+            port_obj.port_num = fields['port_num']
+            port_obj.first_seen = observed[idx]
+            new_ports[key] = port_obj
+
+        port_obj.last_seen = observed[idx]
+        if observed[idx] < now:
+            backdated_keys.add(coalescing_keys[idx])
         else:
-            try:
-                port_obj.last_seen = now
-                # Optionally update other fields if provided
-                if protocol:
-                    port_obj.protocol = protocol
-                if name:
-                    port_obj.name = name
-                if product:
-                    port_obj.product = product
-                if version:
-                    port_obj.version = version
-                port_obj.save()
-                return 200, None
-            except Exception as e:
-                traceback.print_exc()
-                return 500, f'Error updating port: {str(e)}'
+            backdated_keys.discard(coalescing_keys[idx])
+        # Optionally update other fields if provided
+        for field in _PORT_UPDATE_FIELDS:
+            if field != 'last_seen' and fields[field]:
+                setattr(port_obj, field, fields[field])
+        pending_indexes[key].append(idx)
+
+    written = {key: fingerprints[key] for key in fresh_keys}
+    for indexes in pending_indexes.values():
+        written.update((coalescing_keys[idx], fingerprints[coalescing_keys[idx]]) for idx in indexes)
+    for key in backdated_keys:
+        written.pop(key, None)
+    if not new_ports and not changed_ports:
+        write_coalescing.remember(write_coalescing.PORT, written)
+    else:
+        try:
+            with transaction.atomic():
+                if new_ports:
+                    Port.objects.bulk_create(
+                        new_ports.values(),
+                        batch_size=_BULK_BATCH_SIZE,
+                        **_bulk_create_conflict_kwargs(Port, ['device', 'port_num'], _PORT_UPDATE_FIELDS)
+                    )
+                if changed_ports:
+                    Port.objects.bulk_update(changed_ports.values(), _PORT_UPDATE_FIELDS, batch_size=_BULK_BATCH_SIZE)
+                transaction.on_commit(lambda: write_coalescing.remember(write_coalescing.PORT, written))
+        except Exception as e:
+            _logger.exception(f"Error saving ports: {e}")
+            for key, indexes in pending_indexes.items():
+                action = 'adding' if key in new_ports else 'updating'
+                for idx in indexes:
+                    results[idx] = (500, f'Error {action} port: {str(e)}')
+            return results
+
+    write_coalescing.get_write_counters().add(write_coalescing.PORT,
+                                              written=len(new_ports) + len(changed_ports),
+                                              coalesced=coalesced_count)
+    metrics.record_batch(write_coalescing.PORT, len(raw_ports),
+                         inserted=len(new_ports), updated=len(changed_ports), skipped=coalesced_count)
+    return results
 
 
 @api_view(['POST'])
@@ -309,19 +593,9 @@ def add_ports(request):
     if not isinstance(raw_ports, list):
         return _return_error("'ports' must be a list.", status=400, request=request)
 
-    macs = [validators.convert_mac(p.get('mac', '')) for p in raw_ports if p.get('mac', '')]
-    port_keys = [str(p.get('port', '')) for p in raw_ports if p.get('port', '')]
-
-    # Bulk fetch all relevant devices and ports
-    devices = Device.objects.filter(mac__in=macs)
-    existing_devices_map = {d.mac: d for d in devices}
-    ports = Port.objects.filter(device__mac__in=macs, port_num__in=[pk for pk in port_keys])
-    existing_ports_map = {(p.device.mac, str(p.port_num)): p for p in ports}
-
     success_count = 0
     errors = []
-    for idx, port_data in enumerate(raw_ports):
-        code, err = _process_port(port_data, existing_devices_map, existing_ports_map)
+    for idx, (code, err) in enumerate(_upsert_ports(raw_ports)):
         if code == 200:
             success_count += 1
         else:
@@ -352,6 +626,7 @@ def sensor_health(request):
     sensor_info.last_seen = datetime.datetime.now()
 
     sensors = Sensor.objects.filter(mac=sensor_mac)
+    sensor = sensor_info
     if len(sensors) == 0:
         try:
             # Model validation will occur in save()
@@ -375,9 +650,33 @@ def sensor_health(request):
             traceback.print_exc()
             return _return_error('Error :' + str(e), request=request)
 
+    # Operational stats are optional, older sensors don't send them
+    try:
+        sensor_telemetry.record_health(sensor, data.get('metrics'))
+    except Exception as e:
+        _logger.warning(f"Unable to record stats of sensor {sensor_mac}: {e}")
+
     return _return_success('sensor information updated', request=request)
 
 
+class _MetricsRenderer(BaseRenderer):
+    # The view returns the exposition text itself, this only renders DRF errors such as 403
+    media_type = 'text/plain'
+    format = 'txt'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return str(data.get('detail', data) if isinstance(data, dict) else data)
+
+
+@api_view(['GET'])
+@renderer_classes([_MetricsRenderer])
+def prometheus_metrics(request):
+    if not metrics.is_available():
+        return HttpResponse("prometheus-client is not installed", status=503, content_type='text/plain')
+    body, content_type = metrics.render_latest()
+    return HttpResponse(body, content_type=content_type)
+
+
 def _return_success(message, request=None):
     if request is not None and _client_expects_json(request):
         return JsonResponse({"message": message})
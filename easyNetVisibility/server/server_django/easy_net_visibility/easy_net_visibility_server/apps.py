@@ -12,6 +12,8 @@ class EasyNetVisibilityServerConfig(AppConfig):
         """
         Called when Django starts. Initialize background services here.
         """
+        from . import signals  # noqa: F401
+
         # Only start monitoring service in production environments
         # Skip for management commands and tests
         import sys
@@ -30,3 +32,10 @@ class EasyNetVisibilityServerConfig(AppConfig):
                 logger.info("Network monitoring service started successfully")
             except Exception as e:
                 logger.error(f"Failed to start network monitoring service: {e}")
+
+            try:
+                from easy_net_visibility_server.notification_dispatcher import get_notification_dispatcher
+                get_notification_dispatcher().start()
+                logger.info("Notification dispatcher started successfully")
+            except Exception as e:
+                logger.error(f"Failed to start notification dispatcher: {e}")
@@ -0,0 +1,167 @@
+"""
+Bounded queue and worker thread that deliver notifications off the caller's thread.
+
+Callers only enqueue. The worker sends one notification at a time and retries a failed
+send with exponential backoff and full jitter. Retrying holds back the rest of the queue,
+which is what we want when the endpoint is down or rate limiting. A notification that
+still fails after max_attempts is written to the dead-letter log instead of being silently
+lost. One that doesn't fit in the queue is refused, and the caller keeps it for later. A queued notification's on_result callback
+is called on the worker thread with True once it was sent, or with False when it was dropped.
+"""
+import logging
+import queue
+import random
+import threading
+import time
+
+from easy_net_visibility_server import metrics
+
+logger = logging.getLogger(__name__)
+dead_letter_logger = logging.getLogger(__name__ + '.dead_letter')
+
+
+class DeliveryQueue:
+    def __init__(self, send, max_size=1000, max_attempts=5, base_delay_seconds=1, max_delay_seconds=300):
+        """
+        Args:
+            send: Callable delivering one notification, raising on failure
+            max_size: Maximum number of queued notifications
+            max_attempts: Attempts per notification before it is dead-lettered
+            base_delay_seconds: Delay cap after the first failed attempt, doubled after each failure
+            max_delay_seconds: Upper bound of the delay cap
+        """
+        self._send = send
+        self.max_attempts = max_attempts
+        self.base_delay_seconds = base_delay_seconds
+        self.max_delay_seconds = max_delay_seconds
+        self._queue = queue.Queue(maxsize=max_size)
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._stats_lock = threading.Lock()
+        self._stats = {'sent': 0, 'retried': 0, 'dead_lettered': 0, 'send_seconds_total': 0.0, 'last_send_seconds': None}
+
+    def put(self, notification, on_result=None):
+        """
+        Queue a notification for delivery. Returns False when the queue is full and it wasn't
+        queued, on_result isn't called then.
+        """
+        self._ensure_worker()
+        try:
+            self._queue.put_nowait((notification, on_result))
+            metrics.NOTIFICATION_QUEUE_DEPTH.set(self._queue.qsize())
+            return True
+        except queue.Full:
+            logger.warning(f"Delivery queue full, notification not queued: {notification.get('title')}")
+            return False
+
+    def full(self):
+        """Returns True if the queue has no room for another notification."""
+        return self._queue.full()
+
+    def _ensure_worker(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stop_event.clear()
+                self._thread = threading.Thread(target=self._worker_loop, daemon=True)
+                self._thread.start()
+
+    def stop(self, timeout=5):
+        """Stop the worker. Notifications still queued are kept for a later restart."""
+        with self._lock:
+            if self._thread is None:
+                return
+            self._stop_event.set()
+            thread = self._thread
+            self._thread = None
+        thread.join(timeout=timeout)
+
+    def wait_until_idle(self, timeout):
+        """Wait until every queued notification was delivered or dead-lettered. Returns True if idle."""
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks:
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+    def _worker_loop(self):
+        while not self._stop_event.is_set():
+            try:
+                notification, on_result = self._queue.get(timeout=1)
+            except queue.Empty:
+                continue
+            metrics.NOTIFICATION_QUEUE_DEPTH.set(self._queue.qsize())
+            try:
+                self._deliver(notification, on_result)
+            except Exception as e:
+                logger.exception(f"Error in notification delivery worker: {e}")
+            finally:
+                self._queue.task_done()
+
+    def _deliver(self, notification, on_result):
+        for attempt in range(1, self.max_attempts + 1):
+            started = time.monotonic()
+            try:
+                self._send(notification)
+            except Exception as e:
+                if attempt == self.max_attempts:
+                    self._dead_letter(notification, f"{type(e).__name__}: {e}")
+                    self._report(on_result, False)
+                    return
+                delay = self.backoff_seconds(attempt)
+                logger.warning(f"Notification delivery failed (attempt {attempt}/{self.max_attempts}), "
+                               f"retrying in {delay:.1f}s: {e}")
+                with self._stats_lock:
+                    self._stats['retried'] += 1
+                if self._stop_event.wait(timeout=delay):
+                    # Stopping, put it back so it isn't lost with the worker
+                    self._requeue(notification, on_result)
+                    return
+            else:
+                elapsed = time.monotonic() - started
+                with self._stats_lock:
+                    self._stats['sent'] += 1
+                    self._stats['send_seconds_total'] += elapsed
+                    self._stats['last_send_seconds'] = elapsed
+                self._report(on_result, True)
+                return
+
+    def _requeue(self, notification, on_result):
+        try:
+            self._queue.put_nowait((notification, on_result))
+        except queue.Full:
+            self._dead_letter(notification, 'delivery queue full')
+            self._report(on_result, False)
+
+    @staticmethod
+    def _report(on_result, delivered):
+        if on_result is None:
+            return
+        try:
+            on_result(delivered)
+        except Exception as e:
+            logger.exception(f"Error handling the result of a notification: {e}")
+
+    def backoff_seconds(self, attempt):
+        """Full jitter: a random delay up to the exponential cap of the attempt."""
+        cap = min(self.max_delay_seconds, self.base_delay_seconds * 2 ** (attempt - 1))
+        return random.uniform(0, cap)
+
+    def _dead_letter(self, notification, reason):
+        with self._stats_lock:
+            self._stats['dead_lettered'] += 1
+        dead_letter_logger.error(f"Notification dropped ({reason}): {notification}")
+
+    def stats(self):
+        """Returns the queue depth and delivery counters, send times in milliseconds."""
+        with self._stats_lock:
+            stats = dict(self._stats)
+        sent = stats.pop('sent')
+        total = stats.pop('send_seconds_total')
+        last = stats.pop('last_send_seconds')
+        return dict(stats,
+                    queue_depth=self._queue.qsize(),
+                    sent=sent,
+                    avg_send_ms=round(1000 * total / sent, 1) if sent else None,
+                    last_send_ms=round(1000 * last, 1) if last is not None else None)
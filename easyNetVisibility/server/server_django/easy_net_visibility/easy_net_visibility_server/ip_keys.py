@@ -0,0 +1,69 @@
+"""
+Sortable keys for device IP addresses.
+
+IPs are stored as text, which sorts 10.0.0.10 before 10.0.0.2. Every address is mapped
+into the 128 bit IPv6 space (IPv4 as ::ffff:a.b.c.d) and written as 32 zero-padded hex
+digits, so plain string ordering in the database is numeric ordering, on every backend.
+The subnet key is the key of the address's network, /24 for IPv4 and /64 for IPv6.
+"""
+import ipaddress
+
+IPV4_PREFIX_LENGTH = 24
+IPV6_PREFIX_LENGTH = 64
+
+_IPV4_MAPPED = ipaddress.ip_network('::ffff:0:0/96')
+
+
+def _to_ipv6(address):
+    if address.version == 4:
+        return ipaddress.IPv6Address(int(_IPV4_MAPPED.network_address) | int(address))
+    return address
+
+
+def _format_key(address):
+    return format(int(_to_ipv6(address)), '032x')
+
+
+def _parse(ip):
+    if not ip:
+        return None
+    try:
+        return ipaddress.ip_address(str(ip).strip())
+    except ValueError:
+        return None
+
+
+def ip_key(ip):
+    """Returns the sortable key of an IP address, or None when it isn't a valid address."""
+    address = _parse(ip)
+    return _format_key(address) if address is not None else None
+
+
+def _network(address):
+    prefix_length = IPV4_PREFIX_LENGTH if address.version == 4 else IPV6_PREFIX_LENGTH
+    return ipaddress.ip_network(f"{address}/{prefix_length}", strict=False)
+
+
+def subnet_key(ip):
+    """Returns the key of the subnet an IP address belongs to, or None when it isn't a valid address."""
+    address = _parse(ip)
+    return _format_key(_network(address).network_address) if address is not None else None
+
+
+def subnet_label(key):
+    """Returns the CIDR notation of a subnet key, e.g. '192.168.1.0/24', or 'unknown' for None."""
+    if key is None:
+        return "unknown"
+    address = ipaddress.IPv6Address(int(key, 16))
+    if address in _IPV4_MAPPED:
+        return str(_network(address.ipv4_mapped))
+    return str(_network(address))
+
+
+def network_key_range(cidr):
+    """
+    Returns the (first, last) ip keys of a network in CIDR notation, for range filters.
+    Raises ValueError for an invalid network.
+    """
+    network = ipaddress.ip_network(cidr, strict=False)
+    return _format_key(network.network_address), _format_key(network.broadcast_address)
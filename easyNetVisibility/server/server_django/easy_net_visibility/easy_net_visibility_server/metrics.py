@@ -0,0 +1,92 @@
+"""
+Prometheus metrics of the server, exposed at /metrics.
+
+Gunicorn runs several worker processes. When PROMETHEUS_MULTIPROC_DIR is set (see
+start-server.sh), every process writes its samples to that directory and /metrics
+aggregates all of them. Otherwise only the process answering the scrape is reported.
+Without the prometheus-client library recording is a no-op and /metrics answers 503.
+"""
+import os
+
+try:
+    import prometheus_client
+    from prometheus_client import multiprocess
+except ImportError:
+    prometheus_client = None
+
+
+class _NoopMetric:
+    """Stands in for every metric when prometheus-client is not installed."""
+
+    def labels(self, *args, **kwargs):
+        return self
+
+    def observe(self, value):
+        pass
+
+    def inc(self, amount=1):
+        pass
+
+    def set(self, value):
+        pass
+
+
+def _histogram(name, documentation, labelnames=(), buckets=None):
+    if prometheus_client is None:
+        return _NoopMetric()
+    kwargs = {'buckets': buckets} if buckets else {}
+    return prometheus_client.Histogram(name, documentation, labelnames, **kwargs)
+
+
+def _counter(name, documentation, labelnames=()):
+    if prometheus_client is None:
+        return _NoopMetric()
+    return prometheus_client.Counter(name, documentation, labelnames)
+
+
+def _gauge(name, documentation):
+    if prometheus_client is None:
+        return _NoopMetric()
+    # Summed over the live worker processes when running multiprocess
+    return prometheus_client.Gauge(name, documentation, multiprocess_mode='livesum')
+
+
+_COUNT_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+REQUEST_DURATION = _histogram(
+    'easynet_request_duration_seconds', 'Request latency per view', ['view'])
+REQUEST_DB_QUERIES = _histogram(
+    'easynet_request_db_queries', 'Database queries per request per view', ['view'], buckets=_COUNT_BUCKETS)
+BATCH_SIZE = _histogram(
+    'easynet_batch_size', 'Records per ingest batch', ['kind'], buckets=_COUNT_BUCKETS)
+INGESTED_RECORDS = _counter(
+    'easynet_ingested_records', 'Ingested records by outcome (inserted, updated, skipped)', ['kind', 'outcome'])
+NOTIFICATION_SEND_DURATION = _histogram(
+    'easynet_notification_send_duration_seconds', 'Latency of Pushover sends')
+NOTIFICATION_QUEUE_DEPTH = _gauge(
+    'easynet_notification_queue_depth', 'Notifications waiting in the delivery queue')
+MONITOR_CYCLE_DURATION = _histogram(
+    'easynet_monitor_cycle_duration_seconds', 'Duration of a monitoring service check cycle',
+    buckets=(0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300))
+
+
+def record_batch(kind, size, inserted, updated, skipped):
+    """Record an ingest batch of the given kind ('device' or 'port') and what happened to its records."""
+    BATCH_SIZE.labels(kind).observe(size)
+    INGESTED_RECORDS.labels(kind, 'inserted').inc(inserted)
+    INGESTED_RECORDS.labels(kind, 'updated').inc(updated)
+    INGESTED_RECORDS.labels(kind, 'skipped').inc(skipped)
+
+
+def is_available():
+    return prometheus_client is not None
+
+
+def render_latest():
+    """Returns (body, content type) of the current metrics, aggregated over all processes when multiprocess."""
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        registry = prometheus_client.CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = prometheus_client.REGISTRY
+    return prometheus_client.generate_latest(registry), prometheus_client.CONTENT_TYPE_LATEST
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.10 on 2026-10-16 23:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('easy_net_visibility_server', '0005_device_last_notified_offline_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NotificationOutbox',
+            fields=[
+                ('id', models.AutoField(db_column='notification_id', primary_key=True, serialize=False)),
+                ('event_type', models.CharField(max_length=32)),
+                ('name', models.CharField(blank=True, max_length=255, null=True)),
+                ('ip', models.CharField(blank=True, max_length=255, null=True)),
+                ('mac', models.CharField(blank=True, max_length=255, null=True)),
+                ('created_at', models.DateTimeField(verbose_name='created_at')),
+                ('claimed_by', models.CharField(blank=True, db_index=True, max_length=32, null=True)),
+                ('claimed_at', models.DateTimeField(blank=True, null=True, verbose_name='claimed_at')),
+                ('sent_at', models.DateTimeField(blank=True, db_index=True, null=True, verbose_name='sent_at')),
+                ('attempts', models.IntegerField(default=0)),
+                ('last_error', models.CharField(blank=True, max_length=255, null=True)),
+            ],
+            options={
+                'db_table': 'notification_outbox',
+            },
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.10 on 2026-10-16 23:37
+
+from django.db import migrations, models
+
+from easy_net_visibility_server import ip_keys
+
+
+def populate_ip_keys(apps, schema_editor):
+    Device = apps.get_model('easy_net_visibility_server', 'Device')
+    devices = list(Device.objects.only('id', 'ip'))
+    for device in devices:
+        device.ip_key = ip_keys.ip_key(device.ip)
+        device.subnet_key = ip_keys.subnet_key(device.ip)
+    Device.objects.bulk_update(devices, ['ip_key', 'subnet_key'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('easy_net_visibility_server', '0006_notificationoutbox'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='device',
+            name='ip_key',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=32, null=True),
+        ),
+        migrations.AddField(
+            model_name='device',
+            name='subnet_key',
+            field=models.CharField(blank=True, editable=False, max_length=32, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='device',
+            index=models.Index(fields=['subnet_key', 'ip_key'], name='idx_device_subnet_ip'),
+        ),
+        migrations.RunPython(populate_ip_keys, migrations.RunPython.noop),
+    ]
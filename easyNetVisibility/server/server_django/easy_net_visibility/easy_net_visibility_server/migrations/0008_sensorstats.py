@@ -0,0 +1,32 @@
+# Generated by Django 5.2.10 on 2026-10-16 23:59
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('easy_net_visibility_server', '0007_device_ip_keys'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SensorStats',
+            fields=[
+                ('id', models.AutoField(db_column='sensor_stats_id', primary_key=True, serialize=False)),
+                ('hour', models.DateTimeField(verbose_name='hour')),
+                ('reports', models.IntegerField(default=0)),
+                ('rss_bytes_max', models.BigIntegerField(blank=True, null=True)),
+                ('cpu_seconds', models.FloatField(default=0)),
+                ('spool_depth_max', models.IntegerField(blank=True, null=True)),
+                ('loops', models.JSONField(default=dict)),
+                ('totals', models.JSONField(default=dict)),
+                ('sensor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='easy_net_visibility_server.sensor')),
+            ],
+            options={
+                'db_table': 'sensor_stats',
+                'constraints': [models.UniqueConstraint(fields=('sensor', 'hour'), name='nk_sensor_stats')],
+            },
+        ),
+    ]
@@ -2,14 +2,30 @@ import datetime
 
 from django.core.exceptions import ValidationError
 from django.db import models
+from django.db.models import Q
 from django.utils import timezone
 
-from . import validators
+from . import ip_keys, validators
+
+
+# Devices seen within this window are considered online
+ONLINE_WINDOW = datetime.timedelta(hours=6)
+
+
+class DeviceQuerySet(models.QuerySet):
+    def visible(self):
+        """Devices shown on the dashboard, the database side of Device.is_hidden()."""
+        return self.filter(Q(nickname__isnull=False) | Q(last_seen__gte=timezone.now() - ONLINE_WINDOW))
+
+    def in_network(self, cidr):
+        """Devices whose IP is inside the network, e.g. '10.2.0.0/16'. A range scan on the ip_key index."""
+        first, last = ip_keys.network_key_range(cidr)
+        return self.filter(ip_key__gte=first, ip_key__lte=last)
 
 
 # Create your models here.
 class Device(models.Model):
-    objects: models.Manager["Device"]  # type: ignore
+    objects: models.Manager["Device"] = DeviceQuerySet.as_manager()  # type: ignore
     id = models.AutoField(primary_key=True, db_column='device_id')
     nickname = models.CharField(max_length=255, blank=True, null=True)
     hostname = models.CharField(max_length=255, blank=True, null=True)
@@ -19,6 +35,17 @@ class Device(models.Model):
     first_seen = models.DateTimeField('first_seen')
     last_seen = models.DateTimeField('last_seen')
     last_notified_offline = models.DateTimeField('last_notified_offline', blank=True, null=True)
+    # Derived from ip on every write, see ip_keys
+    ip_key = models.CharField(max_length=32, blank=True, null=True, db_index=True, editable=False)
+    subnet_key = models.CharField(max_length=32, blank=True, null=True, editable=False)
+
+    def update_ip_keys(self):
+        """Recompute the stored sort and subnet keys from ip."""
+        self.ip_key = ip_keys.ip_key(self.ip)
+        self.subnet_key = ip_keys.subnet_key(self.ip)
+
+    def subnet(self):
+        return ip_keys.subnet_label(self.subnet_key)
 
     def clean(self):
         """Validate device fields."""
@@ -47,6 +74,10 @@ class Device(models.Model):
         # Skip full validation when doing a partial update with update_fields
         if 'update_fields' not in kwargs:
             self.clean()
+        self.update_ip_keys()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'ip' in update_fields:
+            kwargs['update_fields'] = set(update_fields) | {'ip_key', 'subnet_key'}
         super().save(*args, **kwargs)
 
     def is_hidden(self):
@@ -62,7 +93,7 @@ class Device(models.Model):
         return self.first_seen >= timezone.now() - datetime.timedelta(days=1)
 
     def online(self):
-        return self.last_seen >= timezone.now() - datetime.timedelta(hours=6)
+        return self.last_seen >= timezone.now() - ONLINE_WINDOW
 
     def __str__(self):
         return str(self.name()) + "(" + self.ip + ")"
@@ -72,6 +103,10 @@ class Device(models.Model):
         constraints = [
             models.UniqueConstraint(fields=['mac'], name='nk_device')
         ]
+        indexes = [
+            # Dashboard grouping: devices of a subnet in IP order
+            models.Index(fields=['subnet_key', 'ip_key'], name='idx_device_subnet_ip')
+        ]
 
 
 class Port(models.Model):
@@ -166,3 +201,59 @@ class Sensor(models.Model):
         constraints = [
             models.UniqueConstraint(fields=['mac'], name='nk_sensor')
         ]
+
+
+class NotificationOutbox(models.Model):
+    """
+    Notification waiting to be delivered by the background dispatcher.
+    Rows are written in the same transaction as the change that caused them.
+    """
+    NEW_DEVICE = 'new_device'
+
+    objects: models.Manager["NotificationOutbox"]  # type: ignore
+    id = models.AutoField(primary_key=True, db_column='notification_id')
+    event_type = models.CharField(max_length=32)
+    name = models.CharField(max_length=255, blank=True, null=True)
+    ip = models.CharField(max_length=255, blank=True, null=True)
+    mac = models.CharField(max_length=255, blank=True, null=True)
+    created_at = models.DateTimeField('created_at')
+    claimed_by = models.CharField(max_length=32, blank=True, null=True, db_index=True)
+    claimed_at = models.DateTimeField('claimed_at', blank=True, null=True)
+    sent_at = models.DateTimeField('sent_at', blank=True, null=True, db_index=True)
+    attempts = models.IntegerField(default=0)
+    last_error = models.CharField(max_length=255, blank=True, null=True)
+
+    def __str__(self):
+        return f"{self.event_type}: {self.name} ({self.mac})"
+
+    class Meta:
+        db_table = "notification_outbox"
+
+
+class SensorStats(models.Model):
+    """
+    Hourly rollup of the operational stats a sensor sends with its health reports.
+    One row per sensor and hour, rows older than the retention period are purged.
+    """
+    objects: models.Manager["SensorStats"]  # type: ignore
+    id = models.AutoField(primary_key=True, db_column='sensor_stats_id')
+    sensor = models.ForeignKey(Sensor, on_delete=models.CASCADE)
+    hour = models.DateTimeField('hour')
+    reports = models.IntegerField(default=0)
+    rss_bytes_max = models.BigIntegerField(blank=True, null=True)
+    # CPU time the sensor process used during the hour
+    cpu_seconds = models.FloatField(default=0)
+    spool_depth_max = models.IntegerField(blank=True, null=True)
+    # Per loop: {name: {cycles, failures, upload_failures, bytes_sent, max_duration_seconds, found}}
+    loops = models.JSONField(default=dict)
+    # The sensor's cumulative counters at the last report, to turn the next report into deltas
+    totals = models.JSONField(default=dict)
+
+    def __str__(self):
+        return f"{self.sensor} - {self.hour}"
+
+    class Meta:
+        db_table = "sensor_stats"
+        constraints = [
+            models.UniqueConstraint(fields=['sensor', 'hour'], name='nk_sensor_stats')
+        ]
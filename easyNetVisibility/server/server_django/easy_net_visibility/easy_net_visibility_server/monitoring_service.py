@@ -2,13 +2,12 @@
 Background monitoring service for Pushover notifications.
 Runs as a daemon thread to monitor network devices and sensors.
 """
-import datetime
 import logging
 import threading
+import time
 
-from django.utils import timezone
-from easy_net_visibility_server.models import Sensor, Device
-from easy_net_visibility_server.pushover_notifier import get_notifier
+from easy_net_visibility_server import metrics, offline_detection, sensor_telemetry
+from easy_net_visibility_server.pushover_notifier import NotificationResults, get_notifier
 
 logger = logging.getLogger(__name__)
 
@@ -64,11 +63,14 @@ class NetworkMonitoringService:
         self._stop_event.wait(timeout=1)
 
         while not self._stop_event.is_set():
+            started = time.perf_counter()
             try:
                 self._check_gateway_timeouts()
                 self._check_device_offline()
+                sensor_telemetry.purge_expired()
             except Exception as e:
                 logger.exception(f"Error in monitoring loop: {e}")
+            metrics.MONITOR_CYCLE_DURATION.observe(time.perf_counter() - started)
 
             # Wait for the configured interval or until stop is requested
             self._stop_event.wait(timeout=self.check_interval_seconds)
@@ -82,42 +84,24 @@ class NetworkMonitoringService:
             return
 
         timeout_minutes = self.notifier.gateway_timeout_minutes
-        timeout_threshold = timezone.now() - datetime.timedelta(minutes=timeout_minutes)
 
-        # Find sensors that are offline
-        offline_sensors = Sensor.objects.filter(last_seen__lt=timeout_threshold)
-
-        for sensor in offline_sensors:
-            # Use select_for_update to prevent race conditions
+        # Offline sensors not notified in the last 24 hours, claimed in one statement
+        results = NotificationResults(lambda delivered, failed: offline_detection.release_sensors(failed))
+        for sensor in offline_detection.claim_offline_sensors(timeout_minutes):
+            on_result = results.callback(sensor)
             try:
-                # Re-fetch with lock to ensure atomic check-and-update
-                locked_sensor = Sensor.objects.select_for_update(nowait=True).get(pk=sensor.pk)
-
-                # Check if we've already notified about this sensor being offline
-                # Only notify again if it's been offline for at least 24 hours since last notification
-                should_notify = (
-                        locked_sensor.last_notified_timeout is None or
-                        locked_sensor.last_notified_timeout < timezone.now() - datetime.timedelta(hours=24)
-                )
-
-                if should_notify:
-                    minutes_offline = locked_sensor.time_since_last_seen()
-                    self.notifier.notify_gateway_timeout(locked_sensor.hostname or locked_sensor.mac, minutes_offline)
-                    locked_sensor.last_notified_timeout = timezone.now()
-                    locked_sensor.save(update_fields=['last_notified_timeout'])
-                    logger.info(
-                        f"Gateway timeout notification sent: {locked_sensor.hostname} ({locked_sensor.mac}) - {minutes_offline} minutes offline")
+                minutes_offline = sensor.time_since_last_seen()
+                self.notifier.notify_gateway_timeout(sensor.hostname or sensor.mac, minutes_offline, on_result=on_result)
+                logger.info(f"Gateway timeout: {sensor.hostname} ({sensor.mac}) - {minutes_offline} minutes offline")
             except Exception as e:
-                # Log and continue if we can't acquire lock (another process is handling it)
-                logger.debug(f"Skipping sensor {sensor.mac} - could not acquire lock or error occurred: {e}")
-                continue
+                logger.warning(f"Failed to notify about sensor {sensor.mac}: {e}")
+                on_result(False)
+        _, failed = results.close()
+        if failed:
+            logger.warning(f"Failed to notify about {len(failed)} sensor(s), will retry")
 
         # Clear notification timestamps for sensors that are back online
-        online_sensors = Sensor.objects.filter(
-            last_seen__gte=timeout_threshold,
-            last_notified_timeout__isnull=False
-        )
-        updated_count = online_sensors.update(last_notified_timeout=None)
+        updated_count = offline_detection.clear_recovered_sensors(timeout_minutes)
         if updated_count > 0:
             logger.info(f"Cleared notification state for {updated_count} sensor(s) that came back online")
 
@@ -127,47 +111,23 @@ class NetworkMonitoringService:
             logger.debug("Device offline alerts are disabled")
             return
 
-        # A device is considered offline if not seen in the last 6 hours
-        # This matches the online() method in the Device model
-        offline_threshold = timezone.now() - datetime.timedelta(hours=6)
-
-        # Find devices that were previously online but are now offline
-        # We only care about devices with nicknames (user has marked them as important)
-        offline_devices = Device.objects.filter(
-            last_seen__lt=offline_threshold
-        ).exclude(nickname__isnull=True).exclude(nickname='')
-
-        for device in offline_devices:
-            # Use select_for_update to prevent race conditions
+        # Nicknamed devices offline for 6 hours and not notified in the last 24 hours, claimed in one statement
+        results = NotificationResults(lambda delivered, failed: offline_detection.release_devices(failed))
+        for device in offline_detection.claim_offline_devices():
+            on_result = results.callback(device)
             try:
-                # Re-fetch with lock to ensure atomic check-and-update
-                locked_device = Device.objects.select_for_update(nowait=True).get(pk=device.pk)
-
-                # Check if we've already notified about this device being offline
-                # Only notify again if it's been offline for at least 24 hours since last notification
-                should_notify = (
-                        locked_device.last_notified_offline is None or
-                        locked_device.last_notified_offline < timezone.now() - datetime.timedelta(hours=24)
-                )
-
-                if should_notify:
-                    device_name = locked_device.name() or locked_device.mac
-                    self.notifier.notify_device_offline(device_name, locked_device.ip, locked_device.mac)
-                    locked_device.last_notified_offline = timezone.now()
-                    locked_device.save(update_fields=['last_notified_offline'])
-                    logger.info(
-                        f"Device offline notification sent: {device_name} ({locked_device.ip}) - {locked_device.mac}")
+                device_name = device.name() or device.mac
+                self.notifier.notify_device_offline(device_name, device.ip, device.mac, on_result=on_result)
+                logger.info(f"Device offline: {device_name} ({device.ip}) - {device.mac}")
             except Exception as e:
-                # Log and continue if we can't acquire lock (another process is handling it)
-                logger.debug(f"Skipping device {device.mac} - could not acquire lock or error occurred: {e}")
-                continue
+                logger.warning(f"Failed to notify about device {device.mac}: {e}")
+                on_result(False)
+        _, failed = results.close()
+        if failed:
+            logger.warning(f"Failed to notify about {len(failed)} device(s), will retry")
 
         # Clear notification timestamps for devices that are back online
-        online_devices = Device.objects.filter(
-            last_seen__gte=offline_threshold,
-            last_notified_offline__isnull=False
-        )
-        updated_count = online_devices.update(last_notified_offline=None)
+        updated_count = offline_detection.clear_recovered_devices()
         if updated_count > 0:
             logger.info(f"Cleared notification state for {updated_count} device(s) that came back online")
 
@@ -0,0 +1,209 @@
+"""
+Background dispatcher that drains the notification outbox.
+Ingest requests only write outbox rows, the Pushover calls happen here.
+"""
+import datetime
+import logging
+import threading
+import uuid
+
+from django.db.models import F, Q
+from django.utils import timezone
+from easy_net_visibility_server.models import NotificationOutbox
+from easy_net_visibility_server.pushover_notifier import NotificationResults, get_notifier
+
+logger = logging.getLogger(__name__)
+
+# A claim older than this plus the digest window is considered abandoned (e.g. the worker holding it died)
+_CLAIM_TIMEOUT_MINUTES = 10
+
+# Rows are given up on after this many failed delivery attempts
+_MAX_ATTEMPTS = 5
+
+# Delivered rows are kept this long for troubleshooting
+_RETENTION_DAYS = 7
+
+
+def enqueue_new_devices(devices):
+    """
+    Write a new device notification for each device to the outbox.
+    Call inside the transaction that inserts the devices so both commit together.
+    """
+    notifier = get_notifier()
+    if not notifier.enabled or not notifier.alert_new_device:
+        return
+
+    now = timezone.now()
+    NotificationOutbox.objects.bulk_create([
+        NotificationOutbox(event_type=NotificationOutbox.NEW_DEVICE,
+                           name=device.hostname or device.mac,
+                           ip=device.ip,
+                           mac=device.mac,
+                           created_at=now)
+        for device in devices
+    ])
+
+
+class NotificationDispatcher:
+    """
+    Background service that claims pending outbox rows in batches and sends them.
+    Several processes may run a dispatcher, a batch is only sent by the process that claimed it.
+    """
+
+    def __init__(self, poll_interval_seconds=5, batch_size=100):
+        """
+        Initialize the dispatcher.
+
+        Args:
+            poll_interval_seconds: How often to look for pending notifications (default: 5)
+            batch_size: Maximum number of notifications claimed per round trip (default: 100)
+        """
+        self.poll_interval_seconds = poll_interval_seconds
+        self.batch_size = batch_size
+        self.notifier = get_notifier()
+        self._thread = None
+        self._stop_event = threading.Event()
+        self._wake_event = threading.Event()
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Start the dispatcher in a background thread."""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                logger.warning("Notification dispatcher is already running")
+                return
+
+            logger.info(f"Starting notification dispatcher (poll interval: {self.poll_interval_seconds}s)")
+            self._stop_event.clear()
+            self._thread = threading.Thread(target=self._dispatch_loop, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Stop the dispatcher."""
+        with self._lock:
+            if self._thread is None:
+                return
+
+            logger.info("Stopping notification dispatcher")
+            self._stop_event.set()
+            self._wake_event.set()
+            thread = self._thread
+        thread.join(timeout=5)
+
+    def wake(self):
+        """Ask the dispatcher to check the outbox now instead of waiting for the next poll."""
+        self._wake_event.set()
+
+    def _dispatch_loop(self):
+        """Main dispatch loop that runs in the background."""
+        logger.info("Notification dispatch loop started")
+
+        # Wait briefly before first check to ensure Django initialization is complete
+        self._stop_event.wait(timeout=1)
+
+        while not self._stop_event.is_set():
+            try:
+                # Keep draining while full batches are delivered
+                while self.dispatch_pending() == self.batch_size:
+                    pass
+                self.purge_delivered()
+            except Exception as e:
+                logger.exception(f"Error in notification dispatch loop: {e}")
+
+            self._wake_event.wait(timeout=self.poll_interval_seconds)
+            self._wake_event.clear()
+
+        logger.info("Notification dispatch loop stopped")
+
+    def _claim_batch(self):
+        """Atomically claim up to batch_size pending rows. Returns the claimed rows."""
+        now = timezone.now()
+        # Digested notifications stay claimed until their digest was sent
+        claim_timeout = datetime.timedelta(minutes=_CLAIM_TIMEOUT_MINUTES, seconds=self.notifier.digest_window_seconds)
+        claimable = Q(claimed_at__isnull=True) | Q(claimed_at__lt=now - claim_timeout)
+        pending = NotificationOutbox.objects.filter(claimable, sent_at__isnull=True, attempts__lt=_MAX_ATTEMPTS)
+        candidate_ids = list(pending.order_by('id').values_list('id', flat=True)[:self.batch_size])
+        if not candidate_ids:
+            return []
+
+        # Only rows still claimable are updated, so a concurrent dispatcher can't claim the same row
+        token = uuid.uuid4().hex
+        pending.filter(pk__in=candidate_ids).update(claimed_by=token, claimed_at=now)
+        return list(NotificationOutbox.objects.filter(claimed_by=token).order_by('id'))
+
+    def dispatch_pending(self):
+        """
+        Claim and send one batch of pending notifications. A row is marked sent once the
+        notifier reports it delivered, which for digested alerts is when the digest was sent.
+        Rows that don't fit in a full delivery queue are released without using up an attempt.
+        Returns the number of notifications delivered or still on their way.
+        """
+        batch = self._claim_batch()
+        if not batch:
+            return 0
+
+        token = batch[0].claimed_by
+        deferred_ids = []
+
+        def defer(ids):
+            deferred_ids.extend(ids)
+            self._release(token, ids)
+
+        results = NotificationResults(lambda delivered_ids, failed_ids: self._record_results(token, delivered_ids, failed_ids),
+                                      defer=defer)
+        queue_full = False
+        for notification in batch:
+            on_result = results.callback(notification.id)
+            if not self.notifier.enabled or not self.notifier.alert_new_device:
+                # Alerts were switched off after the row was written, nothing to deliver
+                on_result(True)
+            elif queue_full or self.notifier.delivery_queue_full():
+                # Nothing more fits, the rest waits for the next pass
+                queue_full = True
+                on_result(None)
+            else:
+                self.notifier.notify_new_device(notification.name, notification.ip, notification.mac,
+                                                on_result=on_result)
+        _, failed_ids = results.close()
+        if deferred_ids:
+            logger.info(f"Delivery queue full, {len(deferred_ids)} notification(s) left for the next pass")
+        return len(batch) - len(failed_ids) - len(deferred_ids)
+
+    @staticmethod
+    def _record_results(token, delivered_ids, failed_ids):
+        """Mark delivered rows sent and release failed ones for a retry, unless they were claimed again since."""
+        claimed = NotificationOutbox.objects.filter(claimed_by=token)
+        claimed.filter(pk__in=delivered_ids).update(sent_at=timezone.now())
+        claimed.filter(pk__in=failed_ids).update(
+            claimed_by=None,
+            claimed_at=None,
+            attempts=F('attempts') + 1,
+            last_error='delivery failed'
+        )
+        if failed_ids:
+            logger.warning(f"Failed to deliver {len(failed_ids)} notification(s), will retry")
+
+    @staticmethod
+    def _release(token, ids):
+        """Release rows that weren't attempted, they are claimed again on the next pass."""
+        NotificationOutbox.objects.filter(claimed_by=token, pk__in=ids).update(claimed_by=None, claimed_at=None)
+
+    def purge_delivered(self):
+        """Delete delivered notifications older than the retention period."""
+        threshold = timezone.now() - datetime.timedelta(days=_RETENTION_DAYS)
+        NotificationOutbox.objects.filter(sent_at__lt=threshold).delete()
+
+
+# Global dispatcher instance
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+
+def get_notification_dispatcher() -> NotificationDispatcher:
+    """Get or create the global NotificationDispatcher instance."""
+    global _dispatcher
+    if _dispatcher is None:
+        with _dispatcher_lock:
+            if _dispatcher is None:
+                _dispatcher = NotificationDispatcher()
+    return _dispatcher
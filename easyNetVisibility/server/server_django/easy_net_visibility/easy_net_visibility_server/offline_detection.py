@@ -0,0 +1,77 @@
+"""
+Set-based offline detection shared by the monitoring service and the monitor_network command.
+
+Sensors and devices to notify are claimed with a single UPDATE that stamps their
+last-notified timestamp, guarded by the same conditions that select them. The claimed
+rows are then read back by that stamp, so the cost of a check doesn't depend on the
+number of offline rows and two monitors can't claim the same row: once a row is stamped
+it no longer matches the UPDATE's conditions.
+"""
+import datetime
+
+from django.db.models import Q
+from django.utils import timezone
+from easy_net_visibility_server.models import ONLINE_WINDOW, Device, Sensor
+
+# Offline sensors and devices are notified again at most once per this interval
+RENOTIFY_INTERVAL = datetime.timedelta(hours=24)
+
+
+def claim_offline_sensors(timeout_minutes):
+    """
+    Claim the sensors not seen within timeout_minutes that are due a timeout notification.
+    Returns the claimed sensors, their last_notified_timeout already stamped.
+    """
+    stamp = timezone.now()
+    threshold = stamp - datetime.timedelta(minutes=timeout_minutes)
+    claimed = Sensor.objects.filter(
+        Q(last_notified_timeout__isnull=True) | Q(last_notified_timeout__lt=stamp - RENOTIFY_INTERVAL),
+        last_seen__lt=threshold,
+    ).update(last_notified_timeout=stamp)
+    if not claimed:
+        return []
+    return list(Sensor.objects.filter(last_notified_timeout=stamp, last_seen__lt=threshold))
+
+
+def release_sensors(sensors):
+    """Release claimed sensors whose notification failed, so the next check retries them."""
+    if sensors:
+        Sensor.objects.filter(pk__in=[sensor.pk for sensor in sensors]).update(last_notified_timeout=None)
+
+
+def clear_recovered_sensors(timeout_minutes):
+    """Clear the notification state of sensors seen again. Returns how many were cleared."""
+    threshold = timezone.now() - datetime.timedelta(minutes=timeout_minutes)
+    return Sensor.objects.filter(last_seen__gte=threshold, last_notified_timeout__isnull=False) \
+        .update(last_notified_timeout=None)
+
+
+def claim_offline_devices():
+    """
+    Claim the nicknamed devices that went offline and are due an offline notification.
+    Returns the claimed devices, their last_notified_offline already stamped.
+    """
+    stamp = timezone.now()
+    # Matches Device.online(), only devices the user nicknamed are watched
+    threshold = stamp - ONLINE_WINDOW
+    offline_devices = Device.objects.filter(last_seen__lt=threshold) \
+        .exclude(nickname__isnull=True).exclude(nickname='')
+    claimed = offline_devices.filter(
+        Q(last_notified_offline__isnull=True) | Q(last_notified_offline__lt=stamp - RENOTIFY_INTERVAL)
+    ).update(last_notified_offline=stamp)
+    if not claimed:
+        return []
+    return list(offline_devices.filter(last_notified_offline=stamp))
+
+
+def release_devices(devices):
+    """Release claimed devices whose notification failed, so the next check retries them."""
+    if devices:
+        Device.objects.filter(pk__in=[device.pk for device in devices]).update(last_notified_offline=None)
+
+
+def clear_recovered_devices():
+    """Clear the notification state of devices seen again. Returns how many were cleared."""
+    threshold = timezone.now() - ONLINE_WINDOW
+    return Device.objects.filter(last_seen__gte=threshold, last_notified_offline__isnull=False) \
+        .update(last_notified_offline=None)
@@ -1,11 +1,20 @@
 """
 Pushover notification service for sending alerts about network devices and sensors.
+
+With digest_window_seconds set, alerts are not sent one by one. The first alert of a
+type opens a window, alerts of the same type raised during it are collected, and one
+summary with the count and the first names is sent when the window closes. Until then the
+alerts aren't delivered, callers learn that they were through their on_result callback.
 """
 import logging
 import threading
+import time
 from typing import Optional
 
 from django.conf import settings
+from django.db import connections
+from easy_net_visibility_server import metrics
+from easy_net_visibility_server.delivery_queue import DeliveryQueue
 
 try:
     from pushover_complete import PushoverAPI
@@ -14,6 +23,81 @@ except ImportError:
 
 _logger = logging.getLogger(__name__)
 
+NEW_DEVICE = 'new_device'
+GATEWAY_TIMEOUT = 'gateway_timeout'
+DEVICE_OFFLINE = 'device_offline'
+
+# Title, priority and summary heading of each alert type's digest, in sending order
+_DIGEST_FORMATS = {
+    GATEWAY_TIMEOUT: ("Gateway Timeout Alert", 1, "{count} gateways have not been detected"),
+    DEVICE_OFFLINE: ("Device Offline Alert", 0, "{count} devices went offline"),
+    NEW_DEVICE: ("New Device Detected", 0, "{count} new devices detected"),
+}
+
+
+def _report(on_result, delivered):
+    """Pass the outcome of a notification to its on_result callback, if there is one."""
+    if on_result is None:
+        return
+    try:
+        on_result(delivered)
+    except Exception as e:
+        _logger.exception(f"Error handling the result of a notification: {e}")
+
+
+class NotificationResults:
+    """
+    Collects the outcomes of a batch of notifications for the code that sent them, e.g. to
+    release the claims of failed alerts. Outcomes reported while the batch is being sent are
+    handled together by close(), outcomes reported later are handled as they come in.
+    """
+
+    def __init__(self, handle, defer=None):
+        """
+        Args:
+            handle: Called with (delivered keys, failed keys)
+            defer: Called with the keys of notifications that weren't attempted because the
+                delivery queue was full. Without it they count as failed
+        """
+        self._handle = handle
+        self._defer = defer
+        self._lock = threading.Lock()
+        self._delivered = []
+        self._failed = []
+        self._deferred = []
+        self._closed = False
+
+    def callback(self, key):
+        """Returns the on_result callback for the notification identified by key."""
+        def on_result(delivered):
+            if delivered is None and self._defer is None:
+                delivered = False
+            with self._lock:
+                if not self._closed:
+                    if delivered is None:
+                        self._deferred.append(key)
+                    else:
+                        (self._delivered if delivered else self._failed).append(key)
+                    return
+            if delivered is None:
+                self._defer([key])
+            elif delivered:
+                self._handle([key], [])
+            else:
+                self._handle([], [key])
+        return on_result
+
+    def close(self):
+        """Handle the outcomes reported so far. Returns (delivered keys, failed keys)."""
+        with self._lock:
+            self._closed = True
+            delivered, failed, deferred = self._delivered, self._failed, self._deferred
+        if delivered or failed:
+            self._handle(delivered, failed)
+        if deferred:
+            self._defer(deferred)
+        return delivered, failed
+
 
 class PushoverNotifier:
     """
@@ -28,9 +112,34 @@ class PushoverNotifier:
         self.alert_gateway_timeout = False
         self.alert_device_offline = False
         self.gateway_timeout_minutes = 10
+        self.digest_window_seconds = 0
+        self.digest_max_names = 10
+        self.max_digests_per_window = 0
+        # Sends go through this queue and its worker thread, None sends on the caller's thread
+        self.delivery_queue = None
+
+        # Pending digest alerts: {alert type: [(message, summary line, on_result)]}
+        self._digest_lock = threading.Lock()
+        self._digest_pending = {}
+        self._digest_timer = None
 
         self._load_config()
 
+    @staticmethod
+    def _int_setting(pushover_config, key, default, min_value, max_value):
+        """Read an integer setting, falling back to the default with a warning when invalid."""
+        raw_value = pushover_config.get(key, default)
+        try:
+            value = int(raw_value)
+        except (TypeError, ValueError):
+            _logger.warning(f"Non-numeric {key} value '{raw_value}'; using default of {default} instead.")
+            return default
+        if value < min_value or value > max_value:
+            _logger.warning(f"Invalid {key} value '{raw_value}'; must be between {min_value} and {max_value}. "
+                            f"Using default of {default} instead.")
+            return default
+        return value
+
     def _load_config(self):
         """Load Pushover configuration from Django settings."""
         pushover_config = getattr(settings, 'PUSHOVER_CONFIG', None)
@@ -84,16 +193,29 @@ class PushoverNotifier:
                 timeout_value = default_timeout
             self.gateway_timeout_minutes = timeout_value
 
+            self.digest_window_seconds = self._int_setting(pushover_config, 'digest_window_seconds', 0, 0, 3600)
+            self.digest_max_names = self._int_setting(pushover_config, 'digest_max_names', 10, 1, 100)
+            self.max_digests_per_window = self._int_setting(pushover_config, 'max_digests_per_window', 0, 0, 100)
+
             _logger.info(f"Pushover notifier initialized: new_device={self.alert_new_device}, "
                          f"gateway_timeout={self.alert_gateway_timeout}, "
-                         f"device_offline={self.alert_device_offline}")
+                         f"device_offline={self.alert_device_offline}, "
+                         f"digest_window={self.digest_window_seconds}s")
+
+            queue_size = self._int_setting(pushover_config, 'delivery_queue_size', 1000, 0, 100000)
+            if queue_size > 0:
+                self.delivery_queue = DeliveryQueue(
+                    self._deliver,
+                    max_size=queue_size,
+                    max_attempts=self._int_setting(pushover_config, 'delivery_max_attempts', 5, 1, 20)
+                )
         except Exception as e:
             _logger.error(f"Failed to initialize Pushover client: {e}")
             self.enabled = False
             self.client = None
             self.user_key = None
 
-    def send_notification(self, message: str, title: str = "EasyNetVisibility", priority: int = 0):
+    def send_notification(self, message: str, title: str = "EasyNetVisibility", priority: int = 0, on_result=None):
         """
         Send a Pushover notification.
 
@@ -112,18 +234,80 @@ class PushoverNotifier:
                 typically requires additional parameters such as retry and
                 expire; this notifier does not configure those parameters
                 itself.
+            on_result: Called with True once the notification was delivered, or with False when it
+                wasn't. With the delivery queue on, this is how callers learn the outcome. Called
+                with None when the delivery queue was full and nothing was attempted
+
+        Returns:
+            True if the notification was delivered to Pushover. False otherwise, including when it
+            was only queued for delivery
+        """
+        notification = {'title': title, 'message': message, 'priority': priority}
+        accepted = self._submit(notification, on_result)
+        if not accepted:
+            # None when the delivery queue was full
+            _report(on_result, accepted)
+            return False
+        return self.delivery_queue is None
+
+    def _submit(self, notification, on_result):
+        """
+        Deliver a notification, or queue it when the delivery queue is on.
+        Returns True if it was delivered or queued, on_result is then called with the outcome.
+        Otherwise on_result isn't called, and False is returned, or None when the delivery
+        queue was full.
         """
         if not self.enabled or not self.client:
-            _logger.debug(f"Notification not sent (disabled): {message}")
-            return
+            _logger.debug(f"Notification not sent (disabled): {notification['message']}")
+            return False
+
+        if self.delivery_queue is not None:
+            if on_result is not None:
+                on_result = self._worker_callback(on_result)
+            return self.delivery_queue.put(notification, on_result) or None
 
         try:
-            self.client.send_message(self.user_key, message, title=title, priority=priority)
-            _logger.info(f"Pushover notification sent: {title} - {message}")
+            self._deliver(notification)
         except Exception as e:
             _logger.error(f"Failed to send Pushover notification ({type(e).__name__}): {e}")
+            return False
+        _report(on_result, True)
+        return True
+
+    @staticmethod
+    def _worker_callback(on_result):
+        """Wrap a callback run on the delivery worker thread."""
+        def report(delivered):
+            try:
+                _report(on_result, delivered)
+            finally:
+                # The callback may have used the database from the worker thread
+                connections.close_all()
+        return report
+
+    def _deliver(self, notification):
+        """Send one notification to Pushover, raising on failure."""
+        started = time.perf_counter()
+        try:
+            self.client.send_message(self.user_key, notification['message'],
+                                     title=notification['title'], priority=notification['priority'])
+        finally:
+            metrics.NOTIFICATION_SEND_DURATION.observe(time.perf_counter() - started)
+        _logger.info(f"Pushover notification sent: {notification['title']} - {notification['message']}")
+
+    def delivery_stats(self):
+        """Returns the delivery queue depth and counters, or None when sends aren't queued."""
+        return self.delivery_queue.stats() if self.delivery_queue is not None else None
+
+    def delivery_queue_full(self):
+        """Returns True if notifications are queued and the queue has no room left."""
+        return self.delivery_queue is not None and self.delivery_queue.full()
 
-    def notify_new_device(self, device_name: str, ip: str, mac: str):
+    def wait_for_delivery(self, timeout):
+        """Wait until queued notifications were delivered or dropped. Returns True if none are left."""
+        return self.delivery_queue.wait_until_idle(timeout) if self.delivery_queue is not None else True
+
+    def notify_new_device(self, device_name: str, ip: str, mac: str, on_result=None):
         """
         Send alert for newly detected device.
 
@@ -131,28 +315,32 @@ class PushoverNotifier:
             device_name: Device hostname or nickname
             ip: Device IP address
             mac: Device MAC address
+            on_result: See send_notification()
         """
         if not self.alert_new_device:
-            return
+            _report(on_result, False)
+            return False
 
         message = f"New device detected:\nName: {device_name}\nIP: {ip}\nMAC: {mac}"
-        self.send_notification(message, title="New Device Detected", priority=0)
+        return self._notify(NEW_DEVICE, message, f"{device_name} ({ip})", on_result)
 
-    def notify_gateway_timeout(self, sensor_name: str, minutes_offline: int):
+    def notify_gateway_timeout(self, sensor_name: str, minutes_offline: int, on_result=None):
         """
         Send alert for gateway (sensor) timeout.
 
         Args:
             sensor_name: Sensor hostname
             minutes_offline: Minutes since last seen
+            on_result: See send_notification()
         """
         if not self.alert_gateway_timeout:
-            return
+            _report(on_result, False)
+            return False
 
         message = f"Gateway '{sensor_name}' has not been detected for {minutes_offline} minutes"
-        self.send_notification(message, title="Gateway Timeout Alert", priority=1)
+        return self._notify(GATEWAY_TIMEOUT, message, f"{sensor_name} ({minutes_offline} minutes)", on_result)
 
-    def notify_device_offline(self, device_name: str, ip: str, mac: str):
+    def notify_device_offline(self, device_name: str, ip: str, mac: str, on_result=None):
         """
         Send alert for device going offline.
 
@@ -160,12 +348,102 @@ class PushoverNotifier:
             device_name: Device hostname or nickname
             ip: Device IP address
             mac: Device MAC address
+            on_result: See send_notification()
         """
         if not self.alert_device_offline:
-            return
+            _report(on_result, False)
+            return False
 
         message = f"Device went offline:\nName: {device_name}\nIP: {ip}\nMAC: {mac}"
-        self.send_notification(message, title="Device Offline Alert", priority=0)
+        return self._notify(DEVICE_OFFLINE, message, f"{device_name} ({ip})", on_result)
+
+    def _notify(self, alert_type, message, summary_line, on_result=None):
+        """
+        Send an alert right away, or add it to the digest of its type when digesting is on.
+        A digested alert isn't delivered yet, False is returned and on_result is called once
+        its digest was sent.
+        """
+        title, priority, _ = _DIGEST_FORMATS[alert_type]
+        if self.digest_window_seconds <= 0:
+            return self.send_notification(message, title=title, priority=priority, on_result=on_result)
+        if not self.enabled or not self.client:
+            _logger.debug(f"Notification not sent (disabled): {message}")
+            _report(on_result, False)
+            return False
+
+        with self._digest_lock:
+            self._digest_pending.setdefault(alert_type, []).append((message, summary_line, on_result))
+            self._schedule_digest()
+        return False
+
+    def _schedule_digest(self):
+        """Start the window timer if it isn't running. Call with the digest lock held."""
+        if self._digest_timer is None and self._digest_pending:
+            self._digest_timer = threading.Timer(self.digest_window_seconds, self._digest_timer_fired)
+            self._digest_timer.daemon = True
+            self._digest_timer.start()
+
+    def _digest_timer_fired(self):
+        try:
+            self._on_digest_window_end()
+        finally:
+            # Result callbacks may have used the database from the timer thread
+            connections.close_all()
+
+    def _on_digest_window_end(self):
+        with self._digest_lock:
+            self._digest_timer = None
+        self.flush(budget=self.max_digests_per_window or None)
+
+    def _digest_message(self, alert_type, alerts):
+        """Returns the message for a list of alerts, the alert itself when there's only one."""
+        if len(alerts) == 1:
+            return alerts[0][0]
+        _, _, heading = _DIGEST_FORMATS[alert_type]
+        lines = [heading.format(count=len(alerts)) + ":"]
+        lines += [summary_line for _, summary_line, _ in alerts[:self.digest_max_names]]
+        if len(alerts) > self.digest_max_names:
+            lines.append(f"...and {len(alerts) - self.digest_max_names} more")
+        return "\n".join(lines)
+
+    @staticmethod
+    def _report_digest(alerts, delivered):
+        for _, _, on_result in alerts:
+            _report(on_result, delivered)
+
+    def flush(self, budget=None):
+        """
+        Send the pending digests now, one message per alert type.
+        At most budget messages are sent, the rest and any failed digest are kept for the next window.
+        A digest handed to the delivery queue counts as sent, its alerts learn the outcome from the queue.
+        Returns the number of messages sent.
+        """
+        with self._digest_lock:
+            pending, self._digest_pending = self._digest_pending, {}
+
+        sent = 0
+        unsent = {}
+        for alert_type in _DIGEST_FORMATS:
+            alerts = pending.get(alert_type)
+            if not alerts:
+                continue
+            title, priority, _ = _DIGEST_FORMATS[alert_type]
+            notification = {'title': title, 'message': self._digest_message(alert_type, alerts), 'priority': priority}
+            if (budget is None or sent < budget) and \
+                    self._submit(notification, lambda delivered, alerts=alerts: self._report_digest(alerts, delivered)):
+                sent += 1
+            else:
+                unsent[alert_type] = alerts
+
+        with self._digest_lock:
+            # Keep unsent alerts ahead of the ones raised while sending
+            for alert_type, alerts in unsent.items():
+                self._digest_pending[alert_type] = alerts + self._digest_pending.get(alert_type, [])
+            if self.digest_window_seconds > 0:
+                self._schedule_digest()
+        if unsent:
+            _logger.info(f"{sum(len(alerts) for alerts in unsent.values())} alert(s) deferred to the next digest window")
+        return sent
 
 
 # Global notifier instance and lock for thread-safe initialization
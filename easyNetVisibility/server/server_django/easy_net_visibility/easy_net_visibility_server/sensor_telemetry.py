@@ -0,0 +1,165 @@
+"""
+Rollup of the operational stats sensors send with their health reports.
+
+A sensor reports cumulative counters since its process started. Each report is folded
+into one SensorStats row per sensor and hour: counters become the increase since the
+previous report, durations and gauges keep their maximum. A sensor restart is detected
+by a new started_at and counted from zero. A report taken before the last one applied,
+e.g. replayed from the sensor's spool, is ignored so its counters aren't counted twice.
+
+Rows are kept for SENSOR_STATS_RETENTION_DAYS days (default 30).
+"""
+import datetime
+import logging
+import math
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import SensorStats
+
+_logger = logging.getLogger(__name__)
+
+_DEFAULT_RETENTION_DAYS = 30
+
+# Bounds on what a sensor may report, the payload is not trusted
+_MAX_LOOPS = 20
+_MAX_LOOP_NAME_LENGTH = 50
+
+# Cumulative loop counters, stored per hour as the increase over the hour
+_LOOP_COUNTERS = ('cycles', 'failures', 'upload_failures', 'bytes_sent')
+
+
+def retention_days():
+    return getattr(settings, 'SENSOR_STATS_RETENTION_DAYS', None) or _DEFAULT_RETENTION_DAYS
+
+
+def _number(value):
+    """Returns value as a non-negative finite number, or None."""
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return None
+    if not math.isfinite(value) or value < 0:
+        return None
+    return value
+
+
+def _parse_loops(raw_loops):
+    if not isinstance(raw_loops, dict):
+        return {}
+    loops = {}
+    for name, raw in list(raw_loops.items())[:_MAX_LOOPS]:
+        if not isinstance(raw, dict) or not isinstance(name, str):
+            continue
+        fields = {key: _number(raw.get(key)) for key in _LOOP_COUNTERS}
+        fields['duration_seconds'] = _number(raw.get('last_duration_seconds'))
+        fields['found'] = _number(raw.get('last_found'))
+        loops[name[:_MAX_LOOP_NAME_LENGTH]] = fields
+    return loops
+
+
+def _report_time(value):
+    """Parses a timestamp of the report, None when missing or invalid."""
+    if not isinstance(value, str):
+        return None
+    try:
+        parsed = datetime.datetime.fromisoformat(value)
+    except ValueError:
+        return None
+    return parsed if parsed.tzinfo is not None else parsed.replace(tzinfo=datetime.timezone.utc)
+
+
+def _is_older(started_at, updated_at, previous_totals):
+    """True if the report was taken before the previous one, by process start and then by report time."""
+    taken = (_report_time(started_at), _report_time(updated_at))
+    previous = (_report_time(previous_totals.get('started_at')), _report_time(previous_totals.get('updated_at')))
+    if None in taken or None in previous:
+        return False
+    return taken < previous
+
+
+def _increase(current, previous, restarted):
+    """The increase of a cumulative counter since the previous report."""
+    if current is None:
+        return 0
+    if restarted or previous is None or current < previous:
+        return current
+    return current - previous
+
+
+def _max(a, b):
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return max(a, b)
+
+
+def record_health(sensor, metrics, now=None):
+    """Fold the metrics of a health report into the sensor's row for the current hour."""
+    if not isinstance(metrics, dict):
+        return
+    now = now or timezone.now()
+    hour = now.replace(minute=0, second=0, microsecond=0)
+    loops = _parse_loops(metrics.get('loops'))
+    process = metrics.get('process') if isinstance(metrics.get('process'), dict) else {}
+    cpu_total = _number(process.get('cpu_seconds'))
+    started_at = metrics.get('started_at') if isinstance(metrics.get('started_at'), str) else None
+    updated_at = metrics.get('updated_at') if isinstance(metrics.get('updated_at'), str) else None
+
+    with transaction.atomic():
+        latest = SensorStats.objects.select_for_update().filter(sensor=sensor).order_by('-hour').first()
+        previous_totals = latest.totals if latest is not None else {}
+        if _is_older(started_at, updated_at, previous_totals):
+            _logger.debug(f"Ignoring an out of order health report of sensor {sensor.mac} from {updated_at}")
+            return
+        if latest is not None and latest.hour == hour:
+            row = latest
+        else:
+            row = SensorStats(sensor=sensor, hour=hour, loops={})
+
+        restarted = started_at != previous_totals.get('started_at')
+        previous_loops = previous_totals.get('loops', {})
+
+        row.reports += 1
+        row.rss_bytes_max = _max(row.rss_bytes_max, _number(process.get('rss_bytes')))
+        row.spool_depth_max = _max(row.spool_depth_max, _number(metrics.get('spool_depth')))
+        row.cpu_seconds += _increase(cpu_total, previous_totals.get('cpu_seconds'), restarted)
+
+        for name, fields in loops.items():
+            hourly = row.loops.setdefault(name, {})
+            previous = previous_loops.get(name, {})
+            for key in _LOOP_COUNTERS:
+                hourly[key] = hourly.get(key, 0) + _increase(fields[key], previous.get(key), restarted)
+            hourly['max_duration_seconds'] = _max(hourly.get('max_duration_seconds'), fields['duration_seconds'])
+            if fields['found'] is not None:
+                hourly['found'] = fields['found']
+
+        row.totals = {
+            'started_at': started_at,
+            'updated_at': updated_at,
+            'cpu_seconds': cpu_total,
+            'loops': {name: {key: fields[key] for key in _LOOP_COUNTERS} for name, fields in loops.items()},
+        }
+        row.save()
+
+
+def purge_expired(now=None):
+    """Delete rollup rows older than the retention period. Returns the number deleted."""
+    threshold = (now or timezone.now()) - datetime.timedelta(days=retention_days())
+    deleted, _ = SensorStats.objects.filter(hour__lt=threshold).delete()
+    return deleted
+
+
+def recent_trends(sensors, hours=24, now=None):
+    """
+    Returns {sensor id: [SensorStats]} with each sensor's rows of the last hours, oldest first,
+    and each row's loops as a sorted list of (name, stats) for the template.
+    """
+    since = (now or timezone.now()) - datetime.timedelta(hours=hours)
+    trends = {sensor.id: [] for sensor in sensors}
+    for row in SensorStats.objects.filter(sensor__in=sensors, hour__gte=since).order_by('hour'):
+        row.loop_list = sorted(row.loops.items())
+        row.rss_mb = round(row.rss_bytes_max / (1024 * 1024), 1) if row.rss_bytes_max is not None else None
+        trends[row.sensor_id].append(row)
+    return trends
@@ -0,0 +1,21 @@
+"""
+Model signal receivers, connected when the app is ready.
+"""
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+from . import write_coalescing
+from .models import Device, Port
+
+
+@receiver(post_delete, sender=Device)
+def forget_deleted_device(sender, instance, **kwargs):
+    # A sensor reporting the device again must recreate it right away
+    write_coalescing.forget(write_coalescing.DEVICE, [instance.mac])
+
+
+@receiver(post_delete, sender=Port)
+def forget_deleted_port(sender, instance, origin=None, **kwargs):
+    # Ports deleted along with their device get the device as origin, saving a query per port
+    device = origin if isinstance(origin, Device) and origin.pk == instance.device_id else instance.device
+    write_coalescing.forget(write_coalescing.PORT, [write_coalescing.port_key(device.mac, instance.port_num)])
@@ -1,15 +1,17 @@
 import datetime
 from abc import ABC
+from unittest.mock import patch
 
 from django.contrib.auth.models import User
-from django.test import Client, TestCase
+from django.db import connection
+from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.utils import timezone
 from rest_framework.test import APIClient
 
 from .models import Device
 from .models import Port
-from .views import get_subnet
 
 
 class TestDeviceModel(TestCase):
@@ -41,22 +43,6 @@ class TestDeviceModel(TestCase):
         self.assertIn('192.168.1.2', str(self.device))
 
 
-class TestSubnetCalculation(TestCase):
-    def test_get_subnet_standard_ip(self):
-        self.assertEqual(get_subnet('192.168.1.100'), '192.168.1.0/24')
-        self.assertEqual(get_subnet('10.0.0.5'), '10.0.0.0/24')
-        self.assertEqual(get_subnet('172.16.5.20'), '172.16.5.0/24')
-
-    def test_get_subnet_different_prefix(self):
-        self.assertEqual(get_subnet('192.168.1.100', 16), '192.168.0.0/16')
-        self.assertEqual(get_subnet('10.0.0.5', 8), '10.0.0.0/8')
-
-    def test_get_subnet_invalid_ip(self):
-        self.assertEqual(get_subnet('invalid'), 'unknown')
-        self.assertEqual(get_subnet(''), 'unknown')
-        self.assertEqual(get_subnet('999.999.999.999'), 'unknown')
-
-
 class TestPortModel(TestCase):
     def setUp(self):
         self.device = Device.objects.create(
@@ -205,6 +191,62 @@ class TestDeviceView(TestCase):
         self.assertLess(pos_2, pos_10, "10.2.2.2 should come before 10.2.2.10")
         self.assertLess(pos_10, pos_139, "10.2.2.10 should come before 10.2.2.139")
 
+    def test_home_view_hides_offline_devices_without_nickname(self):
+        stale = timezone.now() - datetime.timedelta(days=1)
+        Device.objects.create(hostname='gone-host', ip='10.0.0.2', mac='AABBCCDDEE31',
+                              first_seen=stale, last_seen=stale)
+        Device.objects.create(nickname='KeptDevice', hostname='kept-host', ip='10.0.0.3', mac='AABBCCDDEE32',
+                              first_seen=stale, last_seen=stale)
+        Device.objects.create(hostname='online-host', ip='10.0.0.4', mac='AABBCCDDEE33',
+                              first_seen=stale, last_seen=timezone.now())
+
+        response = self.client.get(reverse('home'))
+
+        self.assertNotContains(response, 'AABBCCDDEE31')
+        self.assertContains(response, 'KeptDevice')
+        self.assertContains(response, 'AABBCCDDEE33')
+        self.assertEqual(response.context['totalDevices'], 3)
+        self.assertEqual(set(Device.objects.visible().values_list('mac', flat=True)),
+                         {d.mac for d in Device.objects.all() if not d.is_hidden()})
+
+    @patch('easy_net_visibility_server.views._DEVICES_PER_SUBNET_PAGE', 2)
+    def test_home_view_paginates_each_subnet(self):
+        for i in range(2, 7):
+            Device.objects.create(hostname=f'host{i}', ip=f'10.0.0.{i}', mac=f'AABBCCDDEE4{i}',
+                                  first_seen=timezone.now(), last_seen=timezone.now())
+        Device.objects.create(hostname='other', ip='10.0.1.1', mac='AABBCCDDEE51',
+                              first_seen=timezone.now(), last_seen=timezone.now())
+
+        response = self.client.get(reverse('home'), {'subnet': '10.0.0.0/24', 'page': 2})
+
+        grouped = {subnet: [d.ip for d in devices] for subnet, devices, _ in response.context['groupedDevices']}
+        self.assertEqual(grouped, {'10.0.0.0/24': ['10.0.0.3', '10.0.0.4'], '10.0.1.0/24': ['10.0.1.1']})
+        self.assertContains(response, 'Page 2 of 3')
+        self.assertEqual(response.context['totalDevices'], 7)
+
+    def test_home_view_renders_single_rename_modal(self):
+        for i in range(2, 12):
+            Device.objects.create(hostname=f'host{i}', ip=f'10.0.0.{i}', mac=f'AABBCCDDEE{i:02d}',
+                                  first_seen=timezone.now(), last_seen=timezone.now())
+
+        response = self.client.get(reverse('home'))
+
+        self.assertEqual(response.content.decode().count('class="modal fade"'), 1)
+        self.assertContains(response, f'data-device-id="{self.device.id}"')
+
+    def test_home_view_counts_ports_without_loading_them(self):
+        for port_num in (22, 80, 443):
+            Port.objects.create(device=self.device, port_num=port_num, protocol='TCP', name='', version='',
+                                product='', first_seen=timezone.now(), last_seen=timezone.now())
+        port_table = Port._meta.db_table
+
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('home'))
+
+        devices = response.context['groupedDevices'][0][1]
+        self.assertEqual(devices[0].port_count, 3)
+        self.assertFalse([q for q in ctx.captured_queries if q['sql'].startswith(f'SELECT "{port_table}".')])
+
     def test_rename_device(self):
         response = self.client.post(reverse('rename_device'), {
             'device_id': self.device.id,
@@ -742,6 +784,178 @@ class TestAddDevicesApi(TestCase):
         self.assertEqual(data['success_count'], 0)
         self.assertEqual(len(data['errors']), 2)
 
+    def test_batch_add_same_mac_twice(self):
+        payload = {
+            'devices': [
+                {'mac': 'AA:BB:CC:DD:EE:07', 'hostname': 'first', 'ip': '10.0.0.7', 'vendor': 'V7'},
+                {'mac': 'AA:BB:CC:DD:EE:07', 'hostname': 'second', 'ip': '10.0.0.77', 'vendor': ''}
+            ]
+        }
+        response = self.post_json(payload)
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['success_count'], 2)
+        self.assertEqual(len(data['errors']), 0)
+        dev = Device.objects.get(mac='AABBCCDDEE07')
+        self.assertEqual(dev.hostname, 'second')
+        self.assertEqual(dev.ip, '10.0.0.77')
+        self.assertEqual(dev.vendor, 'V7')
+
+    def test_batch_add_query_count_independent_of_batch_size(self):
+        Device.objects.create(mac='AABBCCDDEF00', hostname='old', ip='10.1.0.0', vendor='V',
+                              first_seen=datetime.datetime.now(), last_seen=datetime.datetime.now())
+
+        def batch(count, offset):
+            devices = [{'mac': 'AA:BB:CC:DD:EF:00', 'hostname': 'renamed%d' % offset, 'ip': '10.1.0.0'}]
+            for i in range(count):
+                devices.append({'mac': 'AA:BB:CC:DD:%02X:%02X' % (offset, i), 'hostname': 'h%d' % i,
+                                'ip': '10.1.%d.%d' % (offset, i)})
+            return {'devices': devices}
+
+        with CaptureQueriesContext(connection) as small:
+            self.post_json(batch(2, 1))
+        with CaptureQueriesContext(connection) as large:
+            response = self.post_json(batch(50, 2))
+
+        self.assertEqual(response.json()['success_count'], 51)
+        self.assertEqual(len(small.captured_queries), len(large.captured_queries))
+        self.assertEqual(Device.objects.count(), 53)
+
+    def test_batch_add_keeps_seen_at_of_replayed_devices(self):
+        seen_at = datetime.datetime.now().replace(microsecond=0) - datetime.timedelta(hours=3)
+
+        response = self.post_json({'devices': [{'mac': 'AA:BB:CC:DD:EE:21', 'hostname': 'replayed', 'ip': '10.0.0.21',
+                                                'seen_at': seen_at.isoformat()}]})
+
+        self.assertEqual(response.json()['success_count'], 1)
+        dev = Device.objects.get(mac='AABBCCDDEE21')
+        self.assertEqual(dev.first_seen, seen_at)
+        self.assertEqual(dev.last_seen, seen_at)
+
+    def test_batch_add_skips_devices_older_than_stored(self):
+        now = datetime.datetime.now()
+        Device.objects.create(mac='AABBCCDDEE22', hostname='current', ip='10.0.0.22', vendor='V',
+                              first_seen=now, last_seen=now)
+
+        response = self.post_json({'devices': [{'mac': 'AA:BB:CC:DD:EE:22', 'hostname': 'stale', 'ip': '10.0.0.99',
+                                                'seen_at': (now - datetime.timedelta(hours=1)).isoformat()}]})
+
+        self.assertEqual(response.json()['success_count'], 1)
+        dev = Device.objects.get(mac='AABBCCDDEE22')
+        self.assertEqual((dev.hostname, dev.ip, dev.last_seen), ('current', '10.0.0.22', now))
+
+    def test_batch_add_invalid_seen_at(self):
+        response = self.post_json({'devices': [{'mac': 'AA:BB:CC:DD:EE:23', 'hostname': 'h', 'ip': '10.0.0.23',
+                                                'seen_at': 'yesterday'}]})
+
+        self.assertEqual(response.json()['errors'][0]['index'], 0)
+        self.assertIn('seen_at', response.json()['errors'][0]['error'])
+        self.assertFalse(Device.objects.filter(mac='AABBCCDDEE23').exists())
+
+
+class TestDevicesSeenApi(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='seenuser', password='seenpass')
+        self.client = APIClient()
+        self.client.login(username='seenuser', password='seenpass')
+        self.url = reverse('devices_seen')
+        old = timezone.now() - datetime.timedelta(hours=2)
+        self.device = Device.objects.create(mac='AABBCCDDEE01', hostname='host1', ip='10.0.0.1', vendor='V1',
+                                            first_seen=old, last_seen=old)
+
+    def post_json(self, payload):
+        return self.client.post(self.url, payload, format='json', HTTP_ACCEPT='application/json')
+
+    def test_refreshes_last_seen(self):
+        previous = self.device.last_seen
+
+        response = self.post_json({'macs': ['AA:BB:CC:DD:EE:01']})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['updated_count'], 1)
+        self.device.refresh_from_db()
+        self.assertGreater(self.device.last_seen, previous)
+        self.assertEqual(self.device.hostname, 'host1')
+
+    def test_invalid_mac_reported(self):
+        response = self.post_json({'macs': ['AABBCCDDEE01', 'not-a-mac', 7]})
+
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['updated_count'], 1)
+        self.assertEqual([error['index'] for error in data['errors']], [1, 2])
+
+    def test_macs_must_be_list(self):
+        response = self.post_json({'macs': 'AABBCCDDEE01'})
+
+        self.assertEqual(response.status_code, 400)
+
+    def test_unknown_macs_returned_as_sent(self):
+        response = self.post_json({'macs': ['AA:BB:CC:DD:EE:01', 'AA:BB:CC:DD:EE:99']})
+
+        self.assertEqual(response.json()['unknown_macs'], ['AA:BB:CC:DD:EE:99'])
+        self.assertFalse(Device.objects.filter(mac='AABBCCDDEE99').exists())
+
+    def test_timestamp_is_used(self):
+        seen_at = datetime.datetime.now().replace(microsecond=0) - datetime.timedelta(minutes=5)
+
+        self.post_json({'macs': ['AABBCCDDEE01'], 'timestamp': seen_at.isoformat()})
+
+        self.device.refresh_from_db()
+        self.assertEqual(self.device.last_seen, seen_at)
+
+    def test_last_seen_never_moves_backwards(self):
+        response = self.post_json({'macs': ['AABBCCDDEE01'],
+                                   'timestamp': (self.device.last_seen - datetime.timedelta(hours=1)).isoformat()})
+
+        self.assertEqual(response.json()['updated_count'], 0)
+        self.assertEqual(response.json()['unknown_macs'], [])
+        previous = self.device.last_seen
+        self.device.refresh_from_db()
+        self.assertEqual(self.device.last_seen, previous)
+
+    def test_future_timestamp_is_clamped(self):
+        self.post_json({'macs': ['AABBCCDDEE01'],
+                        'timestamp': (datetime.datetime.now() + datetime.timedelta(days=1)).isoformat()})
+
+        self.device.refresh_from_db()
+        self.assertLessEqual(self.device.last_seen, datetime.datetime.now())
+
+    def test_invalid_timestamp(self):
+        response = self.post_json({'macs': ['AABBCCDDEE01'], 'timestamp': 'yesterday'})
+
+        self.assertEqual(response.status_code, 400)
+
+    @patch('easy_net_visibility_server.api_views._BULK_BATCH_SIZE', 10)
+    def test_large_lists_are_chunked(self):
+        Device.objects.bulk_create([
+            Device(mac='AABBCCDDEE%02X' % i, hostname='h', ip='10.0.1.%d' % i,
+                   first_seen=timezone.now(), last_seen=self.device.last_seen)
+            for i in range(2, 31)
+        ])
+
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.post_json({'macs': ['AABBCCDDEE%02X' % i for i in range(1, 31)]})
+
+        self.assertEqual(response.json()['updated_count'], 30)
+        updates = [q for q in ctx.captured_queries if q['sql'].startswith('UPDATE "devices"')]
+        self.assertEqual(len(updates), 3)
+
+    def test_single_update_query(self):
+        Device.objects.bulk_create([
+            Device(mac='AABBCCDDEE%02X' % i, hostname='h', ip='10.0.1.%d' % i,
+                   first_seen=timezone.now(), last_seen=timezone.now())
+            for i in range(2, 50)
+        ])
+        macs = ['AABBCCDDEE%02X' % i for i in range(1, 50)]
+
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.post_json({'macs': macs})
+
+        self.assertEqual(response.json()['updated_count'], 49)
+        updates = [q for q in ctx.captured_queries if q['sql'].startswith('UPDATE "devices"')]
+        self.assertEqual(len(updates), 1)
+
 
 class TestAddPortsApi(TestCase):
     def setUp(self):
@@ -872,6 +1086,66 @@ class TestAddPortsApi(TestCase):
         self.assertEqual(data['success_count'], 0)
         self.assertEqual(len(data['errors']), 2)
 
+    def test_batch_add_matches_exact_device_port_pairs(self):
+        other = Device.objects.create(mac='AABBCCDDEE11', hostname='other', ip='10.0.0.11',
+                                      first_seen=datetime.datetime.now(), last_seen=datetime.datetime.now())
+        for device, port_num in ((self.device, 80), (other, 443)):
+            Port.objects.create(device=device, port_num=port_num, protocol='TCP', name='svc', product='p',
+                                version='1', first_seen=datetime.datetime.now(), last_seen=datetime.datetime.now())
+        payload = {
+            'ports': [
+                {'mac': 'AA:BB:CC:DD:EE:10', 'port': '443', 'protocol': 'TCP', 'name': 'https'},
+                {'mac': 'AA:BB:CC:DD:EE:11', 'port': 80, 'protocol': 'TCP', 'name': 'http'},
+                {'mac': 'AA:BB:CC:DD:EE:10', 'port': 'abc', 'protocol': 'TCP', 'name': 'http'}
+            ]
+        }
+        response = self.post_json(payload)
+        data = response.json()
+        self.assertEqual(data['success_count'], 2)
+        self.assertEqual(data['errors'], [{'index': 2, 'error': 'invalid port number'}])
+        self.assertEqual(Port.objects.count(), 4)
+        self.assertEqual(Port.objects.get(device=self.device, port_num=443).name, 'https')
+        self.assertEqual(Port.objects.get(device=other, port_num=80).name, 'http')
+
+    @override_settings(WRITE_COALESCING={'port_seconds': 0})
+    def test_batch_add_query_count_independent_of_batch_size(self):
+        Port.objects.create(device=self.device, port_num=22, protocol='TCP', name='ssh', product='p',
+                            version='1', first_seen=datetime.datetime.now(), last_seen=datetime.datetime.now())
+
+        def batch(count, offset):
+            ports = [{'mac': 'AA:BB:CC:DD:EE:10', 'port': '22', 'protocol': 'TCP', 'name': 'ssh'}]
+            for i in range(count):
+                ports.append({'mac': 'AA:BB:CC:DD:EE:10', 'port': str(offset + i), 'protocol': 'TCP', 'name': 'svc'})
+            return {'ports': ports}
+
+        with CaptureQueriesContext(connection) as small:
+            self.post_json(batch(2, 1000))
+        with CaptureQueriesContext(connection) as large:
+            response = self.post_json(batch(50, 2000))
+
+        self.assertEqual(response.json()['success_count'], 51)
+        self.assertEqual(len(small.captured_queries), len(large.captured_queries))
+        self.assertEqual(Port.objects.filter(device=self.device).count(), 53)
+
+    def test_batch_add_keeps_seen_at_of_replayed_ports(self):
+        now = datetime.datetime.now().replace(microsecond=0)
+        Port.objects.create(device=self.device, port_num=22, protocol='TCP', name='ssh', product='p', version='2',
+                            first_seen=now, last_seen=now)
+        seen_at = now - datetime.timedelta(hours=3)
+
+        response = self.post_json({'ports': [
+            {'mac': 'AA:BB:CC:DD:EE:10', 'port': '80', 'protocol': 'TCP', 'name': 'http', 'seen_at': seen_at.isoformat()},
+            {'mac': 'AA:BB:CC:DD:EE:10', 'port': '22', 'protocol': 'TCP', 'name': 'ssh', 'version': '1',
+             'seen_at': seen_at.isoformat()},
+        ]})
+
+        self.assertEqual(response.json()['success_count'], 2)
+        new_port = Port.objects.get(device=self.device, port_num=80)
+        self.assertEqual((new_port.first_seen, new_port.last_seen), (seen_at, seen_at))
+        # The stored port is newer than the replayed record
+        current_port = Port.objects.get(device=self.device, port_num=22)
+        self.assertEqual((current_port.version, current_port.last_seen), ('2', now))
+
 
 class TestAuthenticationViews(TestCase):
     """Test authentication-related functionality"""
@@ -13,7 +13,10 @@ urlpatterns = [
     path('api/csrf', api_views.get_csrf_token, name="get_csrf_token"),
     path('api/addDevice', api_views.add_device, name="add_device"),
     path('api/addDevices', api_views.add_devices, name="add_devices"),
+    path('api/devicesSeen', api_views.devices_seen, name="devices_seen"),
     path('api/addPort', api_views.add_port, name="add_port"),
     path('api/addPorts', api_views.add_ports, name="add_ports"),
-    path('api/sensorHealth', api_views.sensor_health, name="sensor_health")
+    path('api/sensorHealth', api_views.sensor_health, name="sensor_health"),
+
+    path('metrics', api_views.prometheus_metrics, name="metrics")
 ]
@@ -1,70 +1,64 @@
-import ipaddress
 from collections import defaultdict
 
 from django.contrib.auth.decorators import login_required
 from django.contrib.messages import add_message, constants
 from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.db.models import Count, F, OuterRef, Q, Subquery, Window
+from django.db.models.functions import Coalesce, RowNumber
 from django.shortcuts import render
 
-from .models import Device, Sensor
+from . import ip_keys, sensor_telemetry, write_coalescing
+from .models import Device, Port, Sensor
+from .pushover_notifier import get_notifier
 
-
-def get_subnet(ip_address, prefix_length=24):
-    """
-    Calculate the subnet for a given IP address.
-    Uses /24 (255.255.255.0) as default subnet mask.
-    Returns subnet in CIDR notation (e.g., '192.168.1.0/24').
-    Returns 'unknown' for invalid or empty IP addresses.
-    """
-    try:
-        network = ipaddress.ip_network(f"{ip_address}/{prefix_length}", strict=False)
-        return str(network)
-    except (ValueError, ipaddress.AddressValueError):
-        # If IP is invalid or empty, return a default group
-        return "unknown"
+# Devices listed per subnet on each dashboard page
+_DEVICES_PER_SUBNET_PAGE = 100
 
 
 @login_required
 def home(request):
-    devices_list = Device.objects.prefetch_related('port_set').all()
-    visible_devices = [device for device in devices_list if not device.is_hidden()]
-
-    # Sort devices by IP address numerically
-    def ip_sort_key(device):
-        ip = getattr(device, "ip", None)
-        # Handle None or empty/whitespace-only IPs by sorting them last
-        if not ip or str(ip).strip() == "":
-            return ipaddress.ip_address("255.255.255.255")
-        try:
-            return ipaddress.ip_address(ip)
-        except (ValueError, TypeError, ipaddress.AddressValueError):
-            # Put invalid IPs at the end
-            return ipaddress.ip_address("255.255.255.255")
-
-    visible_devices.sort(key=ip_sort_key)
-
-    # Group devices by subnet
+    visible_devices = Device.objects.visible()
+    subnet_order = F('subnet_key').asc(nulls_last=True)
+    ip_order = [F('ip_key').asc(nulls_last=True), F('id').asc()]
+
+    # Device count per subnet, ordered by network address with unknown subnets last
+    subnet_counts = visible_devices.values('subnet_key').annotate(count=Count('id')).order_by(subnet_order)
+
+    # Each subnet is paginated on its own, ?subnet=<cidr>&page=<n> pages through one of them
+    requested_subnet = request.GET.get('subnet')
+    pages = {}
+    shown = Q(position__lte=_DEVICES_PER_SUBNET_PAGE)
+    for row in subnet_counts:
+        subnet_key = row['subnet_key']
+        label = ip_keys.subnet_label(subnet_key)
+        page = Paginator(range(row['count']), _DEVICES_PER_SUBNET_PAGE).get_page(
+            request.GET.get('page') if label == requested_subnet else 1)
+        pages[subnet_key] = (label, page)
+        if page.number > 1:
+            shown = (shown & ~Q(subnet_key=subnet_key)) | Q(subnet_key=subnet_key,
+                                                            position__gte=page.start_index(),
+                                                            position__lte=page.end_index())
+
+    # Open ports are only counted in SQL, port rows are never loaded
+    port_count = (Port.objects.filter(device=OuterRef('pk')).order_by()
+                  .values('device').annotate(count=Count('id')).values('count'))
+
+    # The shown page of every subnet in a single query, numbering devices within their subnet
+    devices = (visible_devices
+               .annotate(port_count=Coalesce(Subquery(port_count), 0),
+                         position=Window(RowNumber(), partition_by=F('subnet_key'), order_by=ip_order))
+               .filter(shown)
+               .order_by(subnet_order, *ip_order))
     devices_by_subnet = defaultdict(list)
-    for device in visible_devices:
-        subnet = get_subnet(device.ip)
-        devices_by_subnet[subnet].append(device)
-
-    # Convert to sorted list of tuples (subnet, devices) for template
-    # Sort by network address for proper ordering
-    def sort_key(item):
-        subnet_str = item[0]
-        if subnet_str == "unknown":
-            # Put unknown subnets at the end
-            return (1, subnet_str)
-        try:
-            return (0, ipaddress.ip_network(subnet_str))
-        except (ValueError, ipaddress.AddressValueError):
-            return (1, subnet_str)
-
-    grouped_devices = sorted(devices_by_subnet.items(), key=sort_key)
+    for device in devices:
+        devices_by_subnet[device.subnet_key].append(device)
+
+    # List of (subnet, devices, page) for the template, ordered by network address
+    grouped_devices = [(label, devices_by_subnet[subnet_key], page) for subnet_key, (label, page) in pages.items()]
 
     return render(request, 'home.html', {
-        'deviceList': visible_devices,
+        'totalDevices': sum(row['count'] for row in subnet_counts),
         'groupedDevices': grouped_devices
     })
 
@@ -143,5 +137,11 @@ def device_info(request, device_id):
 
 @login_required
 def status(request):
-    sensors_list = Sensor.objects.order_by('first_seen')
-    return render(request, 'status.html', {'sensors_list': sensors_list})
+    sensors_list = list(Sensor.objects.order_by('first_seen'))
+    trends = sensor_telemetry.recent_trends(sensors_list)
+    for sensor in sensors_list:
+        sensor.trend = trends[sensor.id]
+    write_stats = write_coalescing.get_write_counters().snapshot()
+    delivery_stats = get_notifier().delivery_stats()
+    return render(request, 'status.html', {'sensors_list': sensors_list, 'write_stats': write_stats,
+                                           'delivery_stats': delivery_stats})
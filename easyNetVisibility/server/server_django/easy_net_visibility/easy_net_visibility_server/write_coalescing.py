@@ -0,0 +1,113 @@
+"""
+Write coalescing for the device and port ingest paths.
+
+Several sensors watching overlapping subnets report the same devices every few minutes.
+Once a device or port was written, its reported fields are remembered in the Django cache
+for a configurable number of seconds. Identical reports within that window are answered
+without touching the database. With the default local memory cache the window is per
+server process, configure a shared cache (e.g. Redis or Memcached) to coalesce across workers.
+
+Configured in settings through WRITE_COALESCING:
+    {"device_seconds": 120, "port_seconds": 600}
+A value of 0 disables coalescing for that kind of record.
+"""
+import threading
+
+from django.conf import settings
+from django.core.cache import cache
+
+DEVICE = 'device'
+PORT = 'port'
+
+_DEFAULT_SECONDS = {
+    DEVICE: 120,
+    PORT: 600,
+}
+
+_CACHE_KEY_PREFIX = 'write_coalescing'
+
+
+def threshold_seconds(kind):
+    """Returns how long a written record of the given kind is considered fresh."""
+    config = getattr(settings, 'WRITE_COALESCING', None) or {}
+    return config.get(f'{kind}_seconds', _DEFAULT_SECONDS[kind])
+
+
+def port_key(mac, port_num):
+    """The key of a port record, from the normalized MAC of its device and the port number."""
+    return f'{mac}/{port_num}'
+
+
+def _cache_key(kind, key):
+    return f'{_CACHE_KEY_PREFIX}:{kind}:{key}'
+
+
+def unchanged_keys(kind, fingerprints):
+    """
+    Returns the keys whose fingerprint matches what was written within the threshold.
+    fingerprints maps a record key (e.g. the MAC) to the reported fields.
+    """
+    if threshold_seconds(kind) <= 0 or not fingerprints:
+        return set()
+    cache_keys = {_cache_key(kind, key): key for key in fingerprints}
+    cached = cache.get_many(cache_keys.keys())
+    return {cache_keys[cache_key] for cache_key, fingerprint in cached.items()
+            if fingerprint == fingerprints[cache_keys[cache_key]]}
+
+
+def recent_keys(kind, keys):
+    """Returns the keys that were written within the threshold, whatever was written."""
+    if threshold_seconds(kind) <= 0 or not keys:
+        return set()
+    cache_keys = {_cache_key(kind, key): key for key in keys}
+    return {cache_keys[cache_key] for cache_key in cache.get_many(cache_keys.keys())}
+
+
+def remember(kind, fingerprints):
+    """Remember the written fingerprints. Call once the write is committed."""
+    timeout = threshold_seconds(kind)
+    if timeout <= 0 or not fingerprints:
+        return
+    cache.set_many({_cache_key(kind, key): fingerprint for key, fingerprint in fingerprints.items()},
+                   timeout=timeout)
+
+
+def forget(kind, keys):
+    """Drop remembered records, e.g. when they are deleted."""
+    cache.delete_many([_cache_key(kind, key) for key in keys])
+
+
+class WriteCounters:
+    """Thread-safe counts of written and coalesced records per kind, for this process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = {}
+
+    def add(self, kind, written=0, coalesced=0):
+        with self._lock:
+            counts = self._counts.setdefault(kind, {'written': 0, 'coalesced': 0})
+            counts['written'] += written
+            counts['coalesced'] += coalesced
+
+    def snapshot(self):
+        """Returns {kind: {'written', 'coalesced', 'coalesced_percent'}}."""
+        with self._lock:
+            stats = {}
+            for kind, counts in self._counts.items():
+                total = counts['written'] + counts['coalesced']
+                stats[kind] = dict(counts, coalesced_percent=round(100 * counts['coalesced'] / total, 1) if total else 0)
+            return stats
+
+    def reset(self):
+        with self._lock:
+            self._counts = {}
+
+
+# Global counters instance
+_counters = WriteCounters()
+
+
+def get_write_counters() -> WriteCounters:
+    """Get the global WriteCounters instance."""
+    return _counters
@@ -0,0 +1,11 @@
+"""
+Gunicorn settings, loaded from the working directory by start-server.sh.
+"""
+import os
+
+
+def child_exit(server, worker):
+    # Drop the live gauges of an exited worker from the aggregated Prometheus metrics
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
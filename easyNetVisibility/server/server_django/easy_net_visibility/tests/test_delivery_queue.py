@@ -0,0 +1,78 @@
+"""
+Tests for the notification delivery queue and its worker.
+"""
+from unittest import TestCase
+from unittest.mock import MagicMock, patch
+
+from easy_net_visibility_server.delivery_queue import DeliveryQueue
+
+
+class TestDeliveryQueue(TestCase):
+    def setUp(self):
+        self.send = MagicMock()
+        self.delivery_queue = DeliveryQueue(self.send, max_size=3, max_attempts=3, base_delay_seconds=0.01)
+
+    def tearDown(self):
+        self.delivery_queue.stop()
+
+    def test_notifications_are_sent_by_worker(self):
+        self.assertTrue(self.delivery_queue.put({'message': 'one'}))
+        self.assertTrue(self.delivery_queue.put({'message': 'two'}))
+
+        self.assertTrue(self.delivery_queue.wait_until_idle(timeout=5))
+        self.assertEqual([c.args[0]['message'] for c in self.send.call_args_list], ['one', 'two'])
+        stats = self.delivery_queue.stats()
+        self.assertEqual(stats['sent'], 2)
+        self.assertEqual(stats['queue_depth'], 0)
+        self.assertIsNotNone(stats['avg_send_ms'])
+
+    def test_failed_send_is_retried(self):
+        self.send.side_effect = [Exception("timeout"), Exception("timeout"), None]
+
+        self.delivery_queue.put({'message': 'one'})
+
+        self.assertTrue(self.delivery_queue.wait_until_idle(timeout=5))
+        self.assertEqual(self.send.call_count, 3)
+        stats = self.delivery_queue.stats()
+        self.assertEqual((stats['sent'], stats['retried'], stats['dead_lettered']), (1, 2, 0))
+
+    def test_notification_is_dead_lettered_after_max_attempts(self):
+        self.send.side_effect = Exception("unavailable")
+
+        with self.assertLogs('easy_net_visibility_server.delivery_queue.dead_letter', level='ERROR') as logs:
+            self.delivery_queue.put({'message': 'lost'})
+            self.assertTrue(self.delivery_queue.wait_until_idle(timeout=5))
+
+        self.assertEqual(self.send.call_count, 3)
+        self.assertIn('lost', logs.output[0])
+        self.assertEqual(self.delivery_queue.stats()['dead_lettered'], 1)
+
+    def test_outcome_is_reported_to_the_callback(self):
+        self.send.side_effect = [None, Exception("unavailable"), Exception("unavailable"), Exception("unavailable")]
+        results = []
+
+        self.delivery_queue.put({'message': 'sent'}, lambda delivered: results.append(('sent', delivered)))
+        with self.assertLogs('easy_net_visibility_server.delivery_queue.dead_letter', level='ERROR'):
+            self.delivery_queue.put({'message': 'lost'}, lambda delivered: results.append(('lost', delivered)))
+            self.assertTrue(self.delivery_queue.wait_until_idle(timeout=5))
+
+        self.assertEqual(results, [('sent', True), ('lost', False)])
+
+    def test_full_queue_refuses_without_dead_lettering(self):
+        with patch.object(self.delivery_queue, '_ensure_worker'):
+            for i in range(3):
+                self.assertTrue(self.delivery_queue.put({'message': i}))
+            self.assertTrue(self.delivery_queue.full())
+            # The caller keeps the notification, so it isn't reported as dropped
+            with self.assertNoLogs('easy_net_visibility_server.delivery_queue.dead_letter', level='ERROR'):
+                self.assertFalse(self.delivery_queue.put({'message': 'overflow'}))
+
+        stats = self.delivery_queue.stats()
+        self.assertEqual((stats['queue_depth'], stats['dead_lettered']), (3, 0))
+
+    def test_backoff_is_capped_and_jittered(self):
+        delivery_queue = DeliveryQueue(self.send, base_delay_seconds=1, max_delay_seconds=10)
+        with patch('easy_net_visibility_server.delivery_queue.random.uniform', side_effect=lambda low, high: high):
+            self.assertEqual([delivery_queue.backoff_seconds(attempt) for attempt in range(1, 7)], [1, 2, 4, 8, 10, 10])
+        for _ in range(20):
+            self.assertTrue(0 <= delivery_queue.backoff_seconds(3) <= 4)
@@ -0,0 +1,84 @@
+"""
+Tests for the sortable IP and subnet keys stored on devices.
+"""
+import datetime
+
+from django.test import TestCase
+from easy_net_visibility_server import ip_keys
+from easy_net_visibility_server.api_views import _create_device_obj_from_data, _upsert_devices
+from easy_net_visibility_server.models import Device
+
+
+class TestIpKeys(TestCase):
+    def test_ip_key_sorts_numerically(self):
+        ips = ['10.0.0.10', '10.0.0.2', '9.255.255.255', '10.0.0.1']
+        self.assertEqual(sorted(ips, key=ip_keys.ip_key), ['9.255.255.255', '10.0.0.1', '10.0.0.2', '10.0.0.10'])
+
+    def test_ipv4_sorts_before_ipv6(self):
+        self.assertLess(ip_keys.ip_key('255.255.255.255'), ip_keys.ip_key('2001:db8::1'))
+        self.assertLess(ip_keys.ip_key('::1'), ip_keys.ip_key('0.0.0.1'))
+
+    def test_ip_key_format(self):
+        self.assertEqual(ip_keys.ip_key('192.168.1.1'), '00000000000000000000ffffc0a80101')
+        self.assertEqual(len(ip_keys.ip_key('2001:db8::1')), 32)
+
+    def test_invalid_ip_has_no_key(self):
+        for ip in [None, '', 'not-an-ip', '300.1.1.1']:
+            self.assertIsNone(ip_keys.ip_key(ip))
+            self.assertIsNone(ip_keys.subnet_key(ip))
+
+    def test_subnet_label(self):
+        self.assertEqual(ip_keys.subnet_label(ip_keys.subnet_key('192.168.1.77')), '192.168.1.0/24')
+        self.assertEqual(ip_keys.subnet_label(ip_keys.subnet_key('2001:db8:0:1::5')), '2001:db8:0:1::/64')
+        self.assertEqual(ip_keys.subnet_label(None), 'unknown')
+
+    def test_subnet_key_is_shared_within_subnet(self):
+        self.assertEqual(ip_keys.subnet_key('10.1.2.3'), ip_keys.subnet_key('10.1.2.254'))
+        self.assertNotEqual(ip_keys.subnet_key('10.1.2.3'), ip_keys.subnet_key('10.1.3.3'))
+
+    def test_network_key_range(self):
+        first, last = ip_keys.network_key_range('10.0.0.0/8')
+        self.assertEqual(first, ip_keys.ip_key('10.0.0.0'))
+        self.assertEqual(last, ip_keys.ip_key('10.255.255.255'))
+        with self.assertRaises(ValueError):
+            ip_keys.network_key_range('not-a-network')
+
+
+class TestDeviceIpKeys(TestCase):
+    def _create_device(self, mac, ip):
+        now = datetime.datetime.now()
+        return Device.objects.create(mac=mac, hostname='host', ip=ip, vendor='V', first_seen=now, last_seen=now)
+
+    def test_save_sets_keys(self):
+        device = self._create_device('AABBCCDDEE01', '192.168.1.10')
+        device.refresh_from_db()
+        self.assertEqual(device.ip_key, ip_keys.ip_key('192.168.1.10'))
+        self.assertEqual(device.subnet(), '192.168.1.0/24')
+
+    def test_save_with_update_fields_updates_keys(self):
+        device = self._create_device('AABBCCDDEE01', '192.168.1.10')
+        device.ip = '10.0.0.5'
+        device.save(update_fields=['ip'])
+        device.refresh_from_db()
+        self.assertEqual(device.ip_key, ip_keys.ip_key('10.0.0.5'))
+        self.assertEqual(device.subnet(), '10.0.0.0/24')
+
+    def test_upsert_maintains_keys(self):
+        _upsert_devices([_create_device_obj_from_data(
+            {'mac': 'AA:BB:CC:DD:EE:01', 'hostname': 'host', 'ip': '10.0.0.5', 'vendor': 'V'})])
+        self.assertEqual(Device.objects.get().ip_key, ip_keys.ip_key('10.0.0.5'))
+
+        _upsert_devices([_create_device_obj_from_data(
+            {'mac': 'AA:BB:CC:DD:EE:01', 'hostname': 'host', 'ip': '172.16.0.9', 'vendor': 'V'})])
+        device = Device.objects.get()
+        self.assertEqual(device.ip_key, ip_keys.ip_key('172.16.0.9'))
+        self.assertEqual(device.subnet(), '172.16.0.0/24')
+
+    def test_in_network(self):
+        self._create_device('AABBCCDDEE01', '10.1.0.5')
+        self._create_device('AABBCCDDEE02', '10.1.255.1')
+        self._create_device('AABBCCDDEE03', '10.2.0.1')
+
+        macs = set(Device.objects.in_network('10.1.0.0/16').values_list('mac', flat=True))
+        self.assertEqual(macs, {'AABBCCDDEE01', 'AABBCCDDEE02'})
+        self.assertEqual(Device.objects.in_network('10.0.0.0/8').count(), 3)
@@ -0,0 +1,88 @@
+"""
+Tests for the Prometheus metrics and the /metrics endpoint.
+"""
+import os
+import subprocess
+import sys
+import tempfile
+from unittest import skipUnless
+from unittest.mock import patch
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import TestCase
+from django.urls import reverse
+from easy_net_visibility_server import metrics
+from rest_framework.test import APIClient
+
+try:
+    from prometheus_client import REGISTRY
+except ImportError:
+    REGISTRY = None
+
+_PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _sample(name, labels=None):
+    return REGISTRY.get_sample_value(name, labels or {}) or 0
+
+
+@skipUnless(metrics.is_available(), "prometheus-client is not installed")
+class TestMetrics(TestCase):
+    def setUp(self):
+        cache.clear()
+        User.objects.create_user(username='apiuser', password='apipass')
+        self.client = APIClient()
+        self.client.login(username='apiuser', password='apipass')
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_metrics_requires_authentication(self):
+        response = APIClient().get(reverse('metrics'))
+
+        self.assertIn(response.status_code, (401, 403))
+
+    def test_metrics_exposes_server_metrics(self):
+        response = self.client.get(reverse('metrics'), HTTP_ACCEPT='text/plain;version=0.0.4;q=0.3,*/*;q=0.2')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        body = response.content.decode()
+        for name in ['easynet_request_duration_seconds', 'easynet_batch_size', 'easynet_ingested_records_total',
+                     'easynet_notification_send_duration_seconds', 'easynet_monitor_cycle_duration_seconds']:
+            self.assertIn(name, body)
+
+    def test_add_devices_records_request_and_batch(self):
+        labels = {'view': 'add_devices'}
+        requests_before = _sample('easynet_request_duration_seconds_count', labels)
+        queries_before = _sample('easynet_request_db_queries_sum', labels)
+        inserted_before = _sample('easynet_ingested_records_total', {'kind': 'device', 'outcome': 'inserted'})
+        batches_before = _sample('easynet_batch_size_count', {'kind': 'device'})
+
+        devices = [{'mac': f'AA:BB:CC:DD:EE:{i:02X}', 'hostname': f'host{i}', 'ip': f'10.0.0.{i + 1}', 'vendor': 'V'}
+                   for i in range(3)]
+        response = self.client.post(reverse('add_devices'), {'devices': devices}, format='json',
+                                    HTTP_ACCEPT='application/json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(_sample('easynet_request_duration_seconds_count', labels), requests_before + 1)
+        self.assertGreater(_sample('easynet_request_db_queries_sum', labels), queries_before)
+        self.assertEqual(_sample('easynet_ingested_records_total', {'kind': 'device', 'outcome': 'inserted'}),
+                         inserted_before + 3)
+        self.assertEqual(_sample('easynet_batch_size_count', {'kind': 'device'}), batches_before + 1)
+
+    def test_metrics_are_aggregated_across_processes(self):
+        with tempfile.TemporaryDirectory() as multiproc_dir:
+            env = dict(os.environ, PROMETHEUS_MULTIPROC_DIR=multiproc_dir)
+            # Two processes standing in for two gunicorn workers
+            for _ in range(2):
+                subprocess.run([sys.executable, '-c',
+                                "from easy_net_visibility_server import metrics; "
+                                "metrics.record_batch('device', 5, inserted=5, updated=0, skipped=0)"],
+                               cwd=_PROJECT_DIR, env=env, check=True)
+
+            with patch.dict(os.environ, {'PROMETHEUS_MULTIPROC_DIR': multiproc_dir}):
+                body, _ = metrics.render_latest()
+
+        self.assertIn('easynet_ingested_records_total{kind="device",outcome="inserted"} 10.0', body.decode())
@@ -6,9 +6,10 @@ from io import StringIO
 from unittest.mock import patch, MagicMock
 
 from django.core.management import call_command
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from django.utils import timezone
 from easy_net_visibility_server.models import Device, Sensor
+from easy_net_visibility_server.pushover_notifier import PushoverNotifier
 
 # Test configuration with Pushover enabled
 PUSHOVER_TEST_CONFIG = {
@@ -264,3 +265,21 @@ class TestMonitorNetworkCommand(TestCase):
 
         # Verify notification was NOT sent (monitoring disabled)
         mock_notifier.notify_device_offline.assert_not_called()
+
+    @patch('easy_net_visibility_server.pushover_notifier.PushoverAPI')
+    @override_settings(PUSHOVER_CONFIG=dict(PUSHOVER_TEST_CONFIG, delivery_queue_size=0))
+    def test_failed_notification_releases_the_claim(self, mock_client_class):
+        """A notifier returning False must leave the sensor to the next run"""
+        mock_client_class.return_value.send_message.side_effect = Exception("Pushover unavailable")
+        sensor = Sensor.objects.create(mac='AABBCCDDEEFF', hostname='test-gateway',
+                                       first_seen=timezone.now() - datetime.timedelta(hours=1),
+                                       last_seen=timezone.now() - datetime.timedelta(minutes=20))
+        notifier = PushoverNotifier()
+        self.assertFalse(notifier.notify_gateway_timeout('probe', 1))
+
+        with patch('easy_net_visibility_server.management.commands.monitor_network.get_notifier',
+                   return_value=notifier):
+            call_command('monitor_network', stdout=StringIO())
+
+        sensor.refresh_from_db()
+        self.assertIsNone(sensor.last_notified_timeout)
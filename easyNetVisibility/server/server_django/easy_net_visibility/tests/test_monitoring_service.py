@@ -5,10 +5,21 @@ import datetime
 import time
 from unittest.mock import patch, MagicMock
 
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from django.utils import timezone
 from easy_net_visibility_server.models import Device, Sensor
 from easy_net_visibility_server.monitoring_service import NetworkMonitoringService
+from easy_net_visibility_server.pushover_notifier import PushoverNotifier
+
+PUSHOVER_TEST_CONFIG = {
+    'enabled': True,
+    'user_key': 'test_user_key',
+    'api_token': 'test_api_token',
+    'alert_gateway_timeout': True,
+    'alert_device_offline': True,
+    'gateway_timeout_minutes': 10,
+    'delivery_queue_size': 0
+}
 
 
 class TestNetworkMonitoringService(TestCase):
@@ -213,3 +224,27 @@ class TestNetworkMonitoringService(TestCase):
         # Verify notification state was cleared
         online_device.refresh_from_db()
         self.assertIsNone(online_device.last_notified_offline)
+
+    @patch('easy_net_visibility_server.pushover_notifier.PushoverAPI')
+    @override_settings(PUSHOVER_CONFIG=PUSHOVER_TEST_CONFIG)
+    def test_failed_notifications_release_the_claims(self, mock_client_class):
+        """A notifier returning False must leave the sensor and device to the next check"""
+        mock_client_class.return_value.send_message.side_effect = Exception("Pushover unavailable")
+        sensor = Sensor.objects.create(mac='AABBCCDDEEFF', hostname='test-gateway',
+                                       first_seen=timezone.now() - datetime.timedelta(hours=1),
+                                       last_seen=timezone.now() - datetime.timedelta(minutes=20))
+        device = Device.objects.create(mac='112233445566', hostname='test-device', nickname='My Device',
+                                       ip='192.168.1.100', first_seen=timezone.now() - datetime.timedelta(days=1),
+                                       last_seen=timezone.now() - datetime.timedelta(hours=7))
+        notifier = PushoverNotifier()
+        self.assertFalse(notifier.notify_gateway_timeout('probe', 1))
+
+        with patch('easy_net_visibility_server.monitoring_service.get_notifier', return_value=notifier):
+            service = NetworkMonitoringService(check_interval_seconds=0.1)
+            service._check_gateway_timeouts()
+            service._check_device_offline()
+
+        sensor.refresh_from_db()
+        device.refresh_from_db()
+        self.assertIsNone(sensor.last_notified_timeout)
+        self.assertIsNone(device.last_notified_offline)
@@ -0,0 +1,150 @@
+"""
+Tests for the notification outbox and its background dispatcher.
+"""
+import datetime
+from unittest.mock import ANY, patch, MagicMock
+
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from easy_net_visibility_server.models import NotificationOutbox
+from easy_net_visibility_server.notification_dispatcher import NotificationDispatcher
+from easy_net_visibility_server.pushover_notifier import PushoverNotifier
+
+
+def _outbox_row(**kwargs):
+    values = {
+        'event_type': NotificationOutbox.NEW_DEVICE,
+        'name': 'new-device',
+        'ip': '192.168.1.50',
+        'mac': 'AABBCCDDEEFF',
+        'created_at': timezone.now(),
+    }
+    values.update(kwargs)
+    return NotificationOutbox.objects.create(**values)
+
+
+class TestNotificationDispatcher(TestCase):
+    """Test draining the notification outbox"""
+
+    def _dispatcher(self, mock_get_notifier, delivered=True):
+        mock_notifier = MagicMock()
+        mock_notifier.enabled = True
+        mock_notifier.alert_new_device = True
+        mock_notifier.digest_window_seconds = 0
+        mock_notifier.delivery_queue_full.return_value = False
+        mock_notifier.notify_new_device.side_effect = lambda name, ip, mac, on_result: on_result(delivered)
+        mock_get_notifier.return_value = mock_notifier
+        return NotificationDispatcher(batch_size=10), mock_notifier
+
+    @patch('easy_net_visibility_server.notification_dispatcher.get_notifier')
+    def test_dispatch_marks_delivered(self, mock_get_notifier):
+        dispatcher, mock_notifier = self._dispatcher(mock_get_notifier)
+        row = _outbox_row()
+
+        self.assertEqual(dispatcher.dispatch_pending(), 1)
+
+        mock_notifier.notify_new_device.assert_called_once_with('new-device', '192.168.1.50', 'AABBCCDDEEFF', on_result=ANY)
+        row.refresh_from_db()
+        self.assertIsNotNone(row.sent_at)
+        # Nothing left to send
+        self.assertEqual(dispatcher.dispatch_pending(), 0)
+        mock_notifier.notify_new_device.assert_called_once()
+
+    @patch('easy_net_visibility_server.notification_dispatcher.get_notifier')
+    def test_dispatch_failure_releases_claim(self, mock_get_notifier):
+        dispatcher, mock_notifier = self._dispatcher(mock_get_notifier, delivered=False)
+        row = _outbox_row()
+
+        self.assertEqual(dispatcher.dispatch_pending(), 0)
+
+        row.refresh_from_db()
+        self.assertIsNone(row.sent_at)
+        self.assertIsNone(row.claimed_by)
+        self.assertEqual(row.attempts, 1)
+
+    @patch('easy_net_visibility_server.notification_dispatcher.get_notifier')
+    def test_digested_notification_is_marked_sent_when_digest_is_sent(self, mock_get_notifier):
+        dispatcher, mock_notifier = self._dispatcher(mock_get_notifier)
+        mock_notifier.digest_window_seconds = 60
+        pending_results = []
+        mock_notifier.notify_new_device.side_effect = lambda name, ip, mac, on_result: pending_results.append(on_result)
+        row = _outbox_row()
+
+        self.assertEqual(dispatcher.dispatch_pending(), 1)
+
+        row.refresh_from_db()
+        self.assertIsNone(row.sent_at)
+        self.assertIsNotNone(row.claimed_by)
+        # Still claimed while the digest is pending, so it isn't sent twice
+        self.assertEqual(dispatcher.dispatch_pending(), 0)
+
+        pending_results[0](True)
+
+        row.refresh_from_db()
+        self.assertIsNotNone(row.sent_at)
+
+    @override_settings(PUSHOVER_CONFIG={'enabled': True, 'user_key': 'test_user_key', 'api_token': 'test_api_token',
+                                        'alert_new_device': True, 'delivery_queue_size': 3})
+    @patch('easy_net_visibility_server.pushover_notifier.PushoverAPI')
+    @patch('easy_net_visibility_server.notification_dispatcher.get_notifier')
+    def test_full_delivery_queue_leaves_rows_for_the_next_pass(self, mock_get_notifier, mock_client_class):
+        notifier = PushoverNotifier()
+        mock_get_notifier.return_value = notifier
+        dispatcher = NotificationDispatcher(batch_size=10)
+        rows = [_outbox_row(mac=f'AABBCCDDEE{i:02d}') for i in range(10)]
+
+        # No worker drains the queue, it fills up after three notifications
+        with patch.object(notifier.delivery_queue, '_ensure_worker'):
+            with self.assertNoLogs('easy_net_visibility_server.delivery_queue.dead_letter', level='ERROR'):
+                self.assertEqual(dispatcher.dispatch_pending(), 3)
+                self.assertEqual(dispatcher.dispatch_pending(), 0)
+
+        for row in rows:
+            row.refresh_from_db()
+        # Queued rows stay claimed until the worker reports, the others wait without losing an attempt
+        self.assertEqual([row.claimed_by is not None for row in rows], [True] * 3 + [False] * 7)
+        self.assertEqual([row.attempts for row in rows], [0] * 10)
+        self.assertEqual(notifier.delivery_stats()['queue_depth'], 3)
+
+    @patch('easy_net_visibility_server.notification_dispatcher.get_notifier')
+    def test_dispatch_gives_up_after_max_attempts(self, mock_get_notifier):
+        dispatcher, mock_notifier = self._dispatcher(mock_get_notifier)
+        _outbox_row(attempts=5)
+
+        self.assertEqual(dispatcher.dispatch_pending(), 0)
+        mock_notifier.notify_new_device.assert_not_called()
+
+    @patch('easy_net_visibility_server.notification_dispatcher.get_notifier')
+    def test_dispatch_skips_rows_claimed_elsewhere(self, mock_get_notifier):
+        dispatcher, mock_notifier = self._dispatcher(mock_get_notifier)
+        _outbox_row(claimed_by='other', claimed_at=timezone.now())
+        stale = _outbox_row(mac='112233445566', claimed_by='dead', claimed_at=timezone.now() - datetime.timedelta(hours=1))
+
+        self.assertEqual(dispatcher.dispatch_pending(), 1)
+
+        mock_notifier.notify_new_device.assert_called_once_with('new-device', '192.168.1.50', '112233445566', on_result=ANY)
+        stale.refresh_from_db()
+        self.assertIsNotNone(stale.sent_at)
+
+    @patch('easy_net_visibility_server.notification_dispatcher.get_notifier')
+    def test_dispatch_discards_when_alerts_disabled(self, mock_get_notifier):
+        dispatcher, mock_notifier = self._dispatcher(mock_get_notifier)
+        mock_notifier.alert_new_device = False
+        row = _outbox_row()
+
+        dispatcher.dispatch_pending()
+
+        mock_notifier.notify_new_device.assert_not_called()
+        row.refresh_from_db()
+        self.assertIsNotNone(row.sent_at)
+
+    @patch('easy_net_visibility_server.notification_dispatcher.get_notifier')
+    def test_purge_delivered(self, mock_get_notifier):
+        dispatcher, _ = self._dispatcher(mock_get_notifier)
+        _outbox_row(sent_at=timezone.now() - datetime.timedelta(days=8))
+        recent = _outbox_row(sent_at=timezone.now())
+        pending = _outbox_row()
+
+        dispatcher.purge_delivered()
+
+        self.assertEqual(set(NotificationOutbox.objects.values_list('id', flat=True)), {recent.id, pending.id})
@@ -0,0 +1,80 @@
+"""
+Tests for the set-based offline claims.
+"""
+import datetime
+
+from django.test import TestCase
+from django.utils import timezone
+from easy_net_visibility_server import offline_detection
+from easy_net_visibility_server.models import Device, Sensor
+
+
+class TestOfflineDetection(TestCase):
+    def _create_devices(self, count, last_seen_hours_ago=7, **fields):
+        now = timezone.now()
+        Device.objects.bulk_create([
+            Device(mac=f'AABBCCDD{i:04X}', hostname=f'host{i}', nickname=f'Device {i}', ip=f'10.0.{i // 250}.{i % 250 + 1}',
+                   first_seen=now - datetime.timedelta(days=1),
+                   last_seen=now - datetime.timedelta(hours=last_seen_hours_ago), **fields)
+            for i in range(count)
+        ])
+
+    def _create_sensors(self, count, last_seen_minutes_ago=20):
+        now = timezone.now()
+        Sensor.objects.bulk_create([
+            Sensor(mac=f'AABBCCDD{i:04X}', hostname=f'sensor{i}', first_seen=now - datetime.timedelta(days=1),
+                   last_seen=now - datetime.timedelta(minutes=last_seen_minutes_ago))
+            for i in range(count)
+        ])
+
+    def test_device_claim_query_count_is_independent_of_estate_size(self):
+        self._create_devices(500)
+
+        with self.assertNumQueries(2):
+            claimed = offline_detection.claim_offline_devices()
+
+        self.assertEqual(len(claimed), 500)
+        self.assertFalse(Device.objects.filter(last_notified_offline__isnull=True).exists())
+
+    def test_sensor_claim_query_count_is_independent_of_estate_size(self):
+        self._create_sensors(300)
+
+        with self.assertNumQueries(2):
+            claimed = offline_detection.claim_offline_sensors(10)
+
+        self.assertEqual(len(claimed), 300)
+
+    def test_claimed_rows_are_not_claimed_again(self):
+        self._create_devices(3)
+        self._create_sensors(2)
+
+        self.assertEqual(len(offline_detection.claim_offline_devices()), 3)
+        self.assertEqual(len(offline_detection.claim_offline_sensors(10)), 2)
+
+        with self.assertNumQueries(2):
+            self.assertEqual(offline_detection.claim_offline_devices(), [])
+            self.assertEqual(offline_detection.claim_offline_sensors(10), [])
+
+    def test_claim_renotifies_after_interval(self):
+        self._create_devices(2, last_notified_offline=timezone.now() - datetime.timedelta(hours=25))
+        Device.objects.filter(mac='AABBCCDD0001').update(last_notified_offline=timezone.now() - datetime.timedelta(hours=1))
+
+        claimed = offline_detection.claim_offline_devices()
+
+        self.assertEqual([device.mac for device in claimed], ['AABBCCDD0000'])
+
+    def test_claim_ignores_online_and_unnamed_devices(self):
+        self._create_devices(2, last_seen_hours_ago=1)
+        now = timezone.now()
+        Device.objects.create(mac='AABBCCDDFFFF', hostname='unnamed', ip='10.1.0.1',
+                              first_seen=now, last_seen=now - datetime.timedelta(hours=7))
+
+        self.assertEqual(offline_detection.claim_offline_devices(), [])
+
+    def test_released_claims_are_claimed_again(self):
+        self._create_sensors(2)
+        claimed = offline_detection.claim_offline_sensors(10)
+
+        offline_detection.release_sensors(claimed[:1])
+
+        self.assertEqual([sensor.mac for sensor in offline_detection.claim_offline_sensors(10)], [claimed[0].mac])
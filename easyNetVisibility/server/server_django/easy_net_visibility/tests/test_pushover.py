@@ -2,7 +2,8 @@ from unittest.mock import patch, MagicMock
 
 from django.test import TestCase, override_settings
 from django.utils import timezone
-from easy_net_visibility_server.models import Device
+from easy_net_visibility_server.models import Device, NotificationOutbox
+from easy_net_visibility_server.notification_dispatcher import NotificationDispatcher
 from easy_net_visibility_server.pushover_notifier import PushoverNotifier
 
 # Test configuration with Pushover enabled
@@ -13,7 +14,9 @@ PUSHOVER_TEST_CONFIG = {
     'alert_new_device': True,
     'alert_gateway_timeout': True,
     'alert_device_offline': True,
-    'gateway_timeout_minutes': 10
+    'gateway_timeout_minutes': 10,
+    # Send on the caller's thread so tests can check the client right away
+    'delivery_queue_size': 0
 }
 
 
@@ -148,14 +151,15 @@ class TestPushoverIntegration(TestCase):
     """Test Pushover integration with API views"""
 
     @patch('easy_net_visibility_server.pushover_notifier.PushoverAPI')
-    @patch('easy_net_visibility_server.api_views.get_notifier')
+    @patch('easy_net_visibility_server.notification_dispatcher.get_notifier')
     @override_settings(PUSHOVER_CONFIG=PUSHOVER_TEST_CONFIG)
     def test_new_device_triggers_notification(self, mock_get_notifier, mock_client_class):
         """Test that adding a new device triggers a Pushover notification"""
-        mock_notifier = MagicMock()
+        mock_notifier = MagicMock(digest_window_seconds=0)
+        mock_notifier.delivery_queue_full.return_value = False
         mock_get_notifier.return_value = mock_notifier
 
-        from easy_net_visibility_server.api_views import _process_device, _create_device_obj_from_data
+        from easy_net_visibility_server.api_views import _upsert_devices, _create_device_obj_from_data
 
         # Create a new device
         device_data = {
@@ -166,13 +170,18 @@ class TestPushoverIntegration(TestCase):
         }
         device = _create_device_obj_from_data(device_data)
 
-        # Process the device (should trigger notification)
-        status, error = _process_device(device, {})
+        # Process the device (should queue a notification)
+        status, error = _upsert_devices([device])[0]
 
         # Verify the device was added successfully
         self.assertEqual(status, 200)
         self.assertIsNone(error)
 
+        # The request only writes to the outbox, the dispatcher sends it
+        mock_notifier.notify_new_device.assert_not_called()
+        self.assertEqual(NotificationOutbox.objects.filter(sent_at__isnull=True).count(), 1)
+        NotificationDispatcher().dispatch_pending()
+
         # Verify notification was triggered
         mock_notifier.notify_new_device.assert_called_once()
         call_args = mock_notifier.notify_new_device.call_args[0]
@@ -182,11 +191,12 @@ class TestPushoverIntegration(TestCase):
         self.assertIn('aabbccddeeff', call_args[2].lower())
 
     @patch('easy_net_visibility_server.pushover_notifier.PushoverAPI')
-    @patch('easy_net_visibility_server.api_views.get_notifier')
+    @patch('easy_net_visibility_server.notification_dispatcher.get_notifier')
     @override_settings(PUSHOVER_CONFIG=PUSHOVER_TEST_CONFIG)
     def test_existing_device_no_notification(self, mock_get_notifier, mock_client_class):
         """Test that updating an existing device does not trigger notification"""
-        mock_notifier = MagicMock()
+        mock_notifier = MagicMock(digest_window_seconds=0)
+        mock_notifier.delivery_queue_full.return_value = False
         mock_get_notifier.return_value = mock_notifier
 
         # Create an existing device with normalized MAC address
@@ -199,7 +209,7 @@ class TestPushoverIntegration(TestCase):
             last_seen=timezone.now()
         )
 
-        from easy_net_visibility_server.api_views import _process_device, _create_device_obj_from_data
+        from easy_net_visibility_server.api_views import _upsert_devices, _create_device_obj_from_data
 
         # Update the existing device
         device_data = {
@@ -209,14 +219,152 @@ class TestPushoverIntegration(TestCase):
             'vendor': 'TestVendor'
         }
         device = _create_device_obj_from_data(device_data)
-        existing_map = {existing.mac: existing}
+        self.assertEqual(device.mac, existing.mac)
 
         # Process the device (should NOT trigger notification)
-        status, error = _process_device(device, existing_map)
+        status, error = _upsert_devices([device])[0]
 
         # Verify the device was updated successfully
         self.assertEqual(status, 200)
         self.assertIsNone(error)
 
         # Verify notification was NOT triggered
+        self.assertEqual(NotificationOutbox.objects.count(), 0)
+        NotificationDispatcher().dispatch_pending()
         mock_notifier.notify_new_device.assert_not_called()
+
+
+PUSHOVER_DIGEST_CONFIG = dict(PUSHOVER_TEST_CONFIG, digest_window_seconds=60, digest_max_names=3)
+
+
+@patch('easy_net_visibility_server.pushover_notifier.threading.Timer')
+@patch('easy_net_visibility_server.pushover_notifier.PushoverAPI')
+class TestPushoverDigest(TestCase):
+    """Test digesting alerts of the same type into one message per window"""
+
+    @override_settings(PUSHOVER_CONFIG=PUSHOVER_DIGEST_CONFIG)
+    def test_alerts_are_collected_until_window_ends(self, mock_client_class, mock_timer):
+        mock_client = mock_client_class.return_value
+        notifier = PushoverNotifier()
+
+        for i in range(5):
+            # Not delivered yet, only added to the digest
+            self.assertFalse(notifier.notify_device_offline(f"device{i}", f"10.0.0.{i}", f"AABBCCDDEE0{i}"))
+
+        mock_client.send_message.assert_not_called()
+        mock_timer.assert_called_once_with(60, notifier._digest_timer_fired)
+
+        notifier._on_digest_window_end()
+
+        mock_client.send_message.assert_called_once()
+        message = mock_client.send_message.call_args[0][1]
+        self.assertEqual(message.splitlines(), [
+            "5 devices went offline:", "device0 (10.0.0.0)", "device1 (10.0.0.1)", "device2 (10.0.0.2)", "...and 2 more"
+        ])
+        self.assertEqual(mock_client.send_message.call_args[1], {'title': "Device Offline Alert", 'priority': 0})
+
+    @override_settings(PUSHOVER_CONFIG=PUSHOVER_DIGEST_CONFIG)
+    def test_single_alert_keeps_its_message(self, mock_client_class, mock_timer):
+        mock_client = mock_client_class.return_value
+        notifier = PushoverNotifier()
+
+        notifier.notify_gateway_timeout("gateway1", 15)
+        notifier.flush()
+
+        mock_client.send_message.assert_called_once_with(
+            'test_user_key', "Gateway 'gateway1' has not been detected for 15 minutes",
+            title="Gateway Timeout Alert", priority=1
+        )
+
+    @override_settings(PUSHOVER_CONFIG=dict(PUSHOVER_DIGEST_CONFIG, max_digests_per_window=1))
+    def test_budget_defers_remaining_digests(self, mock_client_class, mock_timer):
+        mock_client = mock_client_class.return_value
+        notifier = PushoverNotifier()
+
+        notifier.notify_gateway_timeout("gateway1", 15)
+        notifier.notify_new_device("new1", "10.0.0.9", "AABBCCDDEE09")
+        notifier._on_digest_window_end()
+
+        # Gateway alerts go first, the new device waits for the next window
+        self.assertEqual(mock_client.send_message.call_count, 1)
+        self.assertEqual(mock_client.send_message.call_args[1]['title'], "Gateway Timeout Alert")
+        self.assertEqual(mock_timer.call_count, 2)
+
+        notifier.notify_new_device("new2", "10.0.0.10", "AABBCCDDEE10")
+        notifier._on_digest_window_end()
+
+        self.assertEqual(mock_client.send_message.call_count, 2)
+        self.assertTrue(mock_client.send_message.call_args[0][1].startswith("2 new devices detected:"))
+
+    @override_settings(PUSHOVER_CONFIG=PUSHOVER_DIGEST_CONFIG)
+    def test_failed_digest_is_kept(self, mock_client_class, mock_timer):
+        mock_client = mock_client_class.return_value
+        mock_client.send_message.side_effect = [Exception("rate limited"), None]
+        notifier = PushoverNotifier()
+
+        notifier.notify_device_offline("device1", "10.0.0.1", "AABBCCDDEE01")
+        self.assertEqual(notifier.flush(), 0)
+        self.assertEqual(notifier.flush(), 1)
+
+        self.assertEqual(mock_client.send_message.call_count, 2)
+        self.assertEqual(notifier.flush(), 0)
+
+    @override_settings(PUSHOVER_CONFIG=PUSHOVER_DIGEST_CONFIG)
+    def test_digested_alerts_are_reported_once_sent(self, mock_client_class, mock_timer):
+        mock_client = mock_client_class.return_value
+        mock_client.send_message.side_effect = [Exception("rate limited"), None]
+        notifier = PushoverNotifier()
+        results = []
+
+        notifier.notify_device_offline("device1", "10.0.0.1", "AABBCCDDEE01", on_result=results.append)
+        notifier.notify_device_offline("device2", "10.0.0.2", "AABBCCDDEE02", on_result=results.append)
+        self.assertEqual(results, [])
+
+        # A failed digest is retried, its alerts are still pending
+        notifier.flush()
+        self.assertEqual(results, [])
+
+        notifier.flush()
+        self.assertEqual(results, [True, True])
+
+    @override_settings(PUSHOVER_CONFIG=PUSHOVER_TEST_CONFIG)
+    def test_digest_disabled_by_default(self, mock_client_class, mock_timer):
+        mock_client = mock_client_class.return_value
+        notifier = PushoverNotifier()
+
+        notifier.notify_device_offline("device1", "10.0.0.1", "AABBCCDDEE01")
+
+        mock_client.send_message.assert_called_once()
+        mock_timer.assert_not_called()
+
+    @override_settings(PUSHOVER_CONFIG=dict(PUSHOVER_TEST_CONFIG, delivery_queue_size=10))
+    def test_delivery_queue_sends_off_caller_thread(self, mock_client_class, mock_timer):
+        mock_client = mock_client_class.return_value
+        notifier = PushoverNotifier()
+        self.addCleanup(notifier.delivery_queue.stop)
+
+        results = []
+
+        # Only queued, the outcome is reported once the worker sent it
+        self.assertFalse(notifier.notify_device_offline("device1", "10.0.0.1", "AABBCCDDEE01", on_result=results.append))
+
+        self.assertTrue(notifier.wait_for_delivery(timeout=5))
+        mock_client.send_message.assert_called_once()
+        self.assertEqual(notifier.delivery_stats()['sent'], 1)
+        self.assertEqual(results, [True])
+
+    @override_settings(PUSHOVER_CONFIG=dict(PUSHOVER_DIGEST_CONFIG, delivery_queue_size=10, delivery_max_attempts=1))
+    def test_dropped_digest_reports_its_alerts_failed(self, mock_client_class, mock_timer):
+        mock_client = mock_client_class.return_value
+        mock_client.send_message.side_effect = Exception("unavailable")
+        notifier = PushoverNotifier()
+        self.addCleanup(notifier.delivery_queue.stop)
+        results = []
+
+        notifier.notify_device_offline("device1", "10.0.0.1", "AABBCCDDEE01", on_result=results.append)
+        notifier.notify_device_offline("device2", "10.0.0.2", "AABBCCDDEE02", on_result=results.append)
+        with self.assertLogs('easy_net_visibility_server.delivery_queue.dead_letter', level='ERROR'):
+            self.assertEqual(notifier.flush(), 1)
+            self.assertTrue(notifier.wait_for_delivery(timeout=5))
+
+        self.assertEqual(results, [False, False])
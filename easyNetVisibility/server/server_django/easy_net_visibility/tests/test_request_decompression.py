@@ -0,0 +1,78 @@
+"""
+Tests for transparent decompression of gzip/zstd request bodies.
+"""
+import gzip
+import json
+from unittest.mock import patch
+
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from easy_net_visibility.request_decompression import RequestDecompressionMiddleware
+from easy_net_visibility_server.models import Device
+from rest_framework.test import APIClient
+
+
+class TestRequestDecompression(TestCase):
+    def setUp(self):
+        User.objects.create_user(username='gzipuser', password='gzippass')
+        self.client = APIClient()
+        self.client.login(username='gzipuser', password='gzippass')
+        self.url = reverse('add_devices')
+
+    def post_encoded(self, body, encoding):
+        return self.client.generic('POST', self.url, body, content_type='application/json',
+                                   HTTP_CONTENT_ENCODING=encoding, HTTP_ACCEPT='application/json')
+
+    def test_gzip_body_is_decompressed(self):
+        payload = {'devices': [{'mac': 'AA:BB:CC:DD:EE:01', 'hostname': 'host1', 'ip': '10.0.0.1', 'vendor': 'V1'}]}
+
+        response = self.post_encoded(gzip.compress(json.dumps(payload).encode()), 'gzip')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(Device.objects.filter(mac='AABBCCDDEE01').exists())
+
+    def test_invalid_gzip_body_is_rejected(self):
+        response = self.post_encoded(b'not gzip at all', 'gzip')
+
+        self.assertEqual(response.status_code, 400)
+
+    def test_unsupported_encoding_is_rejected(self):
+        response = self.post_encoded(b'{}', 'br')
+
+        self.assertEqual(response.status_code, 415)
+
+    @patch.object(RequestDecompressionMiddleware, 'supported_encodings', return_value=('gzip',))
+    def test_zstd_rejected_without_zstandard(self, mock_supported):
+        response = self.post_encoded(b'{}', 'zstd')
+
+        self.assertEqual(response.status_code, 415)
+
+    @override_settings(DATA_UPLOAD_MAX_MEMORY_SIZE=1024)
+    def test_decompressed_size_is_limited(self):
+        # Compresses to a few dozen bytes but expands past the limit
+        body = gzip.compress(b'{"devices": [' + b' ' * 100000 + b']}')
+
+        response = self.post_encoded(body, 'gzip')
+
+        self.assertEqual(response.status_code, 413)
+        self.assertEqual(Device.objects.count(), 0)
+
+    def test_uncompressed_body_still_accepted(self):
+        payload = {'devices': [{'mac': 'AA:BB:CC:DD:EE:02', 'hostname': 'host2', 'ip': '10.0.0.2', 'vendor': 'V2'}]}
+
+        response = self.client.post(self.url, payload, format='json', HTTP_ACCEPT='application/json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(Device.objects.filter(mac='AABBCCDDEE02').exists())
+
+    def test_server_without_decompression_rejects_compressed_body(self):
+        # What an older server answers, the sensor retries such a request uncompressed
+        payload = {'devices': [{'mac': 'AA:BB:CC:DD:EE:03', 'hostname': 'host3', 'ip': '10.0.0.3', 'vendor': 'V3'}]}
+
+        with self.modify_settings(MIDDLEWARE={'remove': 'easy_net_visibility.request_decompression.RequestDecompressionMiddleware'}):
+            response = self.post_encoded(gzip.compress(json.dumps(payload).encode()), 'gzip')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'error': 'Invalid JSON body.'})
+        self.assertFalse(Device.objects.exists())
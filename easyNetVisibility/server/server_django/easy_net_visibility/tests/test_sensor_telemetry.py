@@ -0,0 +1,168 @@
+"""
+Tests for the hourly rollup of sensor health stats.
+"""
+import datetime
+
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from easy_net_visibility_server import sensor_telemetry
+from easy_net_visibility_server.models import Sensor, SensorStats
+from rest_framework.test import APIClient
+
+_HOUR = datetime.datetime(2026, 3, 1, 10, 0, 0)
+
+
+def _metrics(cycles=1, failures=0, bytes_sent=100, cpu_seconds=1.0, rss_bytes=50 * 1024 * 1024, spool_depth=0,
+             duration=2.0, found=5, started_at='2026-03-01T09:00:00+00:00', updated_at=None):
+    return {
+        'started_at': started_at,
+        'updated_at': updated_at,
+        'loops': {
+            'device_scan': {'cycles': cycles, 'failures': failures, 'upload_failures': 0, 'bytes_sent': bytes_sent,
+                            'last_duration_seconds': duration, 'last_found': found},
+        },
+        'process': {'rss_bytes': rss_bytes, 'cpu_seconds': cpu_seconds},
+        'spool_depth': spool_depth,
+    }
+
+
+class TestSensorTelemetry(TestCase):
+    def setUp(self):
+        self.sensor = Sensor.objects.create(mac='AABBCCDDEE01', hostname='sensor1',
+                                            first_seen=timezone.now(), last_seen=timezone.now())
+
+    def test_reports_in_the_same_hour_are_folded_into_one_row(self):
+        sensor_telemetry.record_health(self.sensor, _metrics(cycles=3, bytes_sent=300, cpu_seconds=2.0),
+                                       now=_HOUR + datetime.timedelta(minutes=5))
+        sensor_telemetry.record_health(self.sensor, _metrics(cycles=5, bytes_sent=700, cpu_seconds=3.5, duration=4.0,
+                                                             found=7, rss_bytes=60 * 1024 * 1024, spool_depth=3),
+                                       now=_HOUR + datetime.timedelta(minutes=10))
+        sensor_telemetry.record_health(self.sensor, _metrics(cycles=6, bytes_sent=800, cpu_seconds=4.0, duration=1.0),
+                                       now=_HOUR + datetime.timedelta(minutes=15))
+
+        row = SensorStats.objects.get(sensor=self.sensor)
+        self.assertEqual(row.hour, _HOUR)
+        self.assertEqual(row.reports, 3)
+        self.assertEqual(row.loops['device_scan']['cycles'], 6)
+        self.assertEqual(row.loops['device_scan']['bytes_sent'], 800)
+        self.assertEqual(row.loops['device_scan']['max_duration_seconds'], 4.0)
+        self.assertEqual(row.loops['device_scan']['found'], 5)
+        self.assertAlmostEqual(row.cpu_seconds, 4.0)
+        self.assertEqual(row.rss_bytes_max, 60 * 1024 * 1024)
+        self.assertEqual(row.spool_depth_max, 3)
+
+    def test_a_new_hour_counts_the_increase_since_the_previous_report(self):
+        sensor_telemetry.record_health(self.sensor, _metrics(cycles=10, cpu_seconds=5.0),
+                                       now=_HOUR + datetime.timedelta(minutes=55))
+        sensor_telemetry.record_health(self.sensor, _metrics(cycles=12, cpu_seconds=6.5, failures=1),
+                                       now=_HOUR + datetime.timedelta(minutes=65))
+
+        rows = list(SensorStats.objects.filter(sensor=self.sensor).order_by('hour'))
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(rows[1].hour, _HOUR + datetime.timedelta(hours=1))
+        self.assertEqual(rows[1].loops['device_scan']['cycles'], 2)
+        self.assertEqual(rows[1].loops['device_scan']['failures'], 1)
+        self.assertAlmostEqual(rows[1].cpu_seconds, 1.5)
+
+    def test_sensor_restart_counts_from_zero(self):
+        sensor_telemetry.record_health(self.sensor, _metrics(cycles=10, cpu_seconds=5.0),
+                                       now=_HOUR + datetime.timedelta(minutes=5))
+        sensor_telemetry.record_health(self.sensor, _metrics(cycles=2, cpu_seconds=0.5,
+                                                             started_at='2026-03-01T10:20:00+00:00'),
+                                       now=_HOUR + datetime.timedelta(minutes=25))
+
+        row = SensorStats.objects.get(sensor=self.sensor)
+        self.assertEqual(row.loops['device_scan']['cycles'], 12)
+        self.assertAlmostEqual(row.cpu_seconds, 5.5)
+
+    def test_out_of_order_report_is_ignored(self):
+        for minute, cycles in ((5, 5), (10, 8), (2, 3), (15, 13)):
+            sensor_telemetry.record_health(self.sensor, _metrics(cycles=cycles, updated_at=f'2026-03-01T10:{minute:02d}:00+00:00'),
+                                           now=_HOUR + datetime.timedelta(minutes=20))
+
+        row = SensorStats.objects.get(sensor=self.sensor)
+        self.assertEqual(row.loops['device_scan']['cycles'], 13)
+        self.assertEqual(row.reports, 3)
+
+    def test_report_of_a_previous_process_is_ignored(self):
+        sensor_telemetry.record_health(self.sensor, _metrics(cycles=2, started_at='2026-03-01T10:20:00+00:00',
+                                                             updated_at='2026-03-01T10:25:00+00:00'),
+                                       now=_HOUR + datetime.timedelta(minutes=30))
+        sensor_telemetry.record_health(self.sensor, _metrics(cycles=10, updated_at='2026-03-01T10:15:00+00:00'),
+                                       now=_HOUR + datetime.timedelta(minutes=31))
+
+        row = SensorStats.objects.get(sensor=self.sensor)
+        self.assertEqual(row.loops['device_scan']['cycles'], 2)
+
+    def test_invalid_metrics_are_ignored(self):
+        sensor_telemetry.record_health(self.sensor, 'not a dict', now=_HOUR)
+        self.assertFalse(SensorStats.objects.exists())
+
+        sensor_telemetry.record_health(self.sensor, {'loops': {'scan': {'cycles': 'many', 'bytes_sent': -5}, 'bad': 3},
+                                                     'process': {'cpu_seconds': float('nan')}, 'spool_depth': True},
+                                       now=_HOUR)
+
+        row = SensorStats.objects.get(sensor=self.sensor)
+        self.assertEqual(row.loops, {'scan': {'cycles': 0, 'failures': 0, 'upload_failures': 0, 'bytes_sent': 0,
+                                              'max_duration_seconds': None}})
+        self.assertEqual(row.cpu_seconds, 0)
+        self.assertIsNone(row.spool_depth_max)
+
+    @override_settings(SENSOR_STATS_RETENTION_DAYS=7)
+    def test_purge_expired_keeps_the_retention_period(self):
+        now = timezone.now()
+        SensorStats.objects.create(sensor=self.sensor, hour=now - datetime.timedelta(days=8), loops={}, totals={})
+        SensorStats.objects.create(sensor=self.sensor, hour=now - datetime.timedelta(days=6), loops={}, totals={})
+
+        self.assertEqual(sensor_telemetry.purge_expired(now=now), 1)
+        self.assertEqual(SensorStats.objects.count(), 1)
+
+    def test_recent_trends_returns_the_last_hours_oldest_first(self):
+        now = timezone.now().replace(minute=30)
+        hour = now.replace(minute=0, second=0, microsecond=0)
+        for hours_ago in (30, 2, 1):
+            SensorStats.objects.create(sensor=self.sensor, hour=hour - datetime.timedelta(hours=hours_ago),
+                                       rss_bytes_max=3 * 1024 * 1024, loops={'b': {}, 'a': {}}, totals={})
+
+        trend = sensor_telemetry.recent_trends([self.sensor], now=now)[self.sensor.id]
+
+        self.assertEqual([row.hour for row in trend], [hour - datetime.timedelta(hours=2), hour - datetime.timedelta(hours=1)])
+        self.assertEqual([name for name, _ in trend[0].loop_list], ['a', 'b'])
+        self.assertEqual(trend[0].rss_mb, 3.0)
+
+
+class TestSensorTelemetryViews(TestCase):
+    def setUp(self):
+        User.objects.create_user(username='apiuser', password='apipass')
+        self.client = APIClient()
+        self.client.login(username='apiuser', password='apipass')
+
+    def test_sensor_health_stores_the_reported_metrics(self):
+        payload = {'mac': 'AA:BB:CC:DD:EE:30', 'hostname': 'sensorStats', 'metrics': _metrics(cycles=4)}
+
+        response = self.client.post(reverse('sensor_health'), payload, format='json', HTTP_ACCEPT='application/json')
+
+        self.assertEqual(response.status_code, 200)
+        row = SensorStats.objects.get(sensor__hostname='sensorStats')
+        self.assertEqual(row.loops['device_scan']['cycles'], 4)
+
+    def test_sensor_health_without_metrics_still_succeeds(self):
+        payload = {'mac': 'AA:BB:CC:DD:EE:31', 'hostname': 'sensorNoStats'}
+
+        response = self.client.post(reverse('sensor_health'), payload, format='json', HTTP_ACCEPT='application/json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(SensorStats.objects.exists())
+
+    def test_status_page_shows_the_trend(self):
+        sensor = Sensor.objects.create(mac='AABBCCDDEE32', hostname='sensorTrend',
+                                       first_seen=timezone.now(), last_seen=timezone.now())
+        sensor_telemetry.record_health(sensor, _metrics(found=42))
+
+        response = self.client.get(reverse('status'))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Last 24 hours')
+        self.assertContains(response, 'device_scan')
@@ -0,0 +1,128 @@
+"""
+Tests for write coalescing of repeated device and port reports.
+"""
+import datetime
+
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from easy_net_visibility_server import write_coalescing
+from easy_net_visibility_server.api_views import _create_device_obj_from_data, _upsert_devices, _upsert_ports
+from easy_net_visibility_server.models import Device, Port
+
+DEVICE_DATA = {'mac': 'AA:BB:CC:DD:EE:01', 'hostname': 'host1', 'ip': '10.0.0.1', 'vendor': 'V1'}
+PORT_DATA = {'mac': 'AA:BB:CC:DD:EE:01', 'port': 22, 'protocol': 'TCP', 'name': 'ssh', 'product': 'OpenSSH', 'version': '9.6'}
+
+
+@override_settings(WRITE_COALESCING={'device_seconds': 120, 'port_seconds': 600})
+class TestWriteCoalescing(TestCase):
+    def setUp(self):
+        cache.clear()
+        write_coalescing.get_write_counters().reset()
+
+    def tearDown(self):
+        cache.clear()
+        write_coalescing.get_write_counters().reset()
+
+    def _upsert_device(self, **changes):
+        with self.captureOnCommitCallbacks(execute=True):
+            return _upsert_devices([_create_device_obj_from_data(dict(DEVICE_DATA, **changes))])
+
+    def _upsert_port(self, **changes):
+        with self.captureOnCommitCallbacks(execute=True):
+            return _upsert_ports([dict(PORT_DATA, **changes)])
+
+    def test_repeated_device_skips_database(self):
+        self._upsert_device()
+
+        with CaptureQueriesContext(connection) as ctx:
+            results = self._upsert_device()
+
+        self.assertEqual(results, [(200, None)])
+        self.assertEqual(len(ctx.captured_queries), 0)
+        self.assertEqual(write_coalescing.get_write_counters().snapshot()['device'],
+                         {'written': 1, 'coalesced': 1, 'coalesced_percent': 50.0})
+
+    def test_changed_device_is_written(self):
+        self._upsert_device()
+
+        self._upsert_device(ip='10.0.0.2')
+
+        self.assertEqual(Device.objects.get(mac='AABBCCDDEE01').ip, '10.0.0.2')
+        self.assertEqual(write_coalescing.get_write_counters().snapshot()['device']['written'], 2)
+
+    def test_fresh_device_in_database_is_not_rewritten(self):
+        last_seen = datetime.datetime.now() - datetime.timedelta(seconds=30)
+        Device.objects.create(mac='AABBCCDDEE01', hostname='host1', ip='10.0.0.1', vendor='V1',
+                              first_seen=last_seen, last_seen=last_seen)
+
+        self._upsert_device()
+
+        self.assertEqual(Device.objects.get(mac='AABBCCDDEE01').last_seen, last_seen)
+        self.assertEqual(write_coalescing.get_write_counters().snapshot()['device']['coalesced'], 1)
+
+    @override_settings(WRITE_COALESCING={'device_seconds': 0})
+    def test_disabled(self):
+        self._upsert_device()
+
+        with CaptureQueriesContext(connection) as ctx:
+            self._upsert_device()
+
+        self.assertGreater(len(ctx.captured_queries), 0)
+        self.assertEqual(write_coalescing.get_write_counters().snapshot()['device']['written'], 2)
+
+    def test_failed_transaction_is_not_remembered(self):
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            _upsert_devices([_create_device_obj_from_data(DEVICE_DATA)])
+
+        # The commit never happened, so nothing may be coalesced against it
+        self.assertTrue(callbacks)
+        self.assertEqual(write_coalescing.unchanged_keys('device', {'AABBCCDDEE01': ('host1', '10.0.0.1', 'V1')}), set())
+
+    def test_repeated_port_skips_database(self):
+        self._upsert_device()
+        self._upsert_port()
+
+        with CaptureQueriesContext(connection) as ctx:
+            results = self._upsert_port()
+
+        self.assertEqual(results, [(200, None)])
+        self.assertEqual(len(ctx.captured_queries), 0)
+
+    def test_changed_port_is_written(self):
+        self._upsert_device()
+        self._upsert_port()
+
+        self._upsert_port(version='9.7')
+
+        self.assertEqual(Port.objects.get(port_num=22).version, '9.7')
+
+    def test_deleted_device_and_its_ports_are_forgotten(self):
+        self._upsert_device()
+        self._upsert_port()
+        Device.objects.get(mac='AABBCCDDEE01').delete()
+
+        self._upsert_device()
+        self._upsert_port()
+
+        self.assertTrue(Device.objects.filter(mac='AABBCCDDEE01').exists())
+        self.assertTrue(Port.objects.filter(device__mac='AABBCCDDEE01', port_num=22).exists())
+
+    def test_deleted_port_is_forgotten(self):
+        self._upsert_device()
+        self._upsert_port()
+        Port.objects.all().delete()
+
+        self._upsert_port()
+
+        self.assertTrue(Port.objects.filter(port_num=22).exists())
+
+    def test_fresh_device_with_a_new_vendor_is_written(self):
+        last_seen = datetime.datetime.now() - datetime.timedelta(seconds=30)
+        Device.objects.create(mac='AABBCCDDEE01', hostname='host1', ip='10.0.0.1', vendor='V1',
+                              first_seen=last_seen, last_seen=last_seen)
+
+        self._upsert_device(vendor='V2')
+
+        self.assertEqual(Device.objects.get(mac='AABBCCDDEE01').vendor, 'V2')
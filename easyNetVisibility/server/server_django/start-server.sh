@@ -7,5 +7,10 @@ export PRODUCTION=1
 if [ -n "$DJANGO_SUPERUSER_USERNAME" ] && [ -n "$DJANGO_SUPERUSER_PASSWORD" ] ; then
     (cd easy_net_visibility; runuser -u www-data -- python manage.py createsuperuser --no-input)
 fi
-(cd easy_net_visibility; gunicorn easy_net_visibility.wsgi --user www-data --bind 0.0.0.0:8010 --workers 3) &
+
+# The gunicorn workers share their Prometheus metrics through this directory, emptied on every start
+export PROMETHEUS_MULTIPROC_DIR=/tmp/easy_net_visibility_metrics
+rm -rf "$PROMETHEUS_MULTIPROC_DIR" && mkdir -p "$PROMETHEUS_MULTIPROC_DIR" && chown www-data "$PROMETHEUS_MULTIPROC_DIR"
+
+(cd easy_net_visibility; gunicorn easy_net_visibility.wsgi --config gunicorn.conf.py --user www-data --bind 0.0.0.0:8010 --workers 3) &
 nginx -g "daemon off;"
\ No newline at end of file